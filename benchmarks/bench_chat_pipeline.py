@@ -0,0 +1,218 @@
+# benchmarks/bench_chat_pipeline.py
+"""
+端到端对话延迟基准：真实的 ChatManager / QwenVisionClient 管线 + 本地模拟后端（不联网、不花钱）
+用法：python benchmarks/bench_chat_pipeline.py [--requests 50] [--concurrency 1] [--no-stream]
+                                              [--first-token-ms 300] [--tokens-per-s 40] [--fail-prob 0]
+                                              [--vision-every 5] [--screen 1920x1080] [--with-knowledge]
+                                              [--budget-p95-ms 0]
+- 对话：ChatManager.chat()，与桌宠一样走历史裁剪、提示词组装、流式解析、端点路由
+- 视觉：每 --vision-every 轮做一次「读截图 → QwenVisionClient.describe_image → send_screen_observation」，
+  截图是按 --screen 分辨率生成的 PNG（标准库编码，不依赖 Pillow / mss / 显示器）
+- 报告首字延迟与总耗时的 p50 / p95 / p99、吞吐（请求/s、输出字/s），以及模拟后端收到的提示词规模
+- 默认不加载知识库（knowledge.when_loading=skip），只测管线本身；--with-knowledge 先等索引就绪再测
+- --concurrency N：N 个线程各自一个 ChatManager 同时发请求（共享连接池），测吞吐
+- --budget-p95-ms：对话总耗时 p95 超出预算、或有失败请求时以非零状态退出，方便发现回归
+- 设置写入临时目录，对话日志与滚动摘要关闭，不碰 config/settings.json
+"""
+import argparse
+import contextlib
+import io
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from mock_openai_server import MockBackend
+from settings_manager import SettingsManager
+from llm.chat_manager import ChatManager
+from vision.qwen_vision import QwenVisionClient
+
+USER_TURNS = ["早上好", "今天要写一整天的代码", "你还记得迦尔纳吗", "讲讲因陀罗的雷杵", "晚上想看部电影", "晚安"]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def write_screenshot_png(path: Path, width: int, height: int, seed: int = 0):
+    """生成一张「像截图」的 PNG：大块纯色窗口 + 一块噪声区域（模拟视频 / 图片），体积接近真实截图"""
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = (30, 30, 36)
+    img[: height // 24] = (60, 60, 70)  # 标题栏
+    img[:, : width // 6] = (45, 48, 56)  # 侧边栏
+    for row in range(height // 12, height, 22):  # 一行行「文字」
+        img[row:row + 8, width // 5: width // 5 + int(rng.integers(width // 8, width // 2))] = (200, 200, 200)
+    h0, w0 = height // 2, width // 2
+    img[h0:, w0:] = rng.integers(0, 256, size=(height - h0, width - w0, 3), dtype=np.uint8)
+
+    raw = b"".join(b"\x00" + img[y].tobytes() for y in range(height))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    path.write_bytes(
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _make_manager(tmp: Path, name: str, backend: MockBackend, stream: bool, with_knowledge: bool) -> ChatManager:
+    sm = SettingsManager(str(tmp / f"{name}.json"))
+    sm.set("llm", "provider", value="openai")
+    sm.set("llm", "base_url", value=backend.url)
+    sm.set("llm", "api_key", value="sk-mock")
+    sm.set("llm", "model", value="mock-model")
+    sm.set("llm", "stream", value=stream)
+    sm.set("memory", "enabled", value=False)
+    sm.set("summary", "enabled", value=False)
+    sm.set("knowledge", "when_loading", value="wait" if with_knowledge else "skip")
+    manager = ChatManager(sm, "src/llm/persona.txt", autostart=with_knowledge)
+    if with_knowledge:
+        manager.wait_until_ready()
+    return manager
+
+
+class Sample:
+    __slots__ = ("kind", "first_token_s", "total_s", "vision_s", "chars", "ok")
+
+    def __init__(self, kind: str, first_token_s: float, total_s: float, vision_s: float, chars: int, ok: bool):
+        self.kind = kind
+        self.first_token_s = first_token_s
+        self.total_s = total_s
+        self.vision_s = vision_s
+        self.chars = chars
+        self.ok = ok
+
+
+def _one_turn(manager: ChatManager, vision: QwenVisionClient | None, screenshot: Path | None, i: int) -> Sample:
+    first = []
+    on_delta = lambda _t: first or first.append(time.perf_counter())
+    started = time.perf_counter()
+    vision_s = 0.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        if vision is not None:
+            try:
+                description = vision.describe_image(screenshot)
+            except Exception:
+                description = ""
+            vision_s = time.perf_counter() - started
+            reply = manager.send_screen_observation(description, on_delta=on_delta) if description else None
+        else:
+            reply = manager.chat(USER_TURNS[i % len(USER_TURNS)], on_delta=on_delta)
+    end = time.perf_counter()
+    return Sample("vision" if vision else "chat", (first[0] if first else end) - started, end - started,
+                  vision_s, len(reply or ""), bool(reply))
+
+
+def _run_worker(manager: ChatManager, vision: QwenVisionClient, screenshot: Path, n: int, vision_every: int,
+                out: list[Sample], lock: threading.Lock):
+    for i in range(n):
+        use_vision = vision_every > 0 and (i + 1) % vision_every == 0
+        sample = _one_turn(manager, vision if use_vision else None, screenshot if use_vision else None, i)
+        with lock:
+            out.append(sample)
+
+
+def _report(label: str, samples: list[Sample]):
+    ok = [s for s in samples if s.ok]
+    fields = [f"{len(samples)} 次，失败 {len(samples) - len(ok)}"]
+    if ok:
+        for name, values in (("首字", [s.first_token_s for s in ok]), ("总耗时", [s.total_s for s in ok])):
+            fields.append(name + " " + " / ".join(
+                f"p{int(q * 100)} {_percentile(values, q) * 1e3:.0f}ms" for q in (0.5, 0.95, 0.99)))
+        if label == "视觉":
+            fields.append(f"识图 p50 {_percentile([s.vision_s for s in ok], 0.5) * 1e3:.0f}ms")
+    print(f"{label:<4}" + " | ".join(fields))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50, help="每个并发线程的请求数")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-s", type=float, default=200)
+    parser.add_argument("--reply-chars", type=int, default=60)
+    parser.add_argument("--fail-prob", type=float, default=0.0)
+    parser.add_argument("--vision-every", type=int, default=5, help="每隔几轮做一次截图评论，0 表示不测视觉")
+    parser.add_argument("--screen", default="1920x1080")
+    parser.add_argument("--with-knowledge", action="store_true")
+    parser.add_argument("--budget-p95-ms", type=float, default=0, help="对话总耗时 p95 预算，0 表示不检查")
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.screen.lower().split("x"))
+
+    backend = MockBackend(
+        "mock", first_token_s=args.first_token_ms / 1e3, tokens_per_s=args.tokens_per_s,
+        reply_chars=args.reply_chars, fail_prob=args.fail_prob, seed=0,
+    ).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            screenshot = tmp / "screenshot.png"
+            write_screenshot_png(screenshot, width, height)
+            print(f"模拟后端 {backend.url} | 首字 {args.first_token_ms:.0f}ms，{args.tokens_per_s:.0f} tokens/s，"
+                  f"回复 {args.reply_chars} 字 | 截图 {width}x{height} {screenshot.stat().st_size / 2 ** 20:.2f} MB")
+
+            t0 = time.perf_counter()
+            managers = [_make_manager(tmp, f"w{i}", backend, not args.no_stream, args.with_knowledge)
+                        for i in range(args.concurrency)]
+            if args.with_knowledge:
+                print(f"索引就绪 {time.perf_counter() - t0:.1f}s")
+            vision = QwenVisionClient(f"{backend.url}/v1/chat/completions", "sk-mock", "mock-vl")
+
+            samples: list[Sample] = []
+            lock = threading.Lock()
+            started = time.perf_counter()
+            threads = [
+                threading.Thread(target=_run_worker,
+                                 args=(m, vision, screenshot, args.requests, args.vision_every, samples, lock))
+                for m in managers
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            wall = time.perf_counter() - started
+    finally:
+        backend.stop()
+
+    chat = [s for s in samples if s.kind == "chat"]
+    seen = [s for s in samples if s.kind == "vision"]
+    _report("对话", chat)
+    if seen:
+        _report("视觉", seen)
+    print(f"吞吐 {len(samples) / wall:.1f} 轮/s，输出 {sum(s.chars for s in samples) / wall:.0f} 字/s"
+          f"（{args.concurrency} 并发，墙钟 {wall:.1f}s）")
+
+    text_records = [r for r in backend.records if not r.images]
+    image_records = [r for r in backend.records if r.images]
+    if text_records:
+        chars = [r.prompt_chars for r in text_records]
+        msgs = [r.messages for r in text_records]
+        print(f"提示词 p50 {_percentile(chars, 0.5)} 字 / max {max(chars)} 字，消息 p50 {_percentile(msgs, 0.5)} 条"
+              f" / max {max(msgs)} 条（{len(text_records)} 个请求）")
+    if image_records:
+        print(f"识图请求 {len(image_records)} 个，图片 p50 {_percentile([r.image_bytes for r in image_records], 0.5) / 1024:.0f} KB")
+
+    if args.budget_p95_ms > 0:
+        ok = [s.total_s for s in chat if s.ok]
+        if len(ok) < len(chat) or not ok or _percentile(ok, 0.95) * 1e3 > args.budget_p95_ms:
+            print(f"对话总耗时 p95 超出预算 {args.budget_p95_ms:.0f}ms（或出现失败请求）")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# benchmarks/bench_embedding_backend.py
+"""
+Embedding 后端对比：torch（HuggingFaceEmbedding） vs onnx（onnxruntime）
+- 每个后端在独立子进程中测量：导入+加载耗时、单条查询延迟（p50/p95）、批量编码吞吐、常驻内存，
+  以及进程里是否加载了 torch（onnx 后端不应加载，加载了说明有导入把 torch 带了进来）
+- 最后比较两个后端对同一批文本的向量（余弦相似度），确认与已持久化索引兼容
+- 仓库里的模型文件经 git-lfs 管理，只拉了指针文件时模型加载会失败；先 git lfs pull，或用 --model 指向完整的模型目录
+用法：python benchmarks/bench_embedding_backend.py [--backends torch onnx] [--queries 50] [--model DIR]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+SAMPLE_QUERIES = [
+    "因陀罗是谁",
+    "阿周那和迦尔纳的关系",
+    "你好",
+    "今天的天气不错",
+    "インドラは雷の神です",
+    "用户正在看视频，画面里是一场足球比赛",
+    "帝释天的神弓",
+    "御主在写代码，屏幕上是 VS Code 和一个终端窗口",
+]
+
+
+def _rss_mb() -> float:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        import resource
+        # Linux 下 ru_maxrss 单位为 KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load_lore_passages(limit: int) -> list[str]:
+    lore_dir = ROOT / "src" / "llm" / "knowledge" / "lore"
+    passages = []
+    for path in sorted(lore_dir.glob("*.txt")):
+        text = path.read_text(encoding="utf-8", errors="ignore")
+        for para in text.split("\n\n"):
+            para = para.strip()
+            if len(para) > 50:
+                passages.append(para[:1000])
+            if len(passages) >= limit:
+                return passages
+    return passages
+
+
+def run_worker(backend: str, n_queries: int, out_path: str, model_dir: str):
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    rss_before = _rss_mb()
+
+    t0 = time.perf_counter()
+    from llm.embedding_backends import create_embed_model
+    model = create_embed_model(backend, model_dir)
+    load_s = time.perf_counter() - t0
+    rss_loaded = _rss_mb()
+
+    # 预热
+    model.get_query_embedding("预热")
+
+    latencies = []
+    for i in range(n_queries):
+        q = SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] + f" {i}"
+        t = time.perf_counter()
+        model.get_query_embedding(q)
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    passages = _load_lore_passages(64)
+    t = time.perf_counter()
+    model.get_text_embedding_batch(passages)
+    batch_s = time.perf_counter() - t
+
+    compare_vectors = [model.get_query_embedding(q) for q in SAMPLE_QUERIES]
+    compare_vectors += model.get_text_embedding_batch(passages[:8])
+
+    latencies.sort()
+    result = {
+        "backend": backend,
+        "load_s": load_s,
+        "rss_before_mb": rss_before,
+        "rss_loaded_mb": rss_loaded,
+        "rss_after_mb": _rss_mb(),
+        "query_p50_ms": statistics.median(latencies),
+        "query_p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "batch_passages": len(passages),
+        "batch_per_s": len(passages) / batch_s if batch_s else 0.0,
+        "torch_loaded": "torch" in sys.modules,
+        "vectors": compare_vectors,
+    }
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--model", default=str(ROOT / "multilingual-e5-small"), help="模型目录")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.queries, args.out, args.model)
+        return
+
+    results = {}
+    for backend in args.backends:
+        out_path = Path(tempfile.gettempdir()) / f"bench_embedding_{backend}.json"
+        proc = subprocess.run(
+            [sys.executable, __file__, "--worker", backend, "--queries", str(args.queries), "--out", str(out_path),
+             "--model", args.model],
+        )
+        if proc.returncode != 0 or not out_path.exists():
+            print(f"[bench] {backend} 后端运行失败（返回码 {proc.returncode}）")
+            continue
+        with open(out_path, "r", encoding="utf-8") as f:
+            results[backend] = json.load(f)
+        out_path.unlink()
+
+    print()
+    print(f"{'后端':<8}{'加载 s':>10}{'内存 MB':>10}{'查询 p50 ms':>14}{'查询 p95 ms':>14}{'批量 条/s':>12}{'torch':>8}")
+    for backend, r in results.items():
+        print(
+            f"{backend:<8}{r['load_s']:>10.2f}{r['rss_after_mb']:>10.0f}"
+            f"{r['query_p50_ms']:>14.2f}{r['query_p95_ms']:>14.2f}{r['batch_per_s']:>12.1f}"
+            f"{'已加载' if r['torch_loaded'] else '-':>8}"
+        )
+    if results.get("onnx", {}).get("torch_loaded"):
+        print("⚠️ onnx 后端的进程里加载了 torch，启动耗时和内存不能代表纯 onnxruntime 推理")
+
+    if "torch" in results and "onnx" in results:
+        sims = [
+            _cosine(a, b)
+            for a, b in zip(results["torch"]["vectors"], results["onnx"]["vectors"])
+        ]
+        print()
+        print(f"向量一致性（torch vs onnx 余弦相似度）：最小 {min(sims):.6f}，平均 {statistics.mean(sims):.6f}")
+
+
+if __name__ == "__main__":
+    main()
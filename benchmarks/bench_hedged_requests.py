@@ -0,0 +1,151 @@
+# benchmarks/bench_hedged_requests.py
+"""
+多端点路由 + 对冲请求的尾延迟测试（本地模拟后端，不联网）
+用法：python benchmarks/bench_hedged_requests.py [--requests 100] [--no-stream]
+- 启动三个模拟后端：primary（偶发慢请求）、flaky（一半请求返回 500）、backup（偶发慢请求，基础延迟稍高）
+- 基线：只配置 primary，关闭对冲；对照：primary + flaky + backup，开启对冲
+- 两组都通过 ChatManager._request_llm 顺序发送同样数量的请求，统计首字延迟与总耗时的 p50 / p95 / p99
+- 对照组的 p95 首字延迟不低于基线、或出现失败请求时以非零状态退出，方便发现回归
+  （p99 只有一两个样本，两个端点同时变慢时会很吵，只报告不判定）
+- 取消检查：一个 30s 才出首字的端点输给备用端点，分别在它等响应头、等首字节时输掉，
+  模拟后端要在胜者返回后 CANCEL_CLOSE_S 内察觉连接被关闭，否则以非零状态退出
+"""
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from mock_openai_server import MockBackend
+from settings_manager import SettingsManager
+from llm.chat_manager import ChatManager
+
+MESSAGES = [{"role": "system", "content": "你是因陀罗。"}, {"role": "user", "content": "早上好"}]
+CANCEL_CLOSE_S = 1.0  # 输掉的一路最晚要在胜者返回后这么久内断开
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _make_manager(tmp: Path, name: str, primary: MockBackend, extras: list[MockBackend], hedge: bool,
+                  stream: bool) -> ChatManager:
+    sm = SettingsManager(str(tmp / f"{name}.json"))
+    sm.set("llm", "provider", value="openai")
+    sm.set("llm", "base_url", value=primary.url)
+    sm.set("llm", "api_key", value="sk-mock")
+    sm.set("llm", "model", value="mock-model")
+    sm.set("llm", "stream", value=stream)
+    sm.set("llm", "hedge", value=hedge)
+    sm.set("llm", "hedge_delay_s", value=0.3)
+    sm.set("llm", "hedge_min_delay_s", value=0.1)
+    sm.set("llm", "endpoints", value=[{"name": b.name, "base_url": b.url} for b in extras])
+    sm.set("llm", "endpoint_cooldown_s", value=5.0)
+    sm.set("memory", "enabled", value=False)
+    return ChatManager(sm, "src/llm/persona.txt", autostart=False)
+
+
+def _run(manager: ChatManager, n: int) -> tuple[list[float], list[float], int]:
+    first_token, total, failed = [], [], 0
+    for _ in range(n):
+        first = []
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            reply = manager._request_llm(MESSAGES, on_delta=lambda _t: first or first.append(time.perf_counter()))
+        end = time.perf_counter()
+        if not reply:
+            failed += 1
+            continue
+        first_token.append((first[0] if first else end) - started)
+        total.append(end - started)
+    return first_token, total, failed
+
+
+def _report(label: str, first_token: list[float], total: list[float], failed: int):
+    fields = [f"失败 {failed}"]
+    for name, values in (("首字", first_token), ("总耗时", total)):
+        if values:
+            fields.append(name + " " + " / ".join(
+                f"p{int(q * 100)} {_percentile(values, q) * 1e3:.0f}ms" for q in (0.5, 0.95, 0.99)))
+    print(f"{label:<8}" + " | ".join(fields))
+
+
+def check_cancel(tmp: Path, stream: bool) -> bool:
+    """慢端点输掉之后，它的连接要被及时关闭，而不是等到读取超时"""
+    cases = [("等首字节", False), ("等响应头", True)] if stream else [("等响应", False)]
+    ok = True
+    for label, delay_headers in cases:
+        slow = MockBackend("slow", first_token_s=30.0, delay_headers=delay_headers).start()
+        fast = MockBackend("fast", first_token_s=0.05).start()
+        try:
+            manager = _make_manager(tmp, f"cancel_{int(delay_headers)}", slow, [fast], hedge=True, stream=stream)
+            with contextlib.redirect_stdout(io.StringIO()):
+                reply = manager._request_llm(MESSAGES)
+            replied = time.perf_counter()
+            while not slow.abort_times and time.perf_counter() - replied < CANCEL_CLOSE_S * 3:
+                time.sleep(0.01)
+            closed_after = slow.abort_times[0] - replied if slow.abort_times else None
+        finally:
+            slow.stop()
+            fast.stop()
+        passed = bool(reply) and closed_after is not None and closed_after <= CANCEL_CLOSE_S
+        ok = ok and passed
+        result = f"胜者返回后 {max(0.0, closed_after) * 1e3:.0f}ms 断开" if closed_after is not None else "连接没有断开"
+        print(f"取消检查（{label}）：{result}{'' if passed else '  ✗'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--no-stream", action="store_true")
+    args = parser.parse_args()
+    stream = not args.no_stream
+
+    backends = {
+        "primary": MockBackend("primary", first_token_s=0.08, slow_prob=0.04, slow_s=1.5, seed=1),
+        "flaky": MockBackend("flaky", first_token_s=0.05, fail_prob=0.5, seed=2),
+        "backup": MockBackend("backup", first_token_s=0.12, slow_prob=0.04, slow_s=1.5, seed=3),
+    }
+    for backend in backends.values():
+        backend.start()
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cancel_ok = check_cancel(Path(tmp), stream)
+            baseline = _make_manager(Path(tmp), "baseline", backends["primary"], [], hedge=False, stream=stream)
+            base = _run(baseline, args.requests)
+            _report("基线", *base)
+
+            routed = _make_manager(Path(tmp), "routed", backends["primary"],
+                                   [backends["flaky"], backends["backup"]], hedge=True, stream=stream)
+            hedged = _run(routed, args.requests)
+            _report("对冲", *hedged)
+
+            for name, st in routed.endpoint_stats().items():
+                ewma = st["latency_ewma_s"]
+                print(f"  {name:<8} 请求 {st['requests']:>3} 失败 {st['failures']:>3} "
+                      f"EWMA {ewma * 1e3 if ewma is not None else float('nan'):.0f}ms")
+            print("  模拟后端：" + "，".join(
+                f"{b.name} 收到 {b.requests} / 中途断开 {b.aborted}" for b in backends.values()))
+    finally:
+        for backend in backends.values():
+            backend.stop()
+
+    if not cancel_ok:
+        print(f"输掉的一路没有在 {CANCEL_CLOSE_S:.0f}s 内关闭连接")
+        sys.exit(1)
+    if hedged[2] or not hedged[0] or _percentile(hedged[0], 0.95) >= _percentile(base[0], 0.95):
+        print("对冲后 p95 首字延迟没有下降（或出现失败请求）")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
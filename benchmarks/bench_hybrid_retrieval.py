@@ -0,0 +1,88 @@
+# benchmarks/bench_hybrid_retrieval.py
+"""
+混合检索微基准：纯向量 / BM25 / 向量 + BM25 融合 的单次查询耗时，以及 BM25 索引的构建耗时与体积
+用法：python benchmarks/bench_hybrid_retrieval.py [--repeat 8]
+- 语料取 src/llm/knowledge/lore 的真实文本（按空行切块，可重复放大规模），
+  向量用随机 384 维单位向量代替（只测耗时，不测质量）
+预期：BM25 查询与向量查询同一量级，融合只比两者之和多出可忽略的排序开销
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from llm.lexical_index import BM25Index, reciprocal_rank_fusion
+from llm.vector_store import MmapVectorStore
+
+QUERIES = ["迦尔纳的铠甲", "因陀罗 阿周那", "黑天 俱卢之野", "坚战 掷骰子", "毗湿摩的誓言", "天帝的雷杵"]
+
+
+def _load_chunks(repeat: int) -> list[str]:
+    chunks = []
+    for file in sorted((ROOT / "src" / "llm" / "knowledge" / "lore").glob("*.txt")):
+        text = file.read_text(encoding="utf-8", errors="ignore")
+        chunks.extend(c.strip() for c in text.split("\n\n") if len(c.strip()) > 50)
+    return chunks * repeat
+
+
+def _time_ms(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=8, help="语料放大倍数")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    texts = _load_chunks(args.repeat)
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((len(texts), 384)).astype(np.float32)
+    store = MmapVectorStore.from_records(texts, [{} for _ in texts], embeddings)
+    query_vecs = {q: rng.standard_normal(384).astype(np.float32) for q in QUERIES}
+
+    t0 = time.perf_counter()
+    lexical = BM25Index.build(texts)
+    build_s = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lexical.save(Path(tmp))
+        size_mb = sum(f.stat().st_size for f in Path(tmp).iterdir()) / 2 ** 20
+        t0 = time.perf_counter()
+        loaded = BM25Index.load(Path(tmp))
+        load_ms = (time.perf_counter() - t0) * 1e3
+
+        def vector_only():
+            for q in QUERIES:
+                store.query(query_vecs[q], top_k=8)
+
+        def bm25_only():
+            for q in QUERIES:
+                loaded.query(q, top_k=8)
+
+        def hybrid():
+            for q in QUERIES:
+                vector_rows = [c.row for c in store.query(query_vecs[q], top_k=8)]
+                lexical_rows = [row for row, _ in loaded.query(q, top_k=8)]
+                reciprocal_rank_fusion([vector_rows, lexical_rows])
+
+        per_query = len(QUERIES)
+        print(f"分块数 {len(texts)}，词项数 {len(lexical.terms)}")
+        print(f"BM25 构建 {build_s:.2f} s，落盘 {size_mb:.1f} MB，加载（mmap）{load_ms:.2f} ms")
+        print(f"{'模式':>8} | {'ms/查询':>8}")
+        print("-" * 22)
+        for name, fn in (("向量", vector_only), ("BM25", bm25_only), ("融合", hybrid)):
+            print(f"{name:>8} | {_time_ms(fn, args.rounds) / per_query:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_memory_recall.py
+"""
+对话日志召回基准：日志增长到 1k / 10k / 100k 轮时的写入吞吐与召回延迟
+用法：python benchmarks/bench_memory_recall.py [--sizes 1000 10000 100000] [--embed]
+- 对话内容取 src/llm/knowledge/lore 的真实句子拼成，查询取其中的人名 / 短语
+- 写入走 ConversationLog.append（只入队）+ 后台写线程批量提交，报告入队耗时与落盘吞吐
+- 召回分别报告不设上限时的 p50 / p95，以及默认 50ms 上限下被跳过的比例
+- --embed：每轮附带随机 384 维向量（只测重排开销，不测质量）
+"""
+import argparse
+import contextlib
+import io
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from memory.conversation_log import ConversationLog
+
+QUERIES = ["迦尔纳的铠甲", "因陀罗 阿周那", "黑天", "坚战 掷骰子", "毗湿摩的誓言", "天帝的雷杵", "今天天气怎么样"]
+
+
+def _load_sentences() -> list[str]:
+    sentences = []
+    for file in sorted((ROOT / "src" / "llm" / "knowledge" / "lore").glob("*.txt")):
+        text = file.read_text(encoding="utf-8", errors="ignore")
+        sentences.extend(s.strip() for s in text.replace("\n", "。").split("。") if 8 <= len(s.strip()) <= 120)
+    return sentences
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--rounds", type=int, default=20, help="每个查询重复次数")
+    parser.add_argument("--embed", action="store_true")
+    args = parser.parse_args()
+
+    sentences = _load_sentences()
+    rng = random.Random(0)
+    vec_rng = np.random.default_rng(0)
+    embed_fn = (lambda _text: vec_rng.standard_normal(384).astype(np.float32)) if args.embed else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = ConversationLog(Path(tmp) / "conversation.db", batch_size=256, embed_fn=embed_fn)
+        written = 0
+        for size in sorted(args.sizes):
+            n = size - written
+            t0 = time.perf_counter()
+            for i in range(n):
+                content = "。".join(rng.sample(sentences, k=rng.randint(1, 3)))
+                log.append("user" if (written + i) % 2 == 0 else "assistant", content)
+            enqueue_s = time.perf_counter() - t0
+            log.flush()
+            flush_s = time.perf_counter() - t0
+            written = size
+            db_mb = sum(f.stat().st_size for f in Path(tmp).iterdir()) / 2 ** 20
+
+            query_vec = vec_rng.standard_normal(384) if args.embed else None
+            latencies, skipped = [], 0
+            for _ in range(args.rounds):
+                for q in QUERIES:
+                    t = time.perf_counter()
+                    log.recall(q, top_k=2, timeout_ms=10_000, query_embedding=query_vec)
+                    latencies.append(time.perf_counter() - t)
+                    with contextlib.redirect_stdout(io.StringIO()) as out:
+                        log.recall(q, top_k=2, timeout_ms=50, query_embedding=query_vec)
+                    skipped += "超过" in out.getvalue()
+
+            print(f"{size:>7} 轮 | 入队 {n / max(enqueue_s, 1e-9) / 1e3:.0f}k 条/s，"
+                  f"落盘 {n / flush_s:.0f} 条/s，库 {db_mb:.1f} MB | "
+                  f"召回 p50 {_percentile(latencies, 0.5) * 1e3:.1f}ms / p95 {_percentile(latencies, 0.95) * 1e3:.1f}ms | "
+                  f"50ms 上限跳过 {skipped}/{len(latencies)}")
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# benchmarks/bench_retrieval_quality.py
+"""
+剧情检索质量 + 延迟基准：黄金查询集（benchmarks/retrieval_golden.yaml）× 检索参数组合
+用法：python benchmarks/bench_retrieval_quality.py [--backend onnx|torch|mock] [--model 模型目录] [--repeat 3]
+                                                   [--report report.md]
+                                                   [--sweep chunk_size=600,1000,1400 top_k=8,12 cutoff=0.2 ...]
+                                                   [--min-mrr 0]
+- 检索走 ChatManager._search_lore / _select_lore，与桌宠每轮对话完全相同（实体路由、向量 + BM25 融合、MMR）
+- 指标：recall@k（期望文件里被前 k 个候选覆盖的比例，取平均）、MRR（第一个相关分块排名的倒数）、
+  R@n 排名 / R@n 入选（n = lore_top_n：排名前 n 条、与 _select_lore 经 MMR 真正放进提示词的 n 条各自覆盖期望文件的比例，
+  两者之差就是 MMR 这一步的得失）、单次查询延迟（冷：含查询嵌入；热：查询向量已缓存）、
+  索引构建耗时与落盘体积，以及实体路由的识别准确率
+- --sweep：knowledge.* 设置的候选值，做笛卡尔积；chunk_size / chunk_overlap / top_k / cutoff 分别是
+  lore_chunk_size / lore_chunk_overlap / similarity_top_k / similarity_cutoff 的简写，其余直接写设置名
+  （lore_top_n、mmr_lambda、rrf_k、retrieval_mode、entity_routing、dedup ...）；
+  分块参数相同的组合共用一次索引构建
+- --report：写一份 Markdown 对比报告（汇总表 + 每条查询在各组合下的首个命中排名）
+- mock 后端用 HashEmbedding：CJK 2-gram 特征哈希成 384 维向量，确定、无需模型文件，但只反映字面重合，
+  没有语义（向量一路约等于另一份 BM25），用来快速检查流水线；质量对比请用 onnx / torch
+- 索引写到临时目录，设置写入临时文件，不影响 src/llm/knowledge_db 与 config/settings.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import yaml
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from settings_manager import DEFAULTS, SettingsManager
+from llm.chat_manager import ChatManager, IndexSpec
+from llm.embedding_cache import QueryEmbeddingCache
+from llm.lexical_index import term_hash, tokenize
+
+LORE_DIR = ROOT / "src" / "llm" / "knowledge" / "lore"
+K_VALUES = (1, 3, 5, 8)
+SWEEP_ALIASES = {
+    "chunk_size": "lore_chunk_size",
+    "chunk_overlap": "lore_chunk_overlap",
+    "top_k": "similarity_top_k",
+    "cutoff": "similarity_cutoff",
+}
+# 这些设置决定索引内容，改变时需要重新构建；其余只影响查询
+BUILD_KEYS = ("lore_chunk_size", "lore_chunk_overlap", "dedup", "dedup_threshold", "vector_dtype")
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _parse_sweep(items: list[str]) -> dict[str, list]:
+    sweep = {}
+    for item in items:
+        key, _, values = item.partition("=")
+        key = SWEEP_ALIASES.get(key.strip(), key.strip())
+        if key not in DEFAULTS["knowledge"]:
+            raise SystemExit(f"未知的 knowledge 设置：{key}")
+        parsed = []
+        for v in values.split(","):
+            try:
+                parsed.append(json.loads(v))
+            except json.JSONDecodeError:
+                parsed.append(v)
+        sweep[key] = parsed
+    return sweep
+
+
+class HashEmbedding(BaseEmbedding):
+    """
+    mock 后端：与 BM25 同一套切词，每个词项按 term_hash 落到一维（带正负号），再归一化
+    同一段文字总是同一个向量、字面相近的文字向量也相近；llama_index 的 MockEmbedding 每段文字都是同一个向量，
+    向量一路的排序就成了任意的固定顺序，RRF 融合后的指标没有意义
+    """
+
+    embed_dim: int = 384
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def _embed(self, text: str) -> list[float]:
+        vec = np.zeros(self.embed_dim, dtype=np.float32)
+        for term in tokenize(text, (2,)):
+            h = term_hash(term)
+            vec[h % self.embed_dim] += 1.0 if h >= 0 else -1.0
+        return (vec / max(float(np.linalg.norm(vec)), 1e-12)).tolist()
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._embed(text)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._embed(query)
+
+
+def _make_embed_model(backend: str, model: str):
+    if backend == "mock":
+        return HashEmbedding()
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    from llm.embedding_backends import create_embed_model
+    from llm.index_builder import cpu_budget
+    return create_embed_model(backend=backend, model_name=model,
+                              num_threads=cpu_budget(0), embed_batch_size=64)
+
+
+def _chunk_files(node) -> set[str]:
+    """分块所属的文件名（含近重复合并进来的副本）"""
+    names = {node.metadata.get("file_name", "")}
+    names.update(d.get("file_name", "") for d in node.metadata.get("duplicates", []))
+    return names
+
+
+def _matched(node, relevant: list[str]) -> set[str]:
+    return {stem for stem in relevant for name in _chunk_files(node) if name.startswith(stem)}
+
+
+def _build(manager: ChatManager, persist_dir: Path, embed_model) -> dict:
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        indices = manager._load_or_build_all(
+            [IndexSpec("Lore", LORE_DIR, persist_dir, is_lore=True, with_lexical=True)], embed_model)
+        manager.lore_index, manager.lore_lexical = indices["Lore"]
+        manager.lore_entities = manager._load_or_build_entities(manager.lore_index, LORE_DIR, persist_dir)
+    return {
+        "build_s": time.perf_counter() - started,
+        "size_mb": sum(f.stat().st_size for f in persist_dir.rglob("*") if f.is_file()) / 2 ** 20,
+        "chunks": len(manager.lore_index),
+    }
+
+
+def _evaluate(manager: ChatManager, embed_model, golden: list[dict], repeat: int) -> dict:
+    manager.query_cache = QueryEmbeddingCache(embed_model.get_query_embedding, max_size=4096)
+    recall = {k: [] for k in K_VALUES}
+    rr, top_n_recall, selected_recall, cold, warm, first_ranks = [], [], [], [], [], []
+    top_n = int(manager.sm.get("knowledge", "lore_top_n", default=3))
+    for item in golden:
+        query, relevant = item["query"], item["relevant"]
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            embedding, candidates = manager._search_lore(query)
+            selected = manager._select_lore(embedding, candidates)
+            cold.append(time.perf_counter() - t)
+            for _ in range(repeat):
+                t = time.perf_counter()
+                manager._select_lore(*manager._search_lore(query))
+                warm.append(time.perf_counter() - t)
+
+        for k in K_VALUES:
+            found = set().union(*(_matched(n, relevant) for n in candidates[:k])) if candidates else set()
+            recall[k].append(len(found) / len(relevant))
+        rank = next((i + 1 for i, n in enumerate(candidates) if _matched(n, relevant)), None)
+        first_ranks.append(rank)
+        rr.append(1.0 / rank if rank else 0.0)
+        found = set().union(*(_matched(n, relevant) for n in candidates[:top_n])) if candidates else set()
+        top_n_recall.append(len(found) / len(relevant))
+        found = set().union(*(_matched(n, relevant) for n in selected)) if selected else set()
+        selected_recall.append(len(found) / len(relevant))
+
+    mean = lambda values: sum(values) / len(values)
+    return {
+        "recall": {k: mean(v) for k, v in recall.items()},
+        "mrr": mean(rr),
+        "top_n": top_n,
+        "top_n_recall": mean(top_n_recall),
+        "selected_recall": mean(selected_recall),
+        "cold_p50_ms": _percentile(cold, 0.5) * 1e3,
+        "cold_p95_ms": _percentile(cold, 0.95) * 1e3,
+        "warm_p50_ms": _percentile(warm, 0.5) * 1e3 if warm else float("nan"),
+        "warm_p95_ms": _percentile(warm, 0.95) * 1e3 if warm else float("nan"),
+        "first_ranks": first_ranks,
+    }
+
+
+def _entity_accuracy(manager: ChatManager, golden: list[dict]) -> tuple[int, int, list[str]]:
+    if not manager.lore_entities:
+        return 0, 0, []
+    glossary = manager.lore_entities.glossary
+    checked = [item for item in golden if item.get("entities")]
+    misses = [
+        f"{item['query']}：期望 {'、'.join(item['entities'])}，识别 {'、'.join(glossary.entities_in(item['query'])) or '无'}"
+        for item in checked if not set(item["entities"]) <= set(glossary.entities_in(item["query"]))
+    ]
+    return len(checked) - len(misses), len(checked), misses
+
+
+def _label(config: dict, swept: list[str]) -> str:
+    inverse = {v: k for k, v in SWEEP_ALIASES.items()}
+    label = " ".join(f"{inverse.get(k, k)}={config[k]}" for k in swept) or "默认"
+    is_default = all(config[k] == DEFAULTS["knowledge"][k] for k in swept)
+    return label + (" *" if is_default and swept else "")
+
+
+def _table(rows: list[tuple[str, dict, dict]]) -> list[str]:
+    header = ["组合", "分块", "构建 s", "索引 MB"] + [f"R@{k}" for k in K_VALUES] + \
+             ["MRR", "n", "R@n 排名", "R@n 入选", "冷 p50/p95 ms", "热 p50/p95 ms"]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for label, build, result in rows:
+        cells = [label, str(build["chunks"]), f"{build['build_s']:.1f}", f"{build['size_mb']:.1f}"]
+        cells += [f"{result['recall'][k]:.3f}" for k in K_VALUES]
+        cells += [f"{result['mrr']:.3f}", str(result["top_n"]), f"{result['top_n_recall']:.3f}",
+                  f"{result['selected_recall']:.3f}",
+                  f"{result['cold_p50_ms']:.1f} / {result['cold_p95_ms']:.1f}",
+                  f"{result['warm_p50_ms']:.1f} / {result['warm_p95_ms']:.1f}"]
+        lines.append("| " + " | ".join(cells) + " |")
+    return lines
+
+
+def _write_report(path: Path, backend: str, golden: list[dict], rows: list[tuple[str, dict, dict]],
+                  entity: tuple[int, int, list[str]]):
+    lines = [
+        "# 剧情检索基准报告",
+        "",
+        f"- 时间：{datetime.now():%Y-%m-%d %H:%M}",
+        f"- 嵌入后端：{backend}，查询数：{len(golden)}",
+        *(["- mock 后端的向量是字面 2-gram 的特征哈希，没有语义，向量一路只反映字面重合"] if backend == "mock" else []),
+        f"- 实体识别：{entity[0]} / {entity[1]}",
+        "- 带 * 的组合为当前默认设置",
+        "",
+        "## 汇总",
+        "",
+        *_table(rows),
+        "",
+        "## 每条查询的首个命中排名（- 表示候选里没有期望文件）",
+        "",
+        "| 查询 | " + " | ".join(label for label, _, _ in rows) + " |",
+        "|" + "---|" * (len(rows) + 1),
+    ]
+    for i, item in enumerate(golden):
+        ranks = [str(result["first_ranks"][i] or "-") for _, _, result in rows]
+        lines.append(f"| {item['query']} | " + " | ".join(ranks) + " |")
+    if entity[2]:
+        lines += ["", "## 实体识别未通过", ""] + [f"- {miss}" for miss in entity[2]]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="onnx", choices=("onnx", "torch", "mock"))
+    parser.add_argument("--model", default=str(ROOT / "multilingual-e5-small"), help="嵌入模型目录")
+    parser.add_argument("--golden", type=Path, default=ROOT / "benchmarks" / "retrieval_golden.yaml")
+    parser.add_argument("--sweep", nargs="*", default=[], metavar="KEY=V1,V2")
+    parser.add_argument("--repeat", type=int, default=3, help="每条查询的热查询次数")
+    parser.add_argument("--report", type=Path, default=None, help="写 Markdown 对比报告")
+    parser.add_argument("--min-mrr", type=float, default=0.0, help="默认组合的 MRR 低于该值时以非零状态退出")
+    args = parser.parse_args()
+
+    golden = yaml.safe_load(args.golden.read_text(encoding="utf-8"))["queries"]
+    sweep = _parse_sweep(args.sweep)
+    swept = list(sweep)
+    configs = [dict(DEFAULTS["knowledge"], **dict(zip(swept, values)))
+               for values in itertools.product(*sweep.values())]
+    embed_model = _make_embed_model(args.backend, args.model)
+    print(f"嵌入后端 {args.backend}，黄金查询 {len(golden)} 条，参数组合 {len(configs)} 个")
+
+    rows, entity = [], (0, 0, [])
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        groups: dict[tuple, list[dict]] = {}
+        for config in configs:
+            groups.setdefault(tuple(config[k] for k in BUILD_KEYS), []).append(config)
+        for g, group in enumerate(groups.values()):
+            sm = SettingsManager(str(tmp / f"settings_{g}.json"))
+            sm.set("memory", "enabled", value=False)
+            sm.set("summary", "enabled", value=False)
+            for key in BUILD_KEYS:
+                sm.set("knowledge", key, value=group[0][key])
+            manager = ChatManager(sm, "src/llm/persona.txt", autostart=False)
+            build = _build(manager, tmp / f"lore_{g}", embed_model)
+            if g == 0:
+                entity = _entity_accuracy(manager, golden)
+            for config in group:
+                for key, value in config.items():
+                    sm.set("knowledge", key, value=value)
+                result = _evaluate(manager, embed_model, golden, args.repeat)
+                rows.append((_label(config, swept), build, result))
+                print(f"  {rows[-1][0]}：MRR {result['mrr']:.3f}，R@3 {result['recall'][3]:.3f}，"
+                      f"R@{result['top_n']} 排名 {result['top_n_recall']:.3f} / 入选 {result['selected_recall']:.3f}")
+            manager.lore_index.close()
+
+    print()
+    print("\n".join(_table(rows)))
+    print(f"\n实体识别 {entity[0]} / {entity[1]}")
+    for miss in entity[2]:
+        print(f"  {miss}")
+    if args.report:
+        _write_report(args.report, args.backend, golden, rows, entity)
+        print(f"报告已写入 {args.report}")
+
+    default_rows = [result for label, _, result in rows if label.endswith("*") or label == "默认"]
+    if args.min_mrr > 0 and default_rows and default_rows[0]["mrr"] < args.min_mrr:
+        print(f"默认组合 MRR {default_rows[0]['mrr']:.3f} 低于 {args.min_mrr}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# benchmarks/bench_screenshot_encode.py
+"""
+截图编码基准：旧路径（raw.rgb → 无损 PNG 落盘 → 重新读盘 → base64）vs 新路径（BGRX 直接解码 → 缩放 → 内存中 JPEG / WebP → base64）
+用法：python benchmarks/bench_screenshot_encode.py [--screens 1920x1080,3840x2160,7680x2160] [--repeat 5]
+                                                  [--max-edge 1568] [--quality 80] [--upload-mbps 20]
+                                                  [--layout 2560x1440,3840x2160]
+- 截图帧是合成的 BGRA 缓冲区（标题栏、侧边栏、一行行「文字」+ 一块噪声区域），不依赖显示器 / mss
+- 报告每种方案的 p50 耗时、上传体积（base64 后）、按 --upload-mbps 估算的上传时间，以及相对旧路径的倍数
+- 新路径直接调用 vision.screen_observer.encode_screenshot，与桌宠实际使用的代码一致
+- --layout：按给定的多屏布局（从左到右、顶端对齐）对比各截图模式（vision.capture_mode）的像素数与上传体积；
+  桌宠在第一块屏幕，光标和一个 1600x1000 的前台窗口在最后一块屏幕。留空则跳过
+"""
+import argparse
+import base64
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from vision.screen_observer import CAPTURE_MODES, encode_screenshot, frame_to_image, select_regions
+
+
+class FakeFrame:
+    """模拟 mss.ScreenShot：只提供 observe_once 用到的 size / bgra / rgb"""
+
+    def __init__(self, width: int, height: int, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        img = np.empty((height, width, 4), dtype=np.uint8)
+        img[:] = (36, 30, 30, 255)
+        img[: height // 24] = (70, 60, 60, 255)  # 标题栏
+        img[:, : width // 6] = (56, 48, 45, 255)  # 侧边栏
+        for row in range(height // 12, height, 22):  # 一行行「文字」
+            img[row:row + 8, width // 5: width // 5 + int(rng.integers(width // 8, width // 2)), :3] = 200
+        h0, w0 = height // 2, width // 2
+        img[h0:, w0:, :3] = rng.integers(0, 256, size=(height - h0, width - w0, 3), dtype=np.uint8)
+        self.size = (width, height)
+        self.width, self.height = width, height
+        self.bgra = img.tobytes()
+
+    @property
+    def rgb(self) -> bytes:
+        # 与 mss 一样每次访问都重新转换
+        return np.frombuffer(self.bgra, dtype=np.uint8).reshape(-1, 4)[:, 2::-1].tobytes()
+
+
+def old_path(frame: FakeFrame, tmp: Path) -> int:
+    img = Image.frombytes("RGB", frame.size, frame.rgb)
+    path = tmp / "screen.png"
+    img.save(path)
+    return len(base64.b64encode(path.read_bytes()))
+
+
+def new_path(frame: FakeFrame, max_edge: int, fmt: str, quality: int) -> int:
+    data, _, _ = encode_screenshot(frame_to_image(frame), max_edge=max_edge, fmt=fmt, quality=quality)
+    return len(base64.b64encode(data))
+
+
+def _layout_monitors(layout: str) -> list[dict]:
+    """「2560x1440,3840x2160」→ mss 风格的 monitors 列表（[0] 为外接矩形）"""
+    screens, left = [], 0
+    for item in layout.split(","):
+        width, height = (int(v) for v in item.lower().split("x"))
+        screens.append({"left": left, "top": 0, "width": width, "height": height})
+        left += width
+    bounds = {"left": 0, "top": 0, "width": left, "height": max(m["height"] for m in screens)}
+    return [bounds] + screens
+
+
+def compare_modes(layout: str, max_edge: int, fmt: str, quality: int, repeat: int):
+    monitors = _layout_monitors(layout)
+    first, last = monitors[1], monitors[-1]
+    pet = (first["left"] + first["width"] // 2, first["top"] + first["height"] // 2)
+    cursor = (last["left"] + last["width"] // 2, last["top"] + last["height"] // 2)
+    window = {"left": last["left"] + 100, "top": last["top"] + 100, "width": 1600, "height": 1000}
+    desktop = monitors[0]["width"] * monitors[0]["height"]
+    print(f"== 多屏布局 {layout}（外接矩形 {monitors[0]['width']}x{monitors[0]['height']}，{fmt} {max_edge}px）==")
+    for mode in CAPTURE_MODES:
+        _, regions = select_regions(mode, monitors, pet_point=pet, cursor_point=cursor, window_rect=window)
+        frames = [FakeFrame(r["width"], r["height"], seed=i) for i, r in enumerate(regions)]
+        pixels = sum(f.width * f.height for f in frames)
+        seconds, size = _measure(lambda: sum(new_path(f, max_edge, fmt, quality) for f in frames), repeat)
+        print(f"  {mode:<15} {len(regions)} 张 | {pixels / 1e6:5.2f} MP（全桌面的 {pixels / desktop:4.0%}）"
+              f" | 编码 {seconds * 1e3:6.1f}ms | 上传 {size / 1024:6.0f} KB")
+
+
+def _measure(fn, repeat: int) -> tuple[float, int]:
+    times, size = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        size = fn()
+        times.append(time.perf_counter() - t0)
+    return sorted(times)[len(times) // 2], size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--screens", default="1920x1080,3840x2160,7680x2160")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-edge", type=int, default=1568)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--upload-mbps", type=float, default=20, help="估算上传时间用的上行带宽")
+    parser.add_argument("--layout", default="2560x1440,3840x2160", help="多屏布局，对比各截图模式；留空跳过")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for screen in args.screens.split(","):
+            width, height = (int(v) for v in screen.lower().split("x"))
+            frame = FakeFrame(width, height)
+            cases = [("旧：PNG 落盘", lambda: old_path(frame, tmp))] + [
+                (f"新：{fmt} {args.max_edge}px", lambda fmt=fmt: new_path(frame, args.max_edge, fmt, args.quality))
+                for fmt in ("jpeg", "webp", "png")
+            ]
+            print(f"== {width}x{height} ==")
+            baseline = None
+            for label, fn in cases:
+                seconds, size = _measure(fn, args.repeat)
+                upload = size * 8 / (args.upload_mbps * 1e6)
+                total = seconds + upload
+                baseline = baseline or (total, size)
+                print(f"  {label:<18} 编码 {seconds * 1e3:7.1f}ms | 上传 {size / 1024:8.0f} KB ≈ {upload * 1e3:7.0f}ms"
+                      f" | 合计 {total * 1e3:7.0f}ms（{baseline[0] / total:4.1f}x，体积 {baseline[1] / size:5.1f}x）")
+
+    if args.layout:
+        compare_modes(args.layout, args.max_edge, "jpeg", args.quality, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
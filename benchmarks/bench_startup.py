@@ -0,0 +1,133 @@
+# benchmarks/bench_startup.py
+"""
+启动耗时报告：GUI 线程的导入开销（按顶层包汇总）+ 桌宠首帧耗时
+用法：python benchmarks/bench_startup.py [--top 15] [--budget-ms 1000] [--wait-index]
+- 导入报告用 python -X importtime 统计首帧之前会导入的模块（gui.pet_window / gui.tray / llm.chat_manager）
+- 如果首帧之前导入了 llama_index / torch / transformers 等重量级依赖，或首帧超出 --budget-ms，以非零状态退出，
+  方便发现回归
+- 首帧在子进程里用 offscreen 平台测量，设置写入临时目录，不碰 config/settings.json
+- --wait-index：首帧后继续等待后台索引加载完成，报告索引就绪耗时
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+GUI_IMPORTS = "import gui.pet_window, gui.tray, settings_manager, llm.chat_manager"
+HEAVY_PACKAGES = ("llama_index", "torch", "transformers", "sentence_transformers", "onnxruntime", "tokenizers")
+
+_FIRST_FRAME_SCRIPT = r"""
+import sys, tempfile, time
+t0 = time.perf_counter()
+from pathlib import Path
+from PySide6.QtWidgets import QApplication
+from gui.pet_window import PetWindow
+from gui.tray import AppTray
+from settings_manager import SettingsManager
+from utils import resource_path
+
+app = QApplication(sys.argv)
+sm = SettingsManager(str(Path(tempfile.mkdtemp()) / "settings.json"))
+pet = PetWindow(settings_manager=sm)
+pet.show()
+menu = AppTray.create_main_menu(app, pet)
+pet.set_context_menu(menu)
+tray = AppTray(app, pet_window=pet, icon_path=resource_path("assets/images/icon.ico"), menu=menu)
+app.processEvents()
+print(f"FIRST_FRAME {(time.perf_counter() - t0) * 1e3:.1f}", flush=True)
+print("HEAVY " + ",".join(sorted({m.split('.')[0] for m in sys.modules} & set(sys.argv[2].split(',')))), flush=True)
+
+if sys.argv[1] == "1":
+    pet.start_background_init()
+    worker = pet.chat_manager._index_thread
+    while worker.is_alive():
+        app.processEvents()
+        time.sleep(0.02)
+    if pet.chat_manager.lore_index is not None:
+        print(f"INDEX_READY {(time.perf_counter() - t0) * 1e3:.1f}", flush=True)
+"""
+
+
+def import_report(top: int) -> tuple[dict[str, float], float]:
+    """返回 ({顶层包: 自身导入耗时 ms}, 总耗时 ms)"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", GUI_IMPORTS],
+        cwd=SRC, capture_output=True, text=True, encoding="utf-8", errors="replace",
+        env={**os.environ, "PYTHONPATH": str(SRC), "QT_QPA_PLATFORM": "offscreen"},
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.splitlines()[-1] if proc.stderr else "导入失败")
+        raise SystemExit("导入报告失败")
+    per_package: dict[str, float] = defaultdict(float)
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, _cumulative, name = (part.strip() for part in line.replace("import time:", "|", 1).split("|"))
+        per_package[name.split(".")[0]] += int(self_us) / 1e3
+    total = sum(per_package.values())
+
+    print(f"首帧之前的导入：共 {len(per_package)} 个顶层包，{total:.0f} ms")
+    print(f"{'顶层包':<28} | {'自身耗时 ms':>12}")
+    print("-" * 44)
+    for name, ms in sorted(per_package.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{name:<28} | {ms:>12.1f}")
+    return per_package, total
+
+
+def first_frame(wait_index: bool) -> dict[str, str]:
+    env = {**os.environ, "PYTHONPATH": str(SRC), "QT_QPA_PLATFORM": os.environ.get("QT_QPA_PLATFORM", "offscreen")}
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", _FIRST_FRAME_SCRIPT, "1" if wait_index else "0", ",".join(HEAVY_PACKAGES)],
+        cwd=SRC, capture_output=True, text=True, encoding="utf-8", errors="replace", env=env,
+    )
+    wall_ms = (time.perf_counter() - start) * 1e3
+    results = {}
+    for line in proc.stdout.splitlines():
+        key, _, value = line.partition(" ")
+        if key in ("FIRST_FRAME", "HEAVY", "INDEX_READY"):
+            results[key] = value
+    if "FIRST_FRAME" not in results:
+        print(proc.stderr[-2000:])
+        raise SystemExit("首帧测量失败")
+    results["WALL"] = f"{wall_ms:.1f}"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=1000.0, help="首帧耗时上限（不含解释器启动）")
+    parser.add_argument("--wait-index", action="store_true")
+    args = parser.parse_args()
+
+    per_package, _ = import_report(args.top)
+    failed = False
+    heavy = [name for name in HEAVY_PACKAGES if name in per_package]
+    if heavy:
+        print(f"\n[回归] 首帧之前导入了重量级依赖：{', '.join(heavy)}")
+        failed = True
+
+    results = first_frame(args.wait_index)
+    first_ms = float(results["FIRST_FRAME"])
+    print(f"\n桌宠首帧：{first_ms:.0f} ms（子进程总耗时 {results['WALL']} ms，含解释器启动）")
+    if results.get("HEAVY"):
+        print(f"[回归] 首帧时已加载：{results['HEAVY']}")
+        failed = True
+    if "INDEX_READY" in results:
+        print(f"后台索引就绪：{float(results['INDEX_READY']):.0f} ms")
+    elif args.wait_index:
+        print("后台索引加载失败（详见子进程输出）")
+    if first_ms > args.budget_ms:
+        print(f"[回归] 首帧超出预算 {args.budget_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
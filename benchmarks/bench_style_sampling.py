@@ -0,0 +1,78 @@
+# benchmarks/bench_style_sampling.py
+"""
+Style 抽样微基准：对比旧逻辑（每轮遍历 docstore + 列表查重）与 StyleSampler
+用法：python benchmarks/bench_style_sampling.py
+预期：旧逻辑的单次耗时随语料规模线性增长，StyleSampler 基本不变
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from llm.style_pool import StyleSampler
+
+
+class _FakeNode:
+    def __init__(self, text: str):
+        self._text = text
+
+    def get_content(self) -> str:
+        return self._text
+
+
+def _make_nodes(n: int) -> list[_FakeNode]:
+    rng = random.Random(n)
+    return [_FakeNode(f"台词{i}：" + "あ" * rng.randint(10, 320)) for i in range(n)]
+
+
+def _legacy_sample(nodes, history: list[str]) -> list[str]:
+    """原 _retrieve_knowledge 中的 Style 抽样逻辑（逐行照搬）"""
+    all_style_contents = []
+    for node in nodes:
+        content = node.get_content().strip()
+        if 20 <= len(content) <= 300:
+            all_style_contents.append(content)
+
+    candidate_contents = [c for c in all_style_contents if c not in history]
+    if not candidate_contents:
+        history.clear()
+        candidate_contents = all_style_contents
+
+    sample_count = random.randint(1, min(3, len(candidate_contents)))
+    sample_contents = random.sample(candidate_contents, sample_count)
+    history.extend(sample_contents)
+    del history[:-15]
+    return sample_contents
+
+
+def _time_per_call(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    print(f"{'语料条数':>10} | {'旧逻辑 µs/次':>14} | {'StyleSampler µs/次':>20} | {'构建池 ms':>10}")
+    print("-" * 66)
+    for n in (1_000, 10_000, 100_000):
+        nodes = _make_nodes(n)
+
+        history: list[str] = []
+        legacy_rounds = max(5, 20_000 // n * 10)
+        legacy_us = _time_per_call(lambda: _legacy_sample(nodes, history), legacy_rounds)
+
+        t0 = time.perf_counter()
+        sampler = StyleSampler.from_texts(
+            (node.get_content() for node in nodes), min_len=20, max_len=300, history_size=15
+        )
+        build_ms = (time.perf_counter() - t0) * 1e3
+        pool_us = _time_per_call(lambda: sampler.sample(max_count=3), 20_000)
+
+        print(f"{n:>10} | {legacy_us:>14.1f} | {pool_us:>20.2f} | {build_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# benchmarks/mock_openai_server.py
+"""
+本地 OpenAI 兼容的模拟后端（基准测试用，不联网、不花钱）
+- POST /v1/chat/completions（也接受任意以 /chat/completions 结尾的路径），支持 stream（SSE）与普通 JSON 两种响应
+- 可配置：首字延迟、输出速率（tokens/s，每个字符算一个 token）、回复长度；
+  按概率出现的慢请求、返回 500、流式输出中途断开；流式响应可以等到首字时才发响应头（delay_headers）
+- 等待首字期间会察觉客户端断开，记录断开次数与时刻（aborted / abort_times），用来确认对冲输掉的一路被及时关闭
+- 视觉请求：消息里带 image_url（data:image/...;base64）时按图片大小额外延迟，并回复一段屏幕描述
+- 记录每个请求的提示词字符数、消息条数、图片张数与字节数，供基准脚本统计提示词规模
+- 每个后端单独一个线程化 HTTP 服务器，默认监听 127.0.0.1 的随机端口
+
+也可以单独运行，让桌宠直接连到它（设置里 Base URL 填打印出来的地址）：
+python benchmarks/mock_openai_server.py --port 8000 [--first-token-ms 300] [--tokens-per-s 40] [--fail-prob 0.05]
+"""
+import argparse
+import json
+import random
+import select
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "好的，御主。今天也辛苦了。"
+DEFAULT_VISION_REPLY = "屏幕上打开着一个代码编辑器，左侧是文件树，右侧是终端窗口，用户似乎正在调试程序。"
+
+
+class RequestRecord:
+    __slots__ = ("stream", "messages", "prompt_chars", "images", "image_bytes", "status")
+
+    def __init__(self, payload: dict):
+        self.stream = bool(payload.get("stream"))
+        self.messages = len(payload.get("messages", []))
+        self.prompt_chars = 0
+        self.images = 0
+        self.image_bytes = 0
+        self.status = 200
+        for message in payload.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                self.prompt_chars += len(content)
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    self.prompt_chars += len(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    url = (part.get("image_url") or {}).get("url", "")
+                    self.images += 1
+                    # data:image/png;base64,xxxx → 解码后的字节数
+                    self.image_bytes += len(url.partition(",")[2]) * 3 // 4
+
+
+class MockBackend:
+    def __init__(self, name: str, first_token_s: float = 0.05, tokens_per_s: float = 200.0,
+                 slow_prob: float = 0.0, slow_s: float = 2.0, fail_prob: float = 0.0, drop_prob: float = 0.0,
+                 image_s_per_mb: float = 0.2, reply: str = DEFAULT_REPLY, reply_chars: int | None = None,
+                 vision_reply: str = DEFAULT_VISION_REPLY, delay_headers: bool = False, seed: int = 0,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.name = name
+        self.first_token_s = first_token_s
+        self.tokens_per_s = tokens_per_s
+        self.slow_prob = slow_prob
+        self.slow_s = slow_s
+        self.fail_prob = fail_prob
+        self.drop_prob = drop_prob  # 流式输出到一半断开连接
+        self.image_s_per_mb = image_s_per_mb
+        self.reply = (reply * (reply_chars // max(1, len(reply)) + 1))[:reply_chars] if reply_chars else reply
+        self.vision_reply = vision_reply
+        self.delay_headers = delay_headers  # 流式响应等到首字时才发响应头（模拟排队中的服务端）
+        self.host = host
+        self.port = port
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.aborted = 0  # 客户端中途断开（对冲输掉的一路）或注入的中途断开
+        self.abort_times: list[float] = []  # 察觉客户端断开的时刻（time.perf_counter）
+        self.records: list[RequestRecord] = []
+        self._server: ThreadingHTTPServer | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def token_interval_s(self) -> float:
+        return 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+
+    def _roll(self, record: RequestRecord) -> tuple[bool, bool, float]:
+        with self._lock:
+            self.requests += 1
+            self.records.append(record)
+            fail = self._rng.random() < self.fail_prob
+            drop = self._rng.random() < self.drop_prob
+            delay = self.first_token_s + (self.slow_s if self._rng.random() < self.slow_prob else 0.0)
+        delay += self.image_s_per_mb * record.image_bytes / 2 ** 20
+        return fail, drop, delay
+
+    def reset_records(self):
+        with self._lock:
+            self.records = []
+
+    def start(self) -> "MockBackend":
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                record = RequestRecord(payload)
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    record.status = 404
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                    return
+                fail, drop, delay = backend._roll(record)
+                if fail:
+                    with backend._lock:
+                        backend.failures += 1
+                    record.status = 500
+                    self._send_json(500, {"error": {"message": "injected failure"}})
+                    return
+                reply = backend.vision_reply if record.images else backend.reply
+                max_tokens = payload.get("max_tokens")
+                if max_tokens:
+                    reply = reply[:int(max_tokens)]
+                try:
+                    if payload.get("stream"):
+                        self._stream(payload, record, reply, delay, drop)
+                    else:
+                        self._wait(delay + backend.token_interval_s * len(reply))
+                        self._send_json(200, {
+                            "choices": [{"message": {"role": "assistant", "content": reply}}],
+                            "usage": backend.usage(record, reply),
+                        })
+                except (BrokenPipeError, ConnectionResetError):
+                    with backend._lock:
+                        backend.aborted += 1
+                        backend.abort_times.append(time.perf_counter())
+                    self.close_connection = True
+
+            def _wait(self, seconds: float):
+                """等待 seconds 秒；期间客户端断开时立即抛出 ConnectionResetError"""
+                deadline = time.perf_counter() + seconds
+                while (remaining := deadline - time.perf_counter()) > 0:
+                    readable, _, _ = select.select([self.connection], [], [], min(remaining, 0.05))
+                    if not readable:
+                        continue
+                    try:
+                        data = self.connection.recv(1, socket.MSG_PEEK)
+                    except OSError:
+                        data = b""
+                    if not data:
+                        raise ConnectionResetError("client disconnected")
+                    # 客户端提前发来了下一个请求（不会发生在 requests 上），剩下的时间直接睡过去
+                    time.sleep(max(0.0, deadline - time.perf_counter()))
+                    return
+
+            def _send_json(self, status: int, data: dict):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, payload: dict, record: RequestRecord, reply: str, delay: float, drop: bool):
+                if backend.delay_headers:
+                    self._wait(delay)
+                    delay = 0.0
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(data: str):
+                    raw = f"data: {data}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+                    self.wfile.flush()
+
+                self._wait(delay)
+                for i, ch in enumerate(reply):
+                    if drop and i == len(reply) // 2:
+                        with backend._lock:
+                            backend.aborted += 1
+                        self.close_connection = True
+                        return
+                    send(json.dumps({"choices": [{"delta": {"content": ch}}]}, ensure_ascii=False))
+                    time.sleep(backend.token_interval_s)
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    send(json.dumps({"choices": [], "usage": backend.usage(record, reply)}))
+                send("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name=f"Mock-{self.name}").start()
+        return self
+
+    def usage(self, record: RequestRecord, reply: str) -> dict:
+        # 每个字符算一个 token；图片按每 32KB 一个 token 粗略折算
+        prompt_tokens = record.prompt_chars + record.image_bytes // 32768
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply),
+                "prompt_cache_hit_tokens": 0, "prompt_cache_miss_tokens": prompt_tokens}
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟后端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-s", type=float, default=40)
+    parser.add_argument("--reply-chars", type=int, default=None)
+    parser.add_argument("--slow-prob", type=float, default=0.0)
+    parser.add_argument("--slow-ms", type=float, default=3000)
+    parser.add_argument("--fail-prob", type=float, default=0.0)
+    parser.add_argument("--drop-prob", type=float, default=0.0)
+    args = parser.parse_args()
+
+    backend = MockBackend(
+        "mock", first_token_s=args.first_token_ms / 1e3, tokens_per_s=args.tokens_per_s,
+        reply_chars=args.reply_chars, slow_prob=args.slow_prob, slow_s=args.slow_ms / 1e3,
+        fail_prob=args.fail_prob, drop_prob=args.drop_prob, host=args.host, port=args.port,
+    ).start()
+    print(f"模拟后端已启动：{backend.url}/v1/chat/completions（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        backend.stop()
+
+
+if __name__ == "__main__":
+    main()
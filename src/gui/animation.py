@@ -28,6 +28,7 @@ class AnimationDriver(QObject):
 
         self.timer = QTimer(self)
         self.timer.timeout.connect(self._next_frame)
+        self._pending_idle_files: list[str] = []
 
         # 预加载 idle 动画
         self._load_idle_frames()
@@ -57,34 +58,53 @@ class AnimationDriver(QObject):
         - 原始资源是 1280x1280
         - 先缩放到 256x256
         - 再按当前 label 尺寸等比缩放
+        分阶段加载：第一帧同步解码（首帧立即可显示），其余帧在事件循环里逐帧补齐，
+        14 张大图的解码 + 缩放不再卡在窗口出现之前
         """
         folder = resource_path("assets/images/idle")
         if not os.path.isdir(folder):
             return
 
-        files = sorted(
+        self._pending_idle_files = sorted(
             f for f in os.listdir(folder)
             if f.lower().endswith(".png")
         )
 
         frames: list[QPixmap] = []
-        for f in files:
-            pix_path = resource_path(f"assets/images/idle/{f}")
-            pix = QPixmap(pix_path)
-            if pix.isNull():
-                continue
-
-            # ① 先缩放到逻辑基准尺寸 256x256
-            pix = pix.scaled(
-                BASE_SIZE,
-                BASE_SIZE,
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )   
-            frames.append(pix)
+        while self._pending_idle_files and not frames:
+            pix = self._load_frame(self._pending_idle_files.pop(0))
+            if pix is not None:
+                frames.append(pix)
 
         if frames:
+            # 播放时 self.frames 引用的就是这个列表，后续帧追加进来即可参与播放
             self.animations["idle"] = frames
+            if self._pending_idle_files:
+                QTimer.singleShot(0, self._load_next_idle_frame)
+
+    def _load_next_idle_frame(self):
+        if not self._pending_idle_files:
+            return
+        pix = self._load_frame(self._pending_idle_files.pop(0))
+        if pix is not None:
+            self.animations["idle"].append(pix)
+        if self._pending_idle_files:
+            QTimer.singleShot(0, self._load_next_idle_frame)
+
+    @staticmethod
+    def _load_frame(file_name: str) -> QPixmap | None:
+        pix_path = resource_path(f"assets/images/idle/{file_name}")
+        pix = QPixmap(pix_path)
+        if pix.isNull():
+            return None
+
+        # ① 先缩放到逻辑基准尺寸 256x256
+        return pix.scaled(
+            BASE_SIZE,
+            BASE_SIZE,
+            Qt.KeepAspectRatio,
+            Qt.SmoothTransformation
+        )
 
     # -------------------------------------------------
     # playback core
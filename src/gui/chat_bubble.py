@@ -1,10 +1,10 @@
 from PySide6.QtWidgets import (
-    QWidget, QVBoxLayout, QTextEdit, QLineEdit
+    QWidget, QVBoxLayout, QTextEdit, QLineEdit, QLabel
 )
 from PySide6.QtCore import (
     Qt, Signal, QTimer, QPropertyAnimation, QEvent, QRect
 )
-from PySide6.QtGui import QGuiApplication
+from PySide6.QtGui import QGuiApplication, QTextCursor, QTextCharFormat
 from utils import resource_path
 
 class ChatBubble(QWidget):
@@ -50,7 +50,13 @@ class ChatBubble(QWidget):
             "padding: 6px;"
         )
 
+        # 知识库加载状态（加载中 / 失败时显示，就绪后隐藏）
+        self.status_label = QLabel()
+        self.status_label.setStyleSheet("color: rgba(90,90,90,230); font-size: 11px;")
+        self.status_label.hide()
+
         layout.addWidget(self.chat_view)
+        layout.addWidget(self.status_label)
         layout.addWidget(self.input_edit)
 
         self.input_edit.returnPressed.connect(self._on_enter)
@@ -64,6 +70,11 @@ class ChatBubble(QWidget):
         self._fade_anim.setDuration(300)
         self._fade_anim.finished.connect(self._on_fade_finished)
 
+        # ===== 流式回复 =====
+        self._stream_start: int | None = None  # 当前流式回复正文在文档中的起止位置
+        self._stream_end: int | None = None
+        self._default_placeholder = self.input_edit.placeholderText()
+
     def append_pet_silent(self, text: str):
         """
         只写入聊天记录，不触发窗口显示
@@ -95,6 +106,84 @@ class ChatBubble(QWidget):
         self._ensure_visible()
         self.chat_view.append(f"<b>因陀罗：</b>{text}<br>")
 
+    # ---------- 流式回复 ----------
+    def begin_pet_stream(self):
+        """
+        开始一条流式回复：先写入「因陀罗：」前缀，后续增量写在它后面
+        """
+        self._ensure_visible()
+        self.chat_view.append("<b>因陀罗：</b>")
+        cursor = self.chat_view.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        self._stream_start = cursor.position()
+        self._stream_end = self._stream_start
+
+    def _replace_stream_text(self, text: str, rich: bool = False):
+        """
+        替换 [_stream_start, _stream_end) 之间的正文
+        （流式期间用户可能继续发消息，新内容会追加在后面，所以不能直接替换到文档末尾）
+        """
+        cursor = self.chat_view.textCursor()
+        cursor.setPosition(self._stream_start)
+        cursor.setPosition(self._stream_end, QTextCursor.KeepAnchor)
+        if rich:
+            cursor.removeSelectedText()
+            cursor.insertHtml(text)
+        else:
+            # 用默认格式写入，避免继承前缀的粗体
+            cursor.insertText(text, QTextCharFormat())
+        self._stream_end = cursor.position()
+        return cursor
+
+    def update_pet_stream(self, text: str):
+        """
+        用目前为止收到的完整文本替换流式回复正文
+        """
+        if self._stream_start is None:
+            self.begin_pet_stream()
+
+        self._replace_stream_text(text)
+        self.chat_view.ensureCursorVisible()
+
+    def end_pet_stream(self, text: str | None = None, rich: bool = False):
+        """
+        结束流式回复；text 为最终完整文本（为空则保留已显示的内容）
+        rich=True 时 text 按 HTML 写入（用于错误提示）
+        """
+        if self._stream_start is None:
+            if text:
+                self.append_pet(text)
+            return
+
+        if text:
+            self._replace_stream_text(text, rich=rich)
+        cursor = self.chat_view.textCursor()
+        cursor.setPosition(self._stream_end)
+        cursor.insertHtml("<br>")
+        self._stream_start = None
+        self._stream_end = None
+
+    def set_thinking(self, thinking: bool):
+        """
+        请求进行中的「思考中」状态：
+        - 开始时先占一行「因陀罗：……」，收到首个增量后被替换
+        - 输入框仍可输入，新消息会排队发送
+        """
+        if thinking:
+            if self._stream_start is None:
+                self.begin_pet_stream()
+                self.update_pet_stream("……")
+            self.input_edit.setPlaceholderText("因陀罗正在思考……")
+        else:
+            if self._stream_start is not None:
+                self.end_pet_stream()
+            self.input_edit.setPlaceholderText(self._default_placeholder)
+
+    def set_status(self, text: str):
+        """输入框上方的一行状态提示；空字符串隐藏"""
+        self.status_label.setText(text)
+        self.status_label.setVisible(bool(text))
+
     # ---------- 可见性与位置 ----------
     def _ensure_visible(self):
         """
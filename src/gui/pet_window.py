@@ -1,5 +1,4 @@
 # src/gui/pet_window.py
-from email.mime import text
 import os
 from PySide6.QtWidgets import QWidget, QLabel, QMenu, QVBoxLayout
 from PySide6.QtGui import QPixmap, QGuiApplication  # ✅ 修正 QGuiApplication 导入
@@ -10,11 +9,13 @@ from gui.animation import BASE_SIZE
 from vision.screen_observer import ScreenObserver
 from vision.qwen_vision import QwenVisionClient  # 提前导入，避免方法内重复导入
 from utils import resource_path
+from tracing import get_tracer
 
 
 class ScreenObserveWorker(QThread):
     finished = Signal(str)
     error = Signal(str)     # 新增：错误信息信号
+    partial = Signal(str)   # 流式评论：目前为止收到的文本
 
     def __init__(self, observer, vision_client, chat_manager):
         super().__init__()
@@ -24,20 +25,26 @@ class ScreenObserveWorker(QThread):
 
     def run(self):
         try:
-            # 步骤1：截图（新增有效性校验）
-            screenshot_path = self.observer.observe_once()
-            if not screenshot_path or not screenshot_path.exists():
-                raise Exception("截图失败：未生成有效截图文件")
-            # 步骤2：调用Qwen视觉模型（新增空值校验）
-            description = self.vision_client.describe_image(screenshot_path)
-            if not description.strip():
-                raise Exception("视觉模型返回空的屏幕描述")
-            # 步骤3：生成屏幕评论（新增空值校验）
-            reply = self.chat_manager.send_screen_observation(description)
-            if not reply.strip():
-                raise Exception("未生成有效的屏幕评论")
-            # 正常流程：发送评论
-            self.finished.emit(reply)
+            # 每个阶段（截图 / 编码 / 视觉模型 / 检索 / LLM）的耗时记入同一条 trace
+            with get_tracer().trace("screen_observe"):
+                # 步骤1：截图（新增有效性校验）
+                shots = self.observer.observe_once()
+                if not shots or not all(shot.data for shot in shots):
+                    raise Exception("截图失败：未生成有效截图")
+                # 步骤2：调用Qwen视觉模型（截图在内存里直接上传，新增空值校验）
+                description = self.vision_client.describe_images([(shot.data, shot.mime) for shot in shots])
+                if not description.strip():
+                    raise Exception("视觉模型返回空的屏幕描述")
+                # 步骤3：生成屏幕评论（新增空值校验）
+                reply = self.chat_manager.send_screen_observation(
+                    description, on_delta=self.partial.emit
+                )
+                if not reply or not reply.strip():
+                    raise Exception("未生成有效的屏幕评论")
+                # 正常流程：发送评论
+                self.finished.emit(reply)
+            # 评论已送达，之后才在后台压缩挤出历史的旧对话
+            self.chat_manager.summarize_evicted()
         except Exception as e:
             error_msg = f"屏幕观察出错：{str(e)}"
             print(f"[ScreenObserveWorker] {error_msg}")
@@ -45,6 +52,36 @@ class ScreenObserveWorker(QThread):
             self.error.emit(error_msg)
 
 
+class ChatWorker(QThread):
+    """
+    在后台线程执行一次 ChatManager.chat()（检索 + LLM 请求），
+    结果通过信号回到 GUI 线程，避免卡住动画、拖动和托盘菜单
+    注意：不覆盖 QThread 自带的 finished 信号，PetWindow 用它串行处理排队的消息
+    """
+    partial = Signal(str)       # 流式回复：目前为止收到的文本
+    reply_ready = Signal(str)   # 完整回复
+    failed = Signal(str)        # 错误信息
+
+    def __init__(self, chat_manager, text: str):
+        super().__init__()
+        self.chat_manager = chat_manager
+        self.text = text
+
+    def run(self):
+        try:
+            with get_tracer().trace("chat", user_chars=len(self.text)):
+                reply = self.chat_manager.chat(self.text, on_delta=self.partial.emit)
+                if not reply or not reply.strip():
+                    raise Exception("未收到有效回复，请检查 LLM 设置")
+                self.reply_ready.emit(reply)
+            # 回复已送达，之后才在后台压缩挤出历史的旧对话
+            self.chat_manager.summarize_evicted()
+        except Exception as e:
+            error_msg = f"对话出错：{str(e)}"
+            print(f"[ChatWorker] {error_msg}")
+            self.failed.emit(error_msg)
+
+
 class TempBubble(QWidget):
     """
     一次性临时聊天气泡
@@ -97,6 +134,20 @@ class TempBubble(QWidget):
         self._life_timer.setSingleShot(True)
         self._life_timer.timeout.connect(self._fade_anim.start)
 
+    def set_text(self, text: str):
+        """
+        流式更新气泡文字：重新计算大小并保持底边贴住原位置，
+        同时重置显示时长（从最后一次更新开始计时）
+        """
+        old_geo = self.frameGeometry()
+        self.label.setText(text)
+        self.adjustSize()
+        if self.isVisible():
+            self.move(old_geo.x(), old_geo.bottom() - self.frameGeometry().height() + 1)
+            self._clamp_to_screen()
+            if self._life_timer.isActive():
+                self._life_timer.start()
+
     def set_lifetime(self, seconds: int):
         """设置气泡显示时长（秒）"""
         self._life_timer.setInterval(seconds * 1000)
@@ -153,6 +204,8 @@ class PetWindow(QWidget):
 
         self.vision_client = None
         self._observe_worker: ScreenObserveWorker | None = None
+        self._chat_worker: ChatWorker | None = None
+        self._pending_messages: list[str] = []  # 请求进行中时用户继续发送的消息
 
         # ✅ 保存导入的类到实例属性，供其他方法调用
         self._AnimationDriver = AnimationDriver
@@ -200,7 +253,8 @@ class PetWindow(QWidget):
         self.vision_client = QwenVisionClient(
             api_url=api_url,
             api_key=api_key,
-            model=model
+            model=model,
+            transport=self.chat_manager.transport
         )
 
     def _apply_screen_watch_settings(self):
@@ -324,15 +378,60 @@ class PetWindow(QWidget):
     def _setup_chat(self):
         persona_path = resource_path("src/llm/persona.txt")  # 替换原 os.path.join 方式
         # ✅ 使用实例属性中的 ChatManager
-        self.chat_manager = self._ChatManager(self.settings, persona_path)
+        # 索引（llama_index / 嵌入模型）在窗口显示后才开始加载，见 start_background_init
+        self.chat_manager = self._ChatManager(self.settings, persona_path, autostart=False)
+        self.chat_manager.knowledge_state_changed.connect(self._on_knowledge_state_changed)
         # ✅ 使用实例属性中的 ChatBubble
         self.chat_bubble = self._ChatBubble()
         self.chat_bubble.send_message.connect(self._on_user_message)
 
+    def start_background_init(self):
+        """窗口与托盘就绪后调用：开始在后台线程导入 ML 依赖并加载索引"""
+        self.chat_manager.start()
+
+    def _on_knowledge_state_changed(self, state: str, progress: int, message: str):
+        """知识库加载中 / 失败时在气泡里提示，而不是悄悄给出不带剧情记忆的回答"""
+        if state == "loading":
+            self.chat_bubble.set_status(f"记忆预热中 {progress}%：{message}")
+        elif state == "failed":
+            self.chat_bubble.set_status("记忆库加载失败，回复将不参考剧情记忆")
+        else:
+            self.chat_bubble.set_status("")
+
     def _on_user_message(self, text: str):
-        reply = self.chat_manager.chat(text)
-        if reply:
-            self.chat_bubble.append_pet(reply)
+        # 不在 GUI 线程里请求：排队后交给 ChatWorker
+        self._pending_messages.append(text)
+        self._start_next_chat()
+
+    def _start_next_chat(self):
+        if self._chat_worker and self._chat_worker.isRunning():
+            return
+        if not self._pending_messages:
+            return
+
+        text = self._pending_messages.pop(0)
+        worker = ChatWorker(self.chat_manager, text)
+        worker.partial.connect(self.chat_bubble.update_pet_stream)
+        worker.reply_ready.connect(self.chat_bubble.end_pet_stream)
+        worker.failed.connect(self._on_chat_failed)
+        # 线程真正结束后再处理下一条排队消息
+        worker.finished.connect(self._on_chat_worker_finished)
+
+        self.chat_bubble.set_thinking(True)
+        self._chat_worker = worker
+        worker.start()
+
+    def _on_chat_failed(self, error_text: str):
+        self.chat_bubble.end_pet_stream(
+            f"<font color='#ff4444'>{error_text}</font>", rich=True
+        )
+
+    def _on_chat_worker_finished(self):
+        self.chat_bubble.set_thinking(False)
+        if self._chat_worker:
+            self._chat_worker.deleteLater()
+            self._chat_worker = None
+        self._start_next_chat()
 
     # ---------------- Context Menu ----------------
     def set_context_menu(self, menu):
@@ -448,12 +547,24 @@ class PetWindow(QWidget):
             self.chat_manager
         )
 
+        # 流式评论：首个增量到达时弹出气泡，之后原地更新
+        stream_bubble = {"bubble": None}
+
+        def on_screen_partial(text: str):
+            if stream_bubble["bubble"] is None:
+                stream_bubble["bubble"] = self._show_temp_bubble(text)
+            else:
+                stream_bubble["bubble"].set_text(text)
+
         def on_screen_observed(text: str):
             # 1️⃣ 只追加到聊天记录（不显示聊天框）
             self.chat_bubble.append_pet_silent(text)
 
-            # 2️⃣ 显示头顶临时气泡
-            self._show_temp_bubble(text)
+            # 2️⃣ 显示头顶临时气泡（流式时更新为最终文本）
+            if stream_bubble["bubble"] is None:
+                self._show_temp_bubble(text)
+            else:
+                stream_bubble["bubble"].set_text(text)
             self._observe_worker = None  # 重置worker
 
         # 新增：错误回调：仅显示临时气泡（不写入聊天记录）
@@ -461,12 +572,13 @@ class PetWindow(QWidget):
             self._show_temp_bubble(error_text)
             self._observe_worker = None  # 重置worker
 
+        self._observe_worker.partial.connect(on_screen_partial)
         self._observe_worker.finished.connect(on_screen_observed)
         self._observe_worker.error.connect(on_screen_observe_error)  # 绑定错误回调
         self._observe_worker.start()
 
     # ---------------- 临时气泡 ----------------
-    def _show_temp_bubble(self, text: str):
+    def _show_temp_bubble(self, text: str) -> TempBubble:
         # 新增：错误信息标红
         if text.startswith("屏幕观察出错：") or text.startswith("定时屏幕观察出错：") or text.startswith("屏幕观察功能未启用："):
             text = f"<font color='#ff4444'>{text}</font>"
@@ -495,4 +607,5 @@ class PetWindow(QWidget):
         x = pet_geo.center().x() - bw // 2
         y = pet_geo.top() - bh - 10
 
-        bubble.popup(x, y)
\ No newline at end of file
+        bubble.popup(x, y)
+        return bubble
\ No newline at end of file
@@ -2,9 +2,27 @@ from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QFormLayout, QHBoxLayout,
     QLabel, QDoubleSpinBox, QSpinBox, QCheckBox,
     QPushButton, QLineEdit, QGroupBox, QComboBox,
-    QTabWidget, QWidget, QSizePolicy  # ✅ 新增导入 QSizePolicy
+    QTabWidget, QWidget, QSizePolicy,  # ✅ 新增导入 QSizePolicy
+    QTableWidget, QTableWidgetItem, QHeaderView
 )
 from PySide6.QtCore import Qt
+from tracing import get_tracer
+
+# 性能标签页里显示的流程 / 阶段名称（未列出的直接显示原名）
+TRACE_LABELS = {
+    "chat": "对话",
+    "screen_observe": "屏幕观察",
+    "capture": "截图",
+    "image_encode": "缩放 + 编码",
+    "vision_encode": "Base64 编码",
+    "vision_request": "视觉模型",
+    "retrieval": "检索",
+    "memory_recall": "· 旧对话召回",
+    "knowledge_wait": "· 等待知识库",
+    "lore_search": "· 剧情检索",
+    "prompt_assembly": "提示词组装",
+    "llm": "LLM 请求",
+}
 
 
 class SettingsDialog(QDialog):
@@ -48,6 +66,11 @@ class SettingsDialog(QDialog):
         self._build_model_tab()
         self.tab_widget.addTab(self.model_tab, "模型设置")
 
+        # 1.3 第三个标签：最近对话 / 屏幕观察各阶段的耗时汇总
+        self.perf_tab = QWidget()
+        self._build_perf_tab()
+        self.tab_widget.addTab(self.perf_tab, "性能")
+
         # 将标签页添加到主布局
         main_layout.addWidget(self.tab_widget)
 
@@ -96,6 +119,65 @@ class SettingsDialog(QDialog):
         layout.addLayout(form)
         layout.addStretch()
 
+    # ---------- 构建性能标签页 ----------
+    def _build_perf_tab(self):
+        layout = QVBoxLayout(self.perf_tab)
+
+        self.perf_table = QTableWidget(0, 8)
+        self.perf_table.setHorizontalHeaderLabels(
+            ["流程", "阶段", "次数", "失败", "p50 (ms)", "p95 (ms)", "最大 (ms)", "平均载荷 / token"]
+        )
+        self.perf_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.perf_table.verticalHeader().setVisible(False)
+        self.perf_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.perf_table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.perf_table)
+
+        bottom = QHBoxLayout()
+        self.perf_path_label = QLabel()
+        self.perf_path_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        bottom.addWidget(self.perf_path_label, 1)
+        btn_refresh = QPushButton("刷新")
+        btn_refresh.clicked.connect(self._refresh_perf)
+        bottom.addWidget(btn_refresh)
+        layout.addLayout(bottom)
+
+        self._refresh_perf()
+
+    def _refresh_perf(self):
+        tracer = get_tracer(self.sm)
+        rows = tracer.summary()
+        self.perf_path_label.setText(f"明细：{tracer.path}")
+        self.perf_table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            cells = [
+                TRACE_LABELS.get(row["flow"], row["flow"]),
+                TRACE_LABELS.get(row["stage"], row["stage"]),
+                str(row["count"]),
+                str(row["errors"]),
+                f"{row['p50_ms']:.0f}",
+                f"{row['p95_ms']:.0f}",
+                f"{row['max_ms']:.0f}",
+                self._format_trace_attrs(row["attrs"]),
+            ]
+            for j, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if 2 <= j <= 6:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.perf_table.setItem(i, j, item)
+
+    @staticmethod
+    def _format_trace_attrs(attrs: dict) -> str:
+        parts = []
+        for key, value in attrs.items():
+            if key.endswith("_bytes"):
+                parts.append(f"{key[:-6]} {value / 1024:.0f} KB")
+            elif key.endswith("_ms"):
+                parts.append(f"{key[:-3]} {value:.0f} ms")
+            else:
+                parts.append(f"{key} {value:.0f}")
+        return "，".join(parts)
+
     # ---------- 构建模型设置标签页（LLM + 视觉模型） ----------
     def _build_model_tab(self):
         layout = QVBoxLayout(self.model_tab)
@@ -137,6 +219,14 @@ class SettingsDialog(QDialog):
         self.history_spin.setRange(1, 100)
         layout.addRow("保留对话轮数", self.history_spin)
 
+        self.prompt_budget_spin = QSpinBox()
+        self.prompt_budget_spin.setRange(1000, 200000)
+        self.prompt_budget_spin.setSingleStep(1000)
+        layout.addRow("提示词预算（tokens）", self.prompt_budget_spin)
+
+        self.cache_layout_cb = QCheckBox("人设放在最前并保持不变（命中提供方前缀缓存）")
+        layout.addRow(self.cache_layout_cb)
+
         # Temperature 控制
         self.temperature_spinbox = QDoubleSpinBox(self)
         self.temperature_spinbox.setRange(0.0, 1.5)
@@ -144,6 +234,9 @@ class SettingsDialog(QDialog):
         self.temperature_spinbox.setValue(self.sm.get("llm", "temperature", default=1.0))
         layout.addRow("对话Temperature参数", self.temperature_spinbox)
 
+        self.stream_cb = QCheckBox("流式输出（边生成边显示）")
+        layout.addRow(self.stream_cb)
+
         self.provider_combo.currentTextChanged.connect(self._on_provider_changed)
 
         return group
@@ -164,6 +257,14 @@ class SettingsDialog(QDialog):
         self.vision_model = QLineEdit(self)
         self.vision_model.setText(self.sm.get("vision", "model", default="Qwen/Qwen3-VL-32B-Instruct"))
         layout.addRow("视觉模型名称", self.vision_model)
+
+        # 截图范围：多屏时只截相关的部分，省视觉 token 和上传时间
+        self.capture_mode_combo = QComboBox()
+        for label, mode in (("桌宠所在的屏幕", "pet_monitor"), ("光标所在的屏幕", "cursor_monitor"),
+                            ("前台窗口（仅 Windows）", "active_window"), ("每块屏幕各一张", "tiles"),
+                            ("所有屏幕拼成一张", "all")):
+            self.capture_mode_combo.addItem(label, mode)
+        layout.addRow("截图范围", self.capture_mode_combo)
         
         return group
 
@@ -194,12 +295,17 @@ class SettingsDialog(QDialog):
         self.model_edit.setText(self.sm.get("llm", "model", default="") or "")
         self.max_tokens.setValue(self.sm.get("llm", "max_tokens", default=512))
         self.history_spin.setValue(self.sm.get("llm", "history_rounds", default=6))
+        self.prompt_budget_spin.setValue(self.sm.get("llm", "prompt_budget", default=24000))
+        self.cache_layout_cb.setChecked(self.sm.get("llm", "prompt_layout", default="cache") == "cache")
         self.temperature_spinbox.setValue(self.sm.get("llm", "temperature", default=1.0))
+        self.stream_cb.setChecked(bool(self.sm.get("llm", "stream", default=True)))
 
         # 加载视觉模型设置
         self.vision_api_url.setText(self.sm.get("vision", "api_url", default=""))
         self.vision_api_key.setText(self.sm.get("vision", "api_key", default=""))
         self.vision_model.setText(self.sm.get("vision", "model", default="Qwen/Qwen3-VL-32B-Instruct"))
+        index = self.capture_mode_combo.findData(self.sm.get("vision", "capture_mode", default="pet_monitor"))
+        self.capture_mode_combo.setCurrentIndex(max(index, 0))
 
     # ---------- 保存配置 ----------
     def _on_save(self):
@@ -222,7 +328,10 @@ class SettingsDialog(QDialog):
         self.sm.set("llm", "model", value=self.model_edit.text().strip())
         self.sm.set("llm", "max_tokens", value=int(self.max_tokens.value()))
         self.sm.set("llm", "history_rounds", value=int(self.history_spin.value()))
+        self.sm.set("llm", "prompt_budget", value=int(self.prompt_budget_spin.value()))
+        self.sm.set("llm", "prompt_layout", value="cache" if self.cache_layout_cb.isChecked() else "inline")
         self.sm.set("llm", "temperature", value=self.temperature_spinbox.value())
+        self.sm.set("llm", "stream", value=self.stream_cb.isChecked())
 
         # 保存视觉模型设置
         vision_api_url = self.vision_api_url.text().strip().rstrip("/")
@@ -236,6 +345,7 @@ class SettingsDialog(QDialog):
         self.sm.set("vision", "api_url", value=vision_api_url)
         self.sm.set("vision", "api_key", value=self.vision_api_key.text())
         self.sm.set("vision", "model", value=self.vision_model.text())
+        self.sm.set("vision", "capture_mode", value=self.capture_mode_combo.currentData())
 
         self.sm.save()
         self.accept()
@@ -34,8 +34,21 @@ class AppTray:
 
         self.tray.setContextMenu(self.menu)
         self.tray.activated.connect(self._on_activated)
+        self.tray.setToolTip("因陀罗")
+        # 知识库加载进度显示在托盘提示里
+        chat_manager = getattr(pet_window, "chat_manager", None)
+        if chat_manager is not None and hasattr(chat_manager, "knowledge_state_changed"):
+            chat_manager.knowledge_state_changed.connect(self._on_knowledge_state_changed)
         self.tray.show()
 
+    def _on_knowledge_state_changed(self, state: str, progress: int, message: str):
+        if state == "loading":
+            self.tray.setToolTip(f"因陀罗 - 记忆预热中 {progress}%")
+        elif state == "failed":
+            self.tray.setToolTip(f"因陀罗 - 记忆库{message}")
+        else:
+            self.tray.setToolTip("因陀罗")
+
     @staticmethod
     def create_main_menu(app, pet_window):
         menu = QMenu()
@@ -0,0 +1,361 @@
+# src/http_transport.py
+"""
+共享 HTTP 传输层（ChatManager 与 QwenVisionClient 共用）
+- 每个端点（scheme://host:port）一个连接池，保持 keep-alive，避免每次对话/截图都重新握手
+- 连接/读取超时可在 settings 的 network 段配置
+- 可选 HTTP/2（需要安装 httpx 与 h2，未安装时自动回退到 requests）
+- 统计每个端点的请求数与新建连接数，用于确认连接确实被复用
+- 请求可以传入 on_connection 回调：拿到本次请求所用的连接时交给调用方一个「中止」函数，
+  另一个线程调用它即可立即关闭这条连接（对冲请求中输掉的一路，不必等读取超时）；请求结束时回调 None
+"""
+import socket
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+ConnectionCallback = Callable[[Callable[[], None] | None], None]
+
+# 当前线程里正在发出的请求想要拿到的连接（连接池是共享的，按线程区分）
+_connection_hook: ContextVar[ConnectionCallback | None] = ContextVar("connection_hook", default=None)
+
+_httpx = None
+_httpx_checked = False
+
+
+def _load_httpx():
+    """httpx 为可选依赖，且只在开启 HTTP/2 时使用：第一次用到时才导入，不拖慢启动"""
+    global _httpx, _httpx_checked
+    if not _httpx_checked:
+        _httpx_checked = True
+        try:
+            import httpx
+            _httpx = httpx
+        except ImportError:
+            _httpx = None
+    return _httpx
+
+
+def _abort_connection(conn):
+    """从其他线程关闭连接：先 shutdown 让阻塞在 recv 上的线程立即返回，再关闭"""
+    sock = getattr(conn, "sock", None)
+    if sock is not None:
+        try:
+            # 直接对底层套接字 shutdown，绕过 SSLSocket 的包装（不动正在读取的 SSL 对象）
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+    conn.close()
+
+
+class _Lease:
+    """一次借出的连接：归还连接池之前作废，之后的中止调用不会碰到已经借给别的请求的连接"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._active = True
+
+    def abort(self):
+        with self._lock:
+            if self._active:
+                _abort_connection(self.conn)
+
+    def revoke(self):
+        # 正在进行的 abort 做完之后才返回
+        with self._lock:
+            self._active = False
+
+
+class _HookedPoolMixin:
+    """
+    取出连接时把中止函数交给当前线程登记的回调；归还时先作废
+    （响应体读完时 urllib3 自己就会归还连接，早于调用方注销回调）
+    """
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        hook = _connection_hook.get()
+        if hook is not None:
+            lease = _Lease(conn)
+            conn._pet_lease = lease
+            hook(lease.abort)
+        return conn
+
+    def _put_conn(self, conn):
+        lease = conn.__dict__.pop("_pet_lease", None) if conn is not None else None
+        if lease is not None:
+            lease.revoke()
+        super()._put_conn(conn)
+
+
+class _HookedHTTPConnectionPool(_HookedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _HookedHTTPSConnectionPool(_HookedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused": max(0, self.requests - self.new_connections),
+        }
+
+
+class _HttpxStreamResponse:
+    """把 httpx 的流式响应包装成与 requests.Response 相同的用法"""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self.headers = resp.headers
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self._resp.iter_lines():
+            yield line if decode_unicode else line.encode("utf-8")
+
+    def json(self):
+        self._resp.read()
+        return self._resp.json()
+
+
+class HttpTransport:
+    def __init__(self, settings_manager=None):
+        self.sm = settings_manager
+        self._lock = threading.Lock()
+        self._sessions: dict[str, requests.Session] = {}
+        self._http2_clients: dict = {}
+        self._stats: dict[str, _EndpointStats] = {}
+
+    # ---------- 配置 ----------
+    def _get(self, key: str, default):
+        if not self.sm:
+            return default
+        return self.sm.get("network", key, default=default)
+
+    def _timeout(self, read_timeout: float | None = None) -> tuple[float, float]:
+        connect_s = float(self._get("connect_timeout_s", 10))
+        read_s = float(read_timeout if read_timeout is not None else self._get("read_timeout_s", 120))
+        return connect_s, read_s
+
+    def _use_http2(self) -> bool:
+        return bool(self._get("http2", False)) and _load_httpx() is not None
+
+    @staticmethod
+    def _endpoint(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    # ---------- 连接池 ----------
+    def _session_for(self, endpoint: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(endpoint)
+            if session is None:
+                pool_size = int(self._get("pool_maxsize", 4))
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=max(1, pool_size),
+                    max_retries=0,
+                )
+                adapter.poolmanager.pool_classes_by_scheme = {
+                    "http": _HookedHTTPConnectionPool,
+                    "https": _HookedHTTPSConnectionPool,
+                }
+                session = requests.Session()
+                session.mount(endpoint, adapter)
+                self._sessions[endpoint] = session
+                self._stats.setdefault(endpoint, _EndpointStats())
+            return session
+
+    def _http2_client_for(self, endpoint: str):
+        httpx = _load_httpx()
+        with self._lock:
+            client = self._http2_clients.get(endpoint)
+            if client is None:
+                pool_size = int(self._get("pool_maxsize", 4))
+                try:
+                    client = httpx.Client(
+                        http2=True,
+                        limits=httpx.Limits(max_connections=max(1, pool_size)),
+                    )
+                except ImportError:
+                    # 安装了 httpx 但没有 h2
+                    client = httpx.Client(
+                        limits=httpx.Limits(max_connections=max(1, pool_size)),
+                    )
+                    print("[HttpTransport] 未安装 h2，HTTP/2 不可用，使用 HTTP/1.1")
+                self._http2_clients[endpoint] = client
+                self._stats.setdefault(endpoint, _EndpointStats())
+            return client
+
+    # 统计计数会被多个线程同时修改（对冲请求的各路、视觉请求），都在 self._lock 下进行
+    def _httpx_trace(self, endpoint: str):
+        stats = self._stats[endpoint]
+
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                with self._lock:
+                    stats.new_connections += 1
+                    count = stats.new_connections
+                print(f"[HttpTransport] 新建连接 → {endpoint}（第 {count} 次）")
+
+        return trace
+
+    def _count_request(self, endpoint: str):
+        """httpx 路径：新建连接数由 _httpx_trace 统计"""
+        with self._lock:
+            self._stats[endpoint].requests += 1
+
+    def _record_request(self, endpoint: str):
+        """requests 路径：从 urllib3 连接池读取新建连接数"""
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats.requests += 1
+            session = self._sessions.get(endpoint)
+            if session is None:
+                return
+            adapter = session.get_adapter(endpoint)
+            pools = adapter.poolmanager.pools
+            new_connections = 0
+            for key in list(pools.keys()):
+                try:
+                    new_connections += pools[key].num_connections
+                except KeyError:
+                    continue
+            grew = new_connections > stats.new_connections
+            stats.new_connections = max(stats.new_connections, new_connections)
+        if grew:
+            print(f"[HttpTransport] 新建连接 → {endpoint}（第 {new_connections} 次）")
+
+    # ---------- 请求 ----------
+    def post_json(self, url: str, headers: dict, payload: dict, read_timeout: float | None = None,
+                  on_connection: ConnectionCallback | None = None) -> dict:
+        """普通 POST，返回解析后的 JSON；HTTP 错误时抛出异常；on_connection 见模块说明"""
+        endpoint = self._endpoint(url)
+        timeout = self._timeout(read_timeout)
+
+        if self._use_http2():
+            httpx = _load_httpx()
+            client = self._http2_client_for(endpoint)
+            self._count_request(endpoint)
+            resp = client.post(
+                url, headers=headers, json=payload,
+                timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+                extensions={"trace": self._httpx_trace(endpoint)},
+            )
+            resp.raise_for_status()
+            return resp.json()
+
+        session = self._session_for(endpoint)
+        token = _connection_hook.set(on_connection)
+        try:
+            # stream=True：响应体由这里读取，读完、注销之后才归还连接
+            # （stream=False 时 requests 读完就把连接放回池里，注销之前这条连接可能已经属于别的请求）
+            resp = session.post(url, headers=headers, json=payload, stream=True, timeout=timeout)
+        except BaseException:
+            if on_connection is not None:
+                on_connection(None)
+            raise
+        finally:
+            _connection_hook.reset(token)
+        with resp:
+            try:
+                resp.content
+            finally:
+                if on_connection is not None:
+                    on_connection(None)
+        self._record_request(endpoint)
+        resp.raise_for_status()
+        return resp.json()
+
+    @contextmanager
+    def stream_post(self, url: str, headers: dict, payload: dict, read_timeout: float | None = None,
+                    on_connection: ConnectionCallback | None = None):
+        """
+        流式 POST：yield 一个带 headers / iter_lines() / json() 的响应对象，
+        退出时释放连接回连接池；on_connection 见模块说明
+        （HTTP/2 下连接由多个请求共用，只能在收到响应头之后关闭本请求的流）
+        """
+        endpoint = self._endpoint(url)
+        timeout = self._timeout(read_timeout)
+
+        if self._use_http2():
+            httpx = _load_httpx()
+            client = self._http2_client_for(endpoint)
+            self._count_request(endpoint)
+            with client.stream(
+                "POST", url, headers=headers, json=payload,
+                timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+                extensions={"trace": self._httpx_trace(endpoint)},
+            ) as resp:
+                if on_connection is not None:
+                    on_connection(resp.close)
+                try:
+                    resp.raise_for_status()
+                    yield _HttpxStreamResponse(resp)
+                finally:
+                    if on_connection is not None:
+                        on_connection(None)
+            return
+
+        session = self._session_for(endpoint)
+        token = _connection_hook.set(on_connection)
+        try:
+            resp = session.post(url, headers=headers, json=payload, stream=True, timeout=timeout)
+        except BaseException:
+            if on_connection is not None:
+                on_connection(None)
+            raise
+        finally:
+            _connection_hook.reset(token)
+        with resp:
+            try:
+                self._record_request(endpoint)
+                resp.raise_for_status()
+                yield resp
+            finally:
+                # 先注销再归还连接：归还之后这条连接可能已经属于别的请求
+                if on_connection is not None:
+                    on_connection(None)
+
+    # ---------- 统计 ----------
+    def stats(self) -> dict[str, dict]:
+        """{端点: {requests, new_connections, reused}}"""
+        with self._lock:
+            return {ep: st.as_dict() for ep, st in self._stats.items()}
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            for client in self._http2_clients.values():
+                client.close()
+            self._sessions.clear()
+            self._http2_clients.clear()
+
+
+_shared_transport: HttpTransport | None = None
+_shared_lock = threading.Lock()
+
+
+def get_transport(settings_manager=None) -> HttpTransport:
+    """获取进程内共享的 HttpTransport（首次调用时传入的 settings_manager 生效）"""
+    global _shared_transport
+    with _shared_lock:
+        if _shared_transport is None:
+            _shared_transport = HttpTransport(settings_manager)
+        elif settings_manager is not None and _shared_transport.sm is None:
+            _shared_transport.sm = settings_manager
+        return _shared_transport
@@ -1,39 +1,122 @@
-import requests
 import os
-import random
 import threading
+import time
 import json  # 新增：用于读写文件修改时间记录
 from pathlib import Path
-from llama_index.core.schema import Document
-from llama_index.core import (
-    VectorStoreIndex,
-    SimpleDirectoryReader,
-    StorageContext,
-    load_index_from_storage,
-)
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from typing import NamedTuple
+from urllib.parse import urlsplit
+import numpy as np
+from PySide6.QtCore import QObject, Signal
 from utils import resource_path
+from http_transport import get_transport
+from tracing import Span, get_tracer
+from llm.style_pool import StyleSampler
+from llm.embedding_cache import QueryEmbeddingCache
+from llm.index_manifest import compute_file_hashes, diff_manifest, load_manifest, save_manifest
+from llm.vector_store import MmapVectorStore, RetrievedChunk, mmr_select
+from llm.lexical_index import BM25Index, reciprocal_rank_fusion
+from llm.entity_index import GLOSSARY_FILE, EntityIndex, Glossary
+from llm.chunk_dedup import group_near_duplicates
+from llm.index_builder import (LORE_CHUNK_OVERLAP, LORE_CHUNK_SIZE, MIN_CHUNK_SIZE, ChunkedFile, chunk_files,
+                               cpu_budget, embed_in_batches)
+from llm.prompt_builder import (DEFAULT_PRIORITY, LAYOUT_CACHE, PromptParts, TokenCounter, assemble_prompt,
+                                format_usage)
+from llm.prompt_cache import PromptCacheStats, format_cache_usage, parse_cache_usage
+from llm.endpoint_router import Attempt, Endpoint, EndpointRouter
+from llm.summarizer import ConversationSummarizer
+from memory.conversation_log import ConversationLog
 
-class ChatManager:
-    def __init__(self, settings_manager, persona_path: str):
+# llama_index / torch / transformers 只在后台索引线程里导入（首次导入约 1 秒以上），
+# 本模块在 GUI 线程中被导入时不会拖慢桌宠窗口的首帧
+
+class IndexSpec(NamedTuple):
+    name: str
+    data_dir: Path
+    persist_dir: Path
+    is_lore: bool = False
+    with_lexical: bool = False
+
+
+class KnowledgeContext(NamedTuple):
+    lore: list[str]   # 按检索排名
+    style: list[str]
+    memory: list[str]  # 从对话日志召回的旧对话
+
+
+# 知识库（索引）状态
+KNOWLEDGE_IDLE = "idle"        # 尚未开始加载
+KNOWLEDGE_LOADING = "loading"  # 后台线程加载 / 构建中
+KNOWLEDGE_READY = "ready"
+KNOWLEDGE_FAILED = "failed"
+
+
+class ChatManager(QObject):
+    # 知识库状态变化：(状态, 进度 0~100, 说明)；在后台线程发出，跨线程自动排队到 GUI 线程
+    knowledge_state_changed = Signal(str, int, str)
+
+    def __init__(self, settings_manager, persona_path: str, autostart: bool = True):
+        super().__init__()
         self.sm = settings_manager
         self.persona_path = resource_path(persona_path)
 
+        # 与视觉客户端共享的 keep-alive 连接池
+        self.transport = get_transport(self.sm)
+        # 分段计时：检索 / 提示词组装 / LLM 请求记入工作线程开启的 trace
+        self.tracer = get_tracer(self.sm)
+
         self.chat_history = []
+        # 对话与屏幕观察分别在各自的工作线程中读写历史，需要加锁
+        self._history_lock = threading.RLock()
         self._load_persona()
 
+        # 每一轮对话都写入本地 SQLite（后台线程批量提交），旧对话按相关性召回
+        self.conversation_log: ConversationLog | None = None
+        if self.sm.get("memory", "enabled", default=True):
+            self.conversation_log = ConversationLog(
+                resource_path("src/memory/conversation.db"),
+                batch_size=int(self.sm.get("memory", "batch_size", default=32)),
+                flush_interval_s=float(self.sm.get("memory", "flush_interval_s", default=2.0)),
+            )
+
+        # 被挤出历史的旧对话在回复送达后由后台线程压缩成滚动摘要
+        self.summarizer: ConversationSummarizer | None = None
+        if self.sm.get("summary", "enabled", default=True):
+            self.summarizer = ConversationSummarizer(
+                self._request_summary,
+                max_chars=int(self.sm.get("summary", "max_chars", default=300)),
+                max_tokens=int(self.sm.get("summary", "max_tokens", default=400)),
+            )
+
         # ========== 知识库初始化 ==========
         self.knowledge_dir = Path(resource_path("src/llm/knowledge"))
         self.knowledge_db_dir = Path(resource_path("src/llm/knowledge_db"))
         
         # 初始化索引（异步执行，避免启动卡顿）
-        self.lore_index = None
-        self.style_index = None
-        self.style_sample_history = []  # 记录近期抽取的style内容，降低重复频率
-        index_thread = threading.Thread(target=self._init_indices_async)
-        index_thread.daemon = True
-        index_thread.start()
+        self.lore_index: MmapVectorStore | None = None
+        self.lore_lexical: BM25Index | None = None  # 与 lore_index 行号对齐的 n-gram BM25 索引
+        self.lore_entities: EntityIndex | None = None  # 译名对照表 → 实体所在分块
+        self.query_cache: QueryEmbeddingCache | None = None
+        self.style_index: MmapVectorStore | None = None
+        self.style_sampler: StyleSampler | None = None  # 加载 Style 索引后一次性构建
+        self.knowledge_state = KNOWLEDGE_IDLE
+        self.knowledge_progress = 0
+        self.knowledge_message = ""
+        self._knowledge_done = threading.Event()  # 就绪或失败时置位，检索线程据此等待
+        self._index_thread: threading.Thread | None = None
+        self._chunk_pool = None  # 重建索引时的分块进程池（只在 _load_or_build_all 期间存在）
+        self._token_counter: TokenCounter | None = None  # 随设置中的模型名切换
+        self.prompt_cache_stats = PromptCacheStats()  # 提供方返回的前缀缓存命中情况
+        self._router: EndpointRouter | None = None  # 多端点路由 + 对冲请求，首次请求时创建
+        if autostart:
+            self.start()
+
+    def start(self):
+        """启动后台索引初始化（重复调用无效）；PetWindow 在窗口显示之后才调用"""
+        if self._index_thread is not None:
+            return
+        self._index_thread = threading.Thread(target=self._init_indices_async, name="IndexInit")
+        self._index_thread.daemon = True
+        self._index_thread.start()
 
     # ---------- Persona（原有逻辑，无改动） ----------
     def _load_persona(self):
@@ -50,7 +133,54 @@ class ChatManager:
             f"你必须始终称呼用户为「{user_name}」，不要使用其他称呼。"
         )
     
+    # ---------- 知识库状态 ----------
+    def _set_knowledge_state(self, state: str, progress: int, message: str):
+        self.knowledge_state = state
+        self.knowledge_progress = progress
+        self.knowledge_message = message
+        print(f"[ChatManager] 知识库{message}（{progress}%）")
+        if state in (KNOWLEDGE_READY, KNOWLEDGE_FAILED):
+            self._knowledge_done.set()
+        self.knowledge_state_changed.emit(state, progress, message)
+
+    def wait_until_ready(self, timeout: float | None = None) -> bool:
+        """等待索引加载结束（就绪或失败）；返回是否已就绪"""
+        if self.knowledge_state == KNOWLEDGE_IDLE:
+            return False
+        self._knowledge_done.wait(timeout)
+        return self.knowledge_state == KNOWLEDGE_READY
+
+    def _await_knowledge(self):
+        """
+        检索前的等待策略（knowledge.when_loading）：
+        - wait：最多等待 wait_timeout_s 秒，超时仍按无知识库回答
+        - skip：不等待，直接按无知识库回答
+        """
+        if self._knowledge_done.is_set():
+            return
+        policy = self.sm.get("knowledge", "when_loading", default="wait")
+        if policy == "wait":
+            timeout = float(self.sm.get("knowledge", "wait_timeout_s", default=20))
+            print(f"[ChatManager] 知识库加载中，最多等待 {timeout:.0f}s")
+            if self.wait_until_ready(timeout):
+                return
+        print(f"[ChatManager] 知识库未就绪（{self.knowledge_state}），本轮回复不参考剧情记忆")
+
     def _init_indices_async(self):
+        """后台线程入口：加载索引并维护知识库状态"""
+        self._set_knowledge_state(KNOWLEDGE_LOADING, 0, "开始加载")
+        try:
+            # 分词器编码提前开始在后台加载（不等它），首轮对话多半已经能用上
+            self._get_token_counter()
+            self._load_indices()
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self._set_knowledge_state(KNOWLEDGE_FAILED, self.knowledge_progress, f"加载失败：{e}")
+            return
+        self._set_knowledge_state(KNOWLEDGE_READY, 100, "已就绪")
+
+    def _load_indices(self):
         """异步初始化索引，适配中日双语Embedding（兼容旧版本依赖）"""
         # multilingual-e5-small 原生支持中日双语，移除不兼容的encode_kwargs参数
         # ============== 第一处修改：添加禁用联网的环境变量 ==============
@@ -61,34 +191,109 @@ class ChatManager:
         # 新增：适配打包后的路径（pyinstaller 打包后能找到模型）
         import sys
     
+        # 重量级依赖在这里（后台线程）才导入
+        self._set_knowledge_state(KNOWLEDGE_LOADING, 5, "导入依赖")
+        from llm.embedding_backends import create_embed_model
+
         # 核心简化：直接用 resource_path 获取模型路径，无需区分环境
         default_local_model = resource_path("multilingual-e5-small")
     
-        embed_model = HuggingFaceEmbedding(
-            model_name=self.sm.get(
-                "knowledge", "embedding_model",
-                default=default_local_model
-            )
+        model_name = self.sm.get(
+            "knowledge", "embedding_model",
+            default=default_local_model
         )
-        self.lore_index = self._load_or_build_index(
-            # 调整3：处理lore数据目录
-            data_dir=Path(resource_path("src/llm/knowledge/lore")),
-            # 调整4：处理lore索引持久化目录
-            persist_dir=Path(resource_path("src/llm/knowledge_db/lore")),
-            embed_model=embed_model,
-            name="Lore",
-            is_lore=True
+        # torch：HuggingFaceEmbedding；onnx：onnxruntime 直接推理附带的 ONNX 导出（不加载 torch）
+        self._set_knowledge_state(KNOWLEDGE_LOADING, 20, "加载嵌入模型")
+        embed_model = create_embed_model(
+            backend=self.sm.get("knowledge", "embedding_backend", default="torch"),
+            model_name=model_name,
+            onnx_file=self.sm.get("knowledge", "onnx_model_file", default="onnx/model.onnx"),
+            # 未单独设置时与构建线程上限一致，嵌入时不占满所有核心
+            num_threads=int(self.sm.get("knowledge", "embedding_threads", default=0))
+            or cpu_budget(int(self.sm.get("knowledge", "build_max_threads", default=0))),
+            embed_batch_size=int(self.sm.get("knowledge", "embed_batch_size", default=64)),
         )
-        self.style_index = self._load_or_build_index(
-            # 调整5：处理style数据目录
-            data_dir=Path(resource_path("src/llm/knowledge/style")),
-            # 调整6：处理style索引持久化目录
-            persist_dir=Path(resource_path("src/llm/knowledge_db/style")),
-            embed_model=embed_model,
-            name="Style",
-            is_lore=False
+
+        if self.conversation_log is not None and self.sm.get("memory", "embed_turns", default=False):
+            # 之后写入的每一轮都附带向量（在日志的写线程里计算）
+            self.conversation_log.embed_fn = embed_model.get_text_embedding
+
+        # 查询向量缓存：同一屏幕描述、重复的问候不必重复编码
+        cache_size = int(self.sm.get("knowledge", "query_cache_size", default=256))
+        persist_cache = bool(self.sm.get("knowledge", "query_cache_persist", default=True))
+        self.query_cache = QueryEmbeddingCache(
+            embed_model.get_query_embedding,
+            max_size=cache_size,
+            persist_path=(self.knowledge_db_dir / "query_cache.json") if persist_cache else None,
+            # 后端不同向量会有细微差异，查询前缀不同则完全不同，都要计入标识
+            model_key="|".join([
+                embed_model.class_name(),
+                Path(str(model_name)).name,
+                getattr(embed_model, "query_instruction", None) or "",
+            ]),
         )
 
+        self._set_knowledge_state(KNOWLEDGE_LOADING, 40, "加载剧情与语料索引")
+        lore_data_dir = Path(resource_path("src/llm/knowledge/lore"))
+        lore_persist_dir = Path(resource_path("src/llm/knowledge_db/lore"))
+        indices = self._load_or_build_all([
+            # 调整3/4：lore 数据目录与索引持久化目录
+            IndexSpec("Lore", lore_data_dir, lore_persist_dir, is_lore=True, with_lexical=True),
+            # 调整5/6：style 数据目录与索引持久化目录
+            IndexSpec("Style", Path(resource_path("src/llm/knowledge/style")),
+                      Path(resource_path("src/llm/knowledge_db/style"))),
+        ], embed_model)
+        self.lore_index, self.lore_lexical = indices["Lore"]
+        self.style_index, _ = indices["Style"]
+
+        self._set_knowledge_state(KNOWLEDGE_LOADING, 90, "加载实体索引")
+        if self.lore_index:
+            self.lore_entities = self._load_or_build_entities(self.lore_index, lore_data_dir, lore_persist_dir)
+        if self.style_index:
+            # 台词在运行期间不会变化：筛选一次，之后每轮对话直接抽样
+            self.style_sampler = StyleSampler.from_texts(
+                self.style_index.iter_texts(),
+                min_len=20, max_len=300, history_size=15
+            )
+            print(f"[ChatManager] Style 语料池就绪，共 {len(self.style_sampler)} 条")
+
+    def _load_or_build_all(self, specs: list[IndexSpec], embed_model) -> dict[str, tuple]:
+        """
+        同时加载 / 构建多个集合（Lore 与 Style 互不依赖）
+        - 需要重建时，读取 + 分块交给共享的进程池（knowledge.build_workers，0 = 自动）
+        - 进程数与嵌入线程数都受 knowledge.build_max_threads 限制，给界面线程留出 CPU
+        """
+        parallel = bool(self.sm.get("knowledge", "parallel_build", default=True))
+        workers = int(self.sm.get("knowledge", "build_workers", default=0))
+        budget = cpu_budget(int(self.sm.get("knowledge", "build_max_threads", default=0)))
+        workers = min(workers, budget) if workers > 0 else budget
+        if workers > 1:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn：子进程不继承 Qt / 模型线程；只在真正需要分块时才会启动
+            self._chunk_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+        def load(spec: IndexSpec):
+            return spec.name, self._load_or_build_index(
+                data_dir=spec.data_dir,
+                persist_dir=spec.persist_dir,
+                embed_model=embed_model,
+                name=spec.name,
+                is_lore=spec.is_lore,
+                with_lexical=spec.with_lexical
+            )
+
+        try:
+            if parallel and len(specs) > 1:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=len(specs), thread_name_prefix="IndexBuild") as executor:
+                    return dict(executor.map(load, specs))
+            return dict(load(spec) for spec in specs)
+        finally:
+            if self._chunk_pool is not None:
+                self._chunk_pool.shutdown()
+                self._chunk_pool = None
+
     def _get_data_dir_mtime(self, data_dir: Path) -> float:
         """辅助函数：计算数据目录下所有文件的最后修改时间总和（用于检测更新）"""
         total_mtime = 0.0
@@ -100,159 +305,420 @@ class ChatManager:
                     continue
         return total_mtime
 
-    def _load_or_build_index(self, data_dir: Path, persist_dir: Path, embed_model, name: str, is_lore: bool = False):
-        if not data_dir.exists():
-            print(f"[ChatManager] {name} 目录不存在，跳过")
+    @staticmethod
+    def _read_index_record(mtime_file: Path) -> dict | None:
+        try:
+            with open(mtime_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
             return None
 
-        # ========== 新增：检测数据文件更新 ==========
-        mtime_file = persist_dir / "data_mtime.json"  # 记录数据文件最后修改时间的文件
-        current_mtime = self._get_data_dir_mtime(data_dir)
-        need_rebuild = False  # 是否需要重建索引
+    @staticmethod
+    def _write_index_records(persist_dir: Path, mtime_file: Path, current_mtime: float, manifest: dict,
+                             chunking: list[int] | None = None):
+        persist_dir.mkdir(parents=True, exist_ok=True)
+        save_manifest(persist_dir, manifest)
+        record = {"total_mtime": current_mtime}
+        if chunking is not None:
+            record["chunking"] = chunking
+        with open(mtime_file, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+
+    def _chunking(self, is_lore: bool) -> list[int] | None:
+        """
+        Lore 的 [分块长度, 重叠]（knowledge.lore_chunk_size / lore_chunk_overlap）；Style 用固定参数，返回 None
+        不合法的值（非数字、分块过短、重叠不小于分块长度）会让 SentenceSplitter 在建索引时抛异常，
+        这里夹到可用范围并提示，而不是让整个索引构建失败
+        """
+        if not is_lore:
+            return None
+        raw_size = self.sm.get("knowledge", "lore_chunk_size", default=LORE_CHUNK_SIZE)
+        raw_overlap = self.sm.get("knowledge", "lore_chunk_overlap", default=LORE_CHUNK_OVERLAP)
+        try:
+            size = int(raw_size)
+        except (TypeError, ValueError):
+            size = LORE_CHUNK_SIZE
+        try:
+            overlap = int(raw_overlap)
+        except (TypeError, ValueError):
+            overlap = LORE_CHUNK_OVERLAP
+        size = max(MIN_CHUNK_SIZE, size)
+        # 重叠超过一半时分块数量成倍增加，索引体积与构建时间随之膨胀
+        overlap = min(max(0, overlap), size // 2)
+        if [size, overlap] != [raw_size, raw_overlap]:
+            print(f"[ChatManager] ⚠️ Lore 分块设置不可用（lore_chunk_size={raw_size!r}，"
+                  f"lore_chunk_overlap={raw_overlap!r}），改用 {size} / {overlap}")
+        return [size, overlap]
+
+    def _build_store(self, chunked_files: list[ChunkedFile], embed_model, name: str,
+                     existing: MmapVectorStore | None = None) -> MmapVectorStore:
+        """
+        近重复合并 + 分批嵌入，把分块结果生成（尚未落盘的）向量库
+        existing：增量更新时保留下来的旧分块。新分块与它们一起做近重复合并，与旧分块重复的只记进旧分块的
+        duplicates、不再嵌入；返回旧分块在前、新分块在后的完整向量库，与全量重建的合并结果一致
+        """
+        dtype = self.sm.get("knowledge", "vector_dtype", default="float32")
+        texts = [t for f in chunked_files for t in f.texts]
+        metadatas = [m for f in chunked_files for m in f.metadatas]
+        embed_texts = [t for f in chunked_files for t in f.embed_texts]
+        into_existing: dict[int, list[dict]] = {}
+
+        # 近重复分块（副本文件、重复章节）只嵌入一次，来源记在保留分块的 duplicates 里
+        if texts and self.sm.get("knowledge", "dedup", default=True):
+            threshold = float(self.sm.get("knowledge", "dedup_threshold", default=0.85))
+            existing_texts = list(existing.iter_texts()) if existing is not None else []
+            n_existing = len(existing_texts)
+            groups = []
+            for group in group_near_duplicates(existing_texts + texts, threshold=threshold):
+                new_members = [i - n_existing for i in group if i >= n_existing]
+                if not new_members:
+                    continue
+                if group[0] < n_existing:
+                    # 组里有旧分块（下标在前，必为组内第一个）：新分块并入它
+                    into_existing.setdefault(group[0], []).extend(metadatas[i] for i in new_members)
+                else:
+                    groups.append(new_members)
+            merged = sum(len(v) for v in into_existing.values())
+            saved = len(texts) - len(groups)
+            print(f"[ChatManager] {name} 近重复合并：分块 {len(texts)} → {len(groups)}，省去嵌入 {saved} 次"
+                  + (f"（其中 {merged} 个与未变化的分块重复）" if merged else ""))
+            if saved:
+                kept_metadatas = []
+                for group in groups:
+                    metadata = dict(metadatas[group[0]])
+                    if len(group) > 1:
+                        metadata["duplicates"] = [metadatas[i] for i in group[1:]]
+                    kept_metadatas.append(metadata)
+                texts = [texts[g[0]] for g in groups]
+                embed_texts = [embed_texts[g[0]] for g in groups]
+                metadatas = kept_metadatas
+
+        batch_size = int(self.sm.get("knowledge", "embed_batch_size", default=64))
+        embeddings = embed_in_batches(embed_model, embed_texts, batch_size=batch_size) if texts else []
+        new_store = MmapVectorStore.from_records(
+            texts=texts,
+            metadatas=metadatas,
+            embeddings=embeddings,
+            dtype=dtype,
+        )
+        if existing is None:
+            return new_store
+        if into_existing:
+            existing = existing.with_duplicates(into_existing)
+        return existing.extend(new_store)
+
+    def _update_index_incrementally(self, store: MmapVectorStore, lexical: BM25Index | None, data_dir: Path,
+                                    manifest: dict, hashes: dict,
+                                    added: list[str], changed: list[str], removed: list[str],
+                                    embed_model, name: str, is_lore: bool):
+        """只处理变化的文件：删除旧分块，重新分块并嵌入新内容；返回 (新向量库, 新 BM25 索引, 新清单)"""
+        manifest = dict(manifest)
+
+        stale_doc_ids = set()
+        for rel in removed + changed:
+            stale_doc_ids.update(manifest.get(rel, {}).get("doc_ids", []))
+            manifest.pop(rel, None)
+
+        # 先复制到内存并释放文件映射，之后才能覆盖写回
+        store = store.materialize()
+
+        # 与变化文件共用分块（近重复合并）的未变文件也要重新分块，否则删掉共用分块后内容会丢失
+        doc_file = {doc_id: rel for rel, entry in manifest.items() for doc_id in entry.get("doc_ids", [])}
+        reread = []
+        while True:
+            shared_files = {doc_file[d] for d in store.docs_sharing_rows(stale_doc_ids) if d in doc_file}
+            shared_files.difference_update(reread)
+            if not shared_files:
+                break
+            for rel in sorted(shared_files):
+                stale_doc_ids.update(manifest.pop(rel).get("doc_ids", []))
+                reread.append(rel)
+
+        chunked = chunk_files(data_dir, added + changed + reread, is_lore, self._chunk_pool,
+                              *(self._chunking(is_lore) or ()))
+
+        keep_rows = store.rows_without_docs(stale_doc_ids)
+        store = store.take(keep_rows)
+        if chunked:
+            # 新分块与保留的旧分块一起做近重复合并，结果与全量重建一致
+            store = self._build_store(list(chunked.values()), embed_model, name, existing=store)
+        embedded = len(store) - len(keep_rows)
+        if lexical is not None:
+            # 行号变化与向量库一致，只有新分块需要分词（并入旧分块的重复只改了元数据，正文不变）
+            new_texts = [store.get_text(row) for row in range(len(keep_rows), len(store))]
+            lexical = lexical.materialize().update(keep_rows, new_texts)
+
+        for rel, chunked_file in chunked.items():
+            manifest[rel] = {"sha256": hashes[rel], "doc_ids": chunked_file.doc_ids}
 
-        # 检查是否需要重建索引
-        if persist_dir.exists():
+        print(
+            f"[ChatManager] {name} 增量更新：新增 {len(added)}，修改 {len(changed)}，"
+            f"删除 {len(removed)}，连带重建 {len(reread)}，重新嵌入分块 {embedded}"
+        )
+        return store, lexical, manifest
+
+    def _load_or_build_lexical(self, store: MmapVectorStore, persist_dir: Path, name: str) -> BM25Index:
+        """加载与向量库同步的 BM25 索引；不存在或与向量库不同步时由分块正文重建（无需嵌入）"""
+        if BM25Index.exists(persist_dir):
             try:
-                # 读取已保存的修改时间
-                with open(mtime_file, "r", encoding="utf-8") as f:
-                    saved_mtime = json.load(f).get("total_mtime", 0.0)
-                # 对比时间：如果当前数据文件修改时间总和不同，说明有更新
-                if abs(current_mtime - saved_mtime) > 0.1:  # 浮点精度容错
-                    print(f"[ChatManager] {name} 数据文件已更新，将重建索引")
-                    need_rebuild = True
-            except (FileNotFoundError, json.JSONDecodeError):
-                # 无记录文件/文件损坏 → 重建并生成新记录
-                print(f"[ChatManager] {name} 无更新记录/记录损坏，将重建索引")
-                need_rebuild = True
-        else:
-            # 无索引目录 → 首次构建
-            need_rebuild = True
-
-        # ========== 原有分块逻辑（完全保留） ==========
-        if is_lore:
-            # Lore：通用剧情/事实分块，优先按空行拆分
-            node_parser = SentenceSplitter(
-                chunk_size=1000,
-                chunk_overlap=150,
-                # 仅用单个字符串（旧版本要求）
-                paragraph_separator="\n\n",
-                separator="。"  # 中文核心句子分隔符（单个字符串）
-            )
-            reader = SimpleDirectoryReader(
-                str(data_dir),
-                recursive=True,
-                encoding="utf-8",
-                # 关键修正：将字符串路径转Path对象后再取name
-                file_metadata=lambda file_path: {"file_name": Path(file_path).name}
-            )
-        else:
-            # Style：日文语料分块，适配短台词
-            node_parser = SentenceSplitter(
-                chunk_size=300,
-                chunk_overlap=50,
-                # 仅用单个字符串（旧版本要求）
-                paragraph_separator="\n",
-                separator="、"  # 日文核心句子分隔符（单个字符串）
-            )
-            reader = SimpleDirectoryReader(
-                str(data_dir),
-                recursive=True,
-                encoding="utf-8"
-            )
+                lexical = BM25Index.load(persist_dir)
+                if lexical.build_id == store.build_id and len(lexical) == len(store):
+                    return lexical
+                print(f"[ChatManager] {name} BM25 索引与向量库不同步，将重建")
+            except Exception as e:
+                print(f"[ChatManager] 加载{name} BM25 索引失败：{e}，将重建")
+        lexical = BM25Index.build(store.iter_texts(), build_id=store.build_id)
+        lexical.save(persist_dir)
+        print(f"[ChatManager] 构建 {name} BM25 索引，词项数 {len(lexical.terms)}")
+        return lexical
 
-        # ========== 加载/重建索引逻辑（新增更新检测） ==========
-        if persist_dir.exists() and not need_rebuild:
+    def _load_or_build_entities(self, store: MmapVectorStore, data_dir: Path, persist_dir: Path) -> EntityIndex | None:
+        """编译译名对照表，加载或重建 实体 → 分块 倒排表（只做字符串匹配，无需嵌入）"""
+        glossary = Glossary.load(data_dir / GLOSSARY_FILE)
+        if glossary is None:
+            print("[ChatManager] 未找到译名对照表，跳过实体索引")
+            return None
+        entities = EntityIndex.load(glossary, persist_dir)
+        if entities is not None and entities.build_id == store.build_id:
+            return entities
+        entities = EntityIndex.build(glossary, store.iter_texts(), build_id=store.build_id)
+        entities.save(persist_dir)
+        print(f"[ChatManager] 构建实体索引：写法 {len(glossary.surfaces)} 个，命中实体 {len(entities.postings)} 个")
+        return entities
+
+    def _route_query(self, query: str) -> tuple[str, np.ndarray | None]:
+        """
+        查询提到已知实体时：别名换成正式名用于嵌入，检索范围限定为这些实体所在的分块
+        返回 (用于嵌入的查询, 候选行号或 None)
+        """
+        if not self.lore_entities or not self.sm.get("knowledge", "entity_routing", default=True):
+            return query, None
+        entities = self.lore_entities.glossary.entities_in(query)
+        if not entities:
+            return query, None
+        rows = self.lore_entities.rows_for(entities)
+        print(f"[RAG-Entity] 实体 {'、'.join(entities)} → 候选分块 {len(rows)} / {len(self.lore_index)}")
+        return self.lore_entities.glossary.normalize(query), (rows if len(rows) else None)
+
+    def _load_or_build_index(self, data_dir: Path, persist_dir: Path, embed_model, name: str,
+                             is_lore: bool = False, with_lexical: bool = False):
+        """返回 (向量库, BM25 索引)；with_lexical=False 时 BM25 索引为 None"""
+        if not data_dir.exists():
+            print(f"[ChatManager] {name} 目录不存在，跳过")
+            return None, None
+
+        # ========== 检测数据文件更新 ==========
+        # data_mtime.json：修改时间总和，作为「什么都没变」的快速判断
+        # file_manifest.json：每个文件的内容哈希，修改时间变化后据此只处理真正变化的文件
+        mtime_file = persist_dir / "data_mtime.json"
+        current_mtime = self._get_data_dir_mtime(data_dir)
+        manifest = load_manifest(persist_dir) if persist_dir.exists() else None
+        record = self._read_index_record(mtime_file) or {}
+        chunking = self._chunking(is_lore)
+        # 没有记录的旧索引按默认分块参数生成
+        saved_chunking = record.get("chunking", [LORE_CHUNK_SIZE, LORE_CHUNK_OVERLAP] if is_lore else None)
+
+        store = None
+        if manifest is not None and chunking != saved_chunking:
+            print(f"[ChatManager] {name} 分块参数已变化（{saved_chunking} → {chunking}），将重建索引")
+        elif manifest is not None and MmapVectorStore.exists(persist_dir):
             try:
-                storage = StorageContext.from_defaults(persist_dir=str(persist_dir))
-                index = load_index_from_storage(storage, embed_model=embed_model)
-                print(f"[ChatManager] 加载已有 {name} Index")
-                return index
+                store = MmapVectorStore.load(persist_dir)
             except Exception as e:
                 print(f"[ChatManager] 加载{name} Index失败：{e}，将重建")
-                need_rebuild = True
+                store = None
+        elif persist_dir.exists():
+            # 旧版本生成的索引（llama_index JSON 格式 / 无文件清单）→ 重建一次
+            print(f"[ChatManager] {name} 索引格式已更新，将重建索引")
+
+        if store is not None:
+            lexical = self._load_or_build_lexical(store, persist_dir, name) if with_lexical else None
+            saved_mtime = record.get("total_mtime")
+            if saved_mtime is not None and abs(current_mtime - saved_mtime) <= 0.1:  # 浮点精度容错
+                print(f"[ChatManager] 加载已有 {name} Index，分块数 {len(store)}")
+                return store, lexical
 
-        # 重建索引（首次构建/数据更新/加载失败）
-        documents = reader.load_data()
-        if not documents:
+            # 修改时间变了：按内容哈希找出真正变化的文件
+            hashes = compute_file_hashes(data_dir)
+            added, changed, removed = diff_manifest(manifest, hashes)
+            if added or changed or removed:
+                store, lexical, manifest = self._update_index_incrementally(
+                    store, lexical, data_dir, manifest, hashes, added, changed, removed,
+                    embed_model, name, is_lore
+                )
+                store.save(persist_dir)
+                if lexical is not None:
+                    lexical.build_id = store.build_id
+                    lexical.save(persist_dir)
+            else:
+                print(f"[ChatManager] {name} 文件内容未变化（仅修改时间变化），直接加载")
+            self._write_index_records(persist_dir, mtime_file, current_mtime, manifest, chunking)
+            return store, lexical
+
+        # ========== 全量构建（首次构建/格式升级/加载失败） ==========
+        hashes = compute_file_hashes(data_dir)
+        chunked = chunk_files(data_dir, list(hashes), is_lore, self._chunk_pool, *(chunking or ()))
+        if not any(f.texts for f in chunked.values()):
             print(f"[ChatManager] {name} 目录为空")
-            return None
+            return None, None
 
-        index = VectorStoreIndex.from_documents(
-            documents,
-            embed_model=embed_model,
-            transformations=[node_parser],
-            show_progress=True
-        )
+        store = self._build_store(list(chunked.values()), embed_model, name)
 
-        # 保存索引 + 记录当前数据文件修改时间
-        index.storage_context.persist(persist_dir=str(persist_dir))
-        # 确保persist_dir存在（首次构建时创建）
-        persist_dir.mkdir(parents=True, exist_ok=True)
-        # 写入修改时间记录
-        with open(mtime_file, "w", encoding="utf-8") as f:
-            json.dump({"total_mtime": current_mtime}, f, ensure_ascii=False)
-        
-        print(f"[ChatManager] 构建 {name} Index，文档数 {len(documents)}")
-        return index
+        # 保存向量库 + 文件清单 + 修改时间记录
+        store.save(persist_dir)
+        manifest = {
+            rel: {"sha256": hashes[rel], "doc_ids": chunked_file.doc_ids}
+            for rel, chunked_file in chunked.items()
+        }
+        self._write_index_records(persist_dir, mtime_file, current_mtime, manifest, chunking)
+        lexical = self._load_or_build_lexical(store, persist_dir, name) if with_lexical else None
 
-    def _retrieve_knowledge(self, query: str) -> str:
+        print(f"[ChatManager] 构建 {name} Index，文件数 {len(chunked)}，分块数 {len(store)}")
+        return store, lexical
+
+    def _retrieve_knowledge(self, query: str) -> KnowledgeContext:
+        context = KnowledgeContext([], [], [])
         if not query.strip():
-            return ""
+            return context
+        with self.tracer.span("retrieval", query_chars=len(query)) as span:
+            self._fill_knowledge(query, context)
+            span.set(lore=len(context.lore), style=len(context.style), memory=len(context.memory))
+        return context
+
+    def _fill_knowledge(self, query: str, context: KnowledgeContext):
+        # 0. 旧对话召回只依赖 SQLite，不等索引加载
+        with self.tracer.span("memory_recall"):
+            context.memory.extend(self._recall_memory(query))
 
-        contexts = []
-        # 1. Lore：纯向量检索（优化参数适配旧版本）
+        # 在对话工作线程中调用：按策略等待索引加载，不阻塞 GUI
+        with self.tracer.span("knowledge_wait", state=self.knowledge_state):
+            self._await_knowledge()
+
+        # 1. Lore：向量检索 + n-gram BM25，倒数排名融合（专有名词靠 BM25 精确命中）
         if self.lore_index:
-            lore_engine = self.lore_index.as_retriever(
-                similarity_top_k=8,
-                similarity_cutoff=0.2
-            )
-            lore_nodes = lore_engine.retrieve(query)
-            
-            unique_nodes = []
-            seen_content = set()
-            for node in lore_nodes:
-                content = node.get_content().strip()
-                if content not in seen_content and len(content) > 50:
-                    seen_content.add(content)
-                    unique_nodes.append(node)
-
-            if unique_nodes:
-                contexts.append("【剧情记忆】")
-                for n in unique_nodes[:3]:
-                    contexts.append(n.get_content().strip())
-                    print(f"[RAG-Lore] 匹配结果：{n.score:.3f} | {n.get_content()[:50]}...")
-
-        # 2. Style：降低重复频率（核心逻辑保留）
-        if self.style_index:
+            with self.tracer.span("lore_search") as span:
+                query_embedding, candidates = self._search_lore(query)
+                span.set(candidates=len(candidates))
+            for n in self._select_lore(query_embedding, candidates):
+                context.lore.append(n.get_content().strip())
+                print(f"[RAG-Lore] 匹配结果：{n.score:.3f} | {n.get_content()[:50]}...")
+
+        # 2. Style：从预先筛好的语料池抽样，避开最近 15 条
+        if self.style_sampler:
             try:
-                all_style_nodes = list(self.style_index.docstore.docs.values())
-                all_style_contents = []
-                for node in all_style_nodes:
-                    content = node.get_content().strip()
-                    if 20 <= len(content) <= 300:
-                        all_style_contents.append(content)
-
-                if all_style_contents:
-                    candidate_contents = [c for c in all_style_contents if c not in self.style_sample_history]
-                    if not candidate_contents:
-                        self.style_sample_history = []
-                        candidate_contents = all_style_contents
-
-                    sample_count = random.randint(1, min(3, len(candidate_contents)))
-                    sample_contents = random.sample(candidate_contents, sample_count)
-
-                    self.style_sample_history.extend(sample_contents)
-                    self.style_sample_history = self.style_sample_history[-15:]
-                    
-                    contexts.append("【语料参考】")
-                    contexts.extend(sample_contents)
+                context.style.extend(self.style_sampler.sample(max_count=3))
             except Exception as e:
                 print(f"[ChatManager] 随机采样Style失败：{e}")
 
-        if not contexts:
-            return ""
+    def _search_lore(self, query: str) -> tuple[np.ndarray, list[RetrievedChunk]]:
+        """
+        返回 (查询向量, 按排名去重后的候选分块)；候选数与相似度下限见 knowledge.similarity_top_k / similarity_cutoff
+        检索质量基准（benchmarks/bench_retrieval_quality.py）直接对这份排名打分
+        """
+        top_k = int(self.sm.get("knowledge", "similarity_top_k", default=8))
+        # 提到已知实体 → 只在该实体的分块中检索，别名统一后再嵌入
+        embed_query, candidate_rows = self._route_query(query)
+        # 查询向量走缓存；检索是对内存映射向量矩阵的一次矩阵乘法
+        query_embedding = self.query_cache.get(embed_query)
+        lore_nodes = self.lore_index.query(
+            query_embedding,
+            top_k=top_k,
+            similarity_cutoff=float(self.sm.get("knowledge", "similarity_cutoff", default=0.2)),
+            rows=candidate_rows
+        )
+        cache_stats = self.query_cache.stats()
+        print(f"[RAG-Cache] 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']}，缓存 {cache_stats['size']} 条")
 
-        return "\n\n".join(contexts) + "\n\n"
+        mode = self.sm.get("knowledge", "retrieval_mode", default="hybrid")
+        if mode == "hybrid" and self.lore_lexical is not None:
+            lore_nodes = self._fuse_lexical(query, lore_nodes, candidate_rows, top_k)
+
+        unique_nodes = []
+        seen_content = set()
+        for node in lore_nodes:
+            content = node.get_content().strip()
+            if content not in seen_content and len(content) > 50:
+                seen_content.add(content)
+                unique_nodes.append(node)
+        return query_embedding, unique_nodes
+
+    def _select_lore(self, query_embedding: np.ndarray, nodes: list[RetrievedChunk]) -> list[RetrievedChunk]:
+        """从候选中挑出放进提示词的 knowledge.lore_top_n 条"""
+        # 相邻分块有重叠，直接取前几条常常内容重复 → 用 MMR 挑彼此差异大的
+        # 相关度用 _search_lore 排好的分数（混合检索时是 RRF 融合分数），按最高分归一化；向量只用来算冗余度，
+        # 否则只被 BM25 命中的专有名词分块与查询向量不像，会在这一步被挤掉
+        top_n = int(self.sm.get("knowledge", "lore_top_n", default=3))
+        if len(nodes) > top_n:
+            scores = np.array([n.score or 0.0 for n in nodes], dtype=np.float32)
+            picked = mmr_select(
+                query_embedding,
+                self.lore_index.embeddings[[n.row for n in nodes]],
+                top_k=top_n,
+                lambda_mult=float(self.sm.get("knowledge", "mmr_lambda", default=0.7)),
+                relevance=scores / max(float(scores.max()), 1e-12),
+            )
+            nodes = [nodes[i] for i in picked]
+        return nodes[:top_n]
+
+    def _recall_memory(self, query: str) -> list[str]:
+        """从对话日志召回与 query 相关、且已不在当前历史里的旧对话，每条为一问一答"""
+        log = self.conversation_log
+        top_n = int(self.sm.get("memory", "recall_top_n", default=2))
+        if log is None or top_n <= 0:
+            return []
+        with self._history_lock:
+            in_context = {m["content"].strip() for m in self.chat_history}
+        query_embedding = None
+        if log.embed_fn is not None and self.query_cache is not None:
+            query_embedding = self.query_cache.get(query)
+        started = time.perf_counter()
+        hits = log.recall(
+            query,
+            top_k=top_n,
+            timeout_ms=float(self.sm.get("memory", "recall_timeout_ms", default=50)),
+            query_embedding=query_embedding,
+            exclude=in_context,
+        )
+        user_name = self.sm.get("user", "display_name", default="主人")
+        recalled, seen = [], set()
+        for hit in hits:
+            exchange = log.neighbors(hit.id)
+            key = tuple(exchange)
+            if not exchange or key in seen:
+                continue
+            seen.add(key)
+            recalled.append("\n".join(f"{user_name if role == 'user' else '你'}：{text}" for role, text in exchange))
+        if hits:
+            print(f"[Memory] 召回 {len(recalled)} 段旧对话，用时 {(time.perf_counter() - started) * 1e3:.1f}ms")
+        return recalled
+
+    def _fuse_lexical(self, query: str, vector_nodes: list[RetrievedChunk], rows=None,
+                      top_k: int = 8) -> list[RetrievedChunk]:
+        """向量结果与 BM25 结果按 RRF 融合；分数替换为融合分数"""
+        lexical_hits = self.lore_lexical.query(query, top_k=top_k, rows=rows)
+        if not lexical_hits:
+            return vector_nodes
+
+        rrf_k = int(self.sm.get("knowledge", "rrf_k", default=60))
+        by_row = {node.row: node for node in vector_nodes}
+        fused = reciprocal_rank_fusion(
+            [[node.row for node in vector_nodes], [row for row, _ in lexical_hits]],
+            k=rrf_k
+        )
+        results = []
+        for row, score in fused[:top_k]:
+            node = by_row.get(row)
+            if node is None:
+                record = self.lore_index.get_record(row)
+                node = RetrievedChunk(row, record["text"], record["metadata"], score)
+            node.score = score
+            results.append(node)
+        print(f"[RAG-Hybrid] 向量 {len(vector_nodes)} 条 + BM25 {len(lexical_hits)} 条 → 融合 {len(results)} 条")
+        return results
+
+    def query_cache_stats(self) -> dict:
+        """查询向量缓存的命中统计（用于调整 knowledge.query_cache_size）"""
+        return self.query_cache.stats() if self.query_cache else {}
 
     def _extract_general_keywords(self, query: str) -> list[str]:
         """通用关键词提取（无硬编码）"""
@@ -262,21 +728,24 @@ class ChatManager:
                 keywords.append(word)
         return list(dict.fromkeys(keywords))[:8]
 
-    # ---------- 以下所有方法完全保留原有逻辑，无改动 ----------
-    def chat(self, user_text: str) -> str | None:
-        self._append_user(user_text)
+    def chat(self, user_text: str, on_delta=None) -> str | None:
+        """
+        on_delta: 可选回调 on_delta(text_so_far)，流式模式下每收到一段增量就调用一次
+        """
+        # 提问与回复在对话日志里共用一个 pair_id；屏幕评论在另一个线程里写入，可能夹在两者之间
+        pair_id = self.conversation_log.new_pair_id() if self.conversation_log is not None else None
+        self._append_user(user_text, pair_id)
         messages = self._build_chat_messages()
-        reply = self._request_llm(messages)
+        reply = self._request_llm(messages, on_delta=on_delta)
         if reply:
-            self._append_assistant(reply)
+            self._append_assistant(reply, pair_id)
         return reply
 
-    def send_screen_observation(self, description: str) -> str | None:
-        knowledge_context = self._retrieve_knowledge(description)
-        system_content = self._build_persona() + knowledge_context
-        messages = [
-            {"role": "system", "content": system_content},
-            {
+    def send_screen_observation(self, description: str, on_delta=None) -> str | None:
+        knowledge = self._retrieve_knowledge(description)
+        messages = self._assemble_messages(PromptParts(
+            persona=self._build_persona(),
+            current={
                 "role": "user",
                 "content": (
                     "你刚刚观察了用户的电脑屏幕。"
@@ -286,87 +755,315 @@ class ChatManager:
                     f"\n\n{description}"
                 ),
             },
-        ]
-        reply = self._request_llm(messages)
+            lore=knowledge.lore,
+            style=knowledge.style,
+            memory=knowledge.memory,
+            summary=self.summarizer.summary if self.summarizer else "",
+        ))
+        reply = self._request_llm(messages, on_delta=on_delta)
         if reply:
             self._append_assistant(f"【刚刚对屏幕的评论】\n{reply}")
         return reply
 
-    def _append_user(self, text: str):
-        self.chat_history.append(
-            {"role": "user", "content": text.strip() + "\n\n"}
-        )
-        self._trim_history()
+    def _append_user(self, text: str, pair_id: int | None = None):
+        if self.conversation_log is not None:
+            self.conversation_log.append("user", text, pair_id=pair_id)
+        with self._history_lock:
+            self.chat_history.append(
+                {"role": "user", "content": text.strip() + "\n\n"}
+            )
+            self._trim_history()
 
-    def _append_assistant(self, text: str):
-        self.chat_history.append(
-            {"role": "assistant", "content": text.strip() + "\n\n"}
-        )
-        self._trim_history()
+    def _append_assistant(self, text: str, pair_id: int | None = None):
+        if self.conversation_log is not None:
+            self.conversation_log.append("assistant", text, pair_id=pair_id)
+        with self._history_lock:
+            self.chat_history.append(
+                {"role": "assistant", "content": text.strip() + "\n\n"}
+            )
+            self._trim_history()
 
     def _trim_history(self):
+        # 只限制保存的轮数上限；实际发送多少条由 token 预算决定（见 _assemble_messages）
         max_rounds = int(self.sm.get("llm", "history_rounds", default=6))
+        if self.summarizer is not None:
+            # 有滚动摘要时只原样保留最近几轮，更早的并入摘要
+            max_rounds = min(max_rounds, int(self.sm.get("summary", "keep_rounds", default=3)))
         max_msgs = max_rounds * 2
         if len(self.chat_history) > max_msgs:
+            if self.summarizer is not None:
+                self.summarizer.add_evicted(self.chat_history[:-max_msgs])
             self.chat_history = self.chat_history[-max_msgs:]
 
+    def summarize_evicted(self):
+        """
+        回复送达界面之后由工作线程调用：把被挤出历史的消息交给后台摘要线程，立即返回
+        摘要完成之前，这些消息仍排在历史最前面原样发送
+        """
+        if self.summarizer is not None:
+            self.summarizer.schedule(self.sm.get("user", "display_name", default="主人"))
+
+    def summary_stats(self) -> dict:
+        """摘要请求的次数、token 消耗与平均耗时（与对话请求分开统计）"""
+        return self.summarizer.stats() if self.summarizer else {}
+
+    def _request_summary(self, messages: list[dict], max_tokens: int) -> tuple[str, dict | None]:
+        """
+        摘要请求：非流式、发往主端点（或 summary.model 指定的模型），不经过对冲路由，
+        也不计入前缀缓存统计
+        """
+        endpoints = self._configured_endpoints()
+        if not endpoints:
+            raise RuntimeError("LLM 配置不完整")
+        endpoint = endpoints[0]
+        payload = {
+            "model": self.sm.get("summary", "model", default="") or endpoint.model,
+            "messages": messages,
+            "temperature": 0.3,
+            "max_tokens": max_tokens,
+            "stream": False,
+        }
+        headers = {
+            "Authorization": f"Bearer {endpoint.api_key}",
+            "Content-Type": "application/json",
+        }
+        data = self.transport.post_json(endpoint.url, headers, payload)
+        text = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        return text, data.get("usage")
+
     def _build_chat_messages(self):
-        query = self.chat_history[-1]["content"].split("\n", 1)[0].strip() if (self.chat_history and self.chat_history[-1]["role"] == "user") else ""
-        knowledge_context = self._retrieve_knowledge(query)
-        system_content = self._build_persona() + knowledge_context
-        return [
-            {"role": "system", "content": system_content},
-            *self.chat_history,
-        ]
-
-    def _request_llm(self, messages: list[dict]) -> str | None:
+        with self._history_lock:
+            history = list(self.chat_history)
+        pending = self.summarizer.pending_messages() if self.summarizer else []
+        if not history:
+            return []
+        query = history[-1]["content"].split("\n", 1)[0].strip() if history[-1]["role"] == "user" else ""
+        knowledge = self._retrieve_knowledge(query)
+        return self._assemble_messages(PromptParts(
+            persona=self._build_persona(),
+            current=history[-1],
+            lore=knowledge.lore,
+            style=knowledge.style,
+            memory=knowledge.memory,
+            history=pending + history[:-1],
+            summary=self.summarizer.summary if self.summarizer else "",
+        ))
+
+    def _get_token_counter(self) -> TokenCounter:
         provider = self.sm.get("llm", "provider", default="deepseek")
-        api_key = self.sm.get("llm", "api_key", default="")
-        base_url = self.sm.get("llm", "base_url", default="")
-        model = self.sm.get("llm", "model", default="")
-        temperature = float(self.sm.get("llm", "temperature", default=1.0))
-        max_tokens = int(self.sm.get("llm", "max_tokens", default=512))
+        model = self.sm.get("llm", "model", default="") or ""
+        counter = self._token_counter
+        if counter is None or counter.model != model or counter.provider != provider or counter.outdated:
+            counter = TokenCounter(model, provider)
+            self._token_counter = counter
+        return counter
 
-        if not api_key or not base_url or not model:
-            print("[ChatManager] LLM 配置不完整")
-            return None
+    def _assemble_messages(self, parts: PromptParts) -> list[dict]:
+        """按 llm.prompt_budget 与 llm.prompt_priority 裁剪各部分，按 llm.prompt_layout 排列，并打印 token 明细"""
+        counter = self._get_token_counter()
+        budget = int(self.sm.get("llm", "prompt_budget", default=24000))
+        priority = self.sm.get("llm", "prompt_priority", default=list(DEFAULT_PRIORITY))
+        layout = self.sm.get("llm", "prompt_layout", default=LAYOUT_CACHE)
+        with self.tracer.span("prompt_assembly", layout=layout) as span:
+            messages, usage = assemble_prompt(parts, counter, budget, priority, layout)
+            span.set(prompt_tokens=sum(u.tokens for u in usage.values()), messages=len(messages))
+        print(format_usage(usage, budget, counter))
+        return messages
 
+    @staticmethod
+    def _chat_completions_url(provider: str, base_url: str) -> str:
         base_url = base_url.rstrip("/")
+        if provider == "custom" or base_url.endswith("/v1/chat/completions"):
+            return base_url
+        return f"{base_url}/v1/chat/completions"
 
-        if provider == "custom":
-            url = base_url
-        else:
-            if base_url.endswith("/v1/chat/completions"):
-                url = base_url
-            else:
-                url = f"{base_url}/v1/chat/completions"
+    def _configured_endpoints(self) -> list[Endpoint]:
+        """主端点（llm.base_url / api_key / model）在前，其后是 llm.endpoints 中的备用端点；备用端点缺省的字段沿用主端点"""
+        primary = {
+            "provider": self.sm.get("llm", "provider", default="deepseek"),
+            "base_url": self.sm.get("llm", "base_url", default=""),
+            "api_key": self.sm.get("llm", "api_key", default=""),
+            "model": self.sm.get("llm", "model", default=""),
+        }
+        endpoints = []
+        for entry in [primary, *(self.sm.get("llm", "endpoints", default=[]) or [])]:
+            if not isinstance(entry, dict):
+                continue
+            cfg = {**primary, **{k: v for k, v in entry.items() if v}}
+            if not cfg["api_key"] or not cfg["base_url"] or not cfg["model"]:
+                continue
+            url = self._chat_completions_url(cfg["provider"], cfg["base_url"])
+            name = cfg.get("name") or f"{urlsplit(url).netloc}/{cfg['model']}"
+            endpoints.append(Endpoint(name, url, cfg["api_key"], cfg["model"]))
+        return endpoints
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
+    def _get_router(self, endpoints: list[Endpoint]) -> EndpointRouter:
+        """端点列表与对冲参数每次请求时按设置刷新，已有端点的延迟统计保留"""
+        options = {
+            "hedge": bool(self.sm.get("llm", "hedge", default=True)),
+            "hedge_delay_s": float(self.sm.get("llm", "hedge_delay_s", default=4.0)),
+            "hedge_min_delay_s": float(self.sm.get("llm", "hedge_min_delay_s", default=0.5)),
+            "hedge_max_delay_s": float(self.sm.get("llm", "hedge_max_delay_s", default=15.0)),
+            "cooldown_s": float(self.sm.get("llm", "endpoint_cooldown_s", default=30.0)),
         }
+        if self._router is None:
+            self._router = EndpointRouter(endpoints, **options)
+        else:
+            self._router.configure(**options)
+            self._router.set_endpoints(endpoints)
+        return self._router
 
-        payload = {
-            "model": model,
+    def endpoint_stats(self) -> dict:
+        """各端点的请求数、失败数、延迟 EWMA 与 p95"""
+        return self._router.stats() if self._router else {}
+
+    def _request_llm(self, messages: list[dict], on_delta=None) -> str | None:
+        temperature = float(self.sm.get("llm", "temperature", default=1.0))
+        max_tokens = int(self.sm.get("llm", "max_tokens", default=512))
+        # 流式输出：部分提供方不支持 SSE，可在设置中关闭
+        stream = bool(self.sm.get("llm", "stream", default=True))
+
+        endpoints = self._configured_endpoints()
+        if not endpoints:
+            print("[ChatManager] LLM 配置不完整")
+            return None
+
+        base_payload = {
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
-            "stream": False,
+            "stream": stream,
         }
+        if stream and self.sm.get("llm", "stream_usage", default=True):
+            # 让流的最后一个 chunk 带上 usage，才能拿到缓存命中的 token 数
+            base_payload["stream_options"] = {"include_usage": True}
 
-        try:
-            resp = requests.post(
-                url, headers=headers, json=payload, timeout=120
-            )
-            resp.raise_for_status()
-            data = resp.json()
+        def request(endpoint: Endpoint, attempt: Attempt) -> str:
+            headers = {
+                "Authorization": f"Bearer {endpoint.api_key}",
+                "Content-Type": "application/json",
+            }
+            payload = {"model": endpoint.model, **base_payload}
+            if stream:
+                return self._request_llm_stream(endpoint.url, headers, payload, on_delta, attempt, span)
+            started = time.perf_counter()
+            data = self.transport.post_json(endpoint.url, headers, payload,
+                                            on_connection=attempt.bind_connection)
+            attempt.claim()
+            self._record_cache_usage(data.get("usage"), None, time.perf_counter() - started, span)
             return (
                 data.get("choices", [{}])[0]
                 .get("message", {})
                 .get("content", "")
                 .strip()
             )
-        except Exception as e:
-            print("[ChatManager] LLM 请求失败：", e)
-            print("[ChatManager] 请求 URL：", url)
-            return None
\ No newline at end of file
+
+        # 最快的健康端点优先；超过其 p95 首字延迟仍无响应时对冲到下一个端点
+        prompt_chars = sum(len(m["content"]) for m in messages if isinstance(m.get("content"), str))
+        with self.tracer.span("llm", stream=stream, prompt_chars=prompt_chars) as span:
+            try:
+                reply, endpoint = self._get_router(endpoints).run(request)
+                span.set(endpoint=endpoint.name, reply_chars=len(reply or ""))
+                return reply
+            except Exception as e:
+                span.status = "error"
+                span.set(error=str(e)[:200])
+                print("[ChatManager] LLM 请求失败：", e)
+                print("[ChatManager] 请求端点：", ", ".join(ep.url for ep in endpoints))
+                return None
+
+    def _request_llm_stream(self, url: str, headers: dict, payload: dict, on_delta=None,
+                            attempt: Attempt | None = None, span: Span | None = None) -> str:
+        """
+        OpenAI 兼容的 SSE 流式请求：逐块解析 `data: {...}`，直到 `data: [DONE]`
+        每收到一段增量，就把「目前为止的完整文本」交给 on_delta
+        attempt：对冲请求中的一路；收到首字时争夺胜者，输掉或被取消时抛出 AttemptCancelled 并关闭连接
+        span：调用线程里的 llm 阶段，首字延迟与 token 数写入其属性
+        """
+        parts = []
+        usage = {}
+        first_token_s = None
+        started = time.perf_counter()
+        # 被取消时 attempt 直接关闭登记的连接，还在等响应头 / 首字节的一路也能马上退出
+        on_connection = attempt.bind_connection if attempt else None
+        with self.transport.stream_post(url, headers, payload, on_connection=on_connection) as resp:
+            content_type = resp.headers.get("Content-Type", "")
+            if "text/event-stream" not in content_type:
+                # 提供方忽略了 stream 参数，按普通 JSON 响应处理
+                data = resp.json()
+                if attempt:
+                    attempt.claim()
+                self._record_cache_usage(data.get("usage"), None, time.perf_counter() - started, span)
+                return (
+                    data.get("choices", [{}])[0]
+                    .get("message", {})
+                    .get("content", "")
+                    .strip()
+                )
+
+            lines = resp.iter_lines(decode_unicode=False)
+            if attempt:
+                lines = attempt.guard(lines)
+            for delta in self._iter_sse_deltas(lines, usage):
+                if first_token_s is None:
+                    first_token_s = time.perf_counter() - started
+                    if attempt:
+                        attempt.claim()
+                    if span is not None:
+                        span.set(first_token_ms=round(first_token_s * 1e3, 1))
+                parts.append(delta)
+                if on_delta:
+                    try:
+                        on_delta("".join(parts))
+                    except Exception as e:
+                        print("[ChatManager] 流式回调出错：", e)
+
+        self._record_cache_usage(usage.get("usage"), first_token_s, time.perf_counter() - started, span)
+        return "".join(parts).strip()
+
+    def _record_cache_usage(self, usage: dict | None, first_token_s: float | None, total_s: float,
+                            span: Span | None = None):
+        """记录提供方返回的缓存命中 token 数（响应没有 usage 时忽略）"""
+        if span is not None and usage:
+            span.set(prompt_tokens=int(usage.get("prompt_tokens") or 0),
+                     completion_tokens=int(usage.get("completion_tokens") or 0))
+        cache_usage = parse_cache_usage(usage)
+        if cache_usage is None:
+            return
+        if span is not None:
+            span.set(cached_tokens=cache_usage.cached_tokens)
+        self.prompt_cache_stats.record(cache_usage, first_token_s, total_s)
+        print(format_cache_usage(cache_usage, first_token_s, total_s))
+
+    def prompt_cache_report(self) -> dict:
+        """前缀缓存的累计命中率与命中 / 未命中时的平均延迟"""
+        return self.prompt_cache_stats.stats()
+
+    @staticmethod
+    def _iter_sse_deltas(lines, usage_out: dict | None = None):
+        """
+        解析 SSE 行，产出每个 chunk 中 choices[0].delta.content 的文本
+        - 忽略空行、注释行（以 `:` 开头，如 keep-alive）
+        - 遇到 `[DONE]` 结束
+        - 传入 usage_out 时，chunk 中的 usage 字段写入 usage_out["usage"]
+        """
+        for raw in lines:
+            if not raw:
+                continue
+            line = raw.decode("utf-8", errors="replace") if isinstance(raw, bytes) else raw
+            line = line.strip()
+            if not line or line.startswith(":") or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            if usage_out is not None and chunk.get("usage"):
+                usage_out["usage"] = chunk["usage"]
+            choices = chunk.get("choices") or [{}]
+            text = (choices[0].get("delta") or {}).get("content") or ""
+            if text:
+                yield text
@@ -0,0 +1,91 @@
+# src/llm/chunk_dedup.py
+"""
+构建索引时的近重复分块合并（MinHash + LSH 分桶）
+- 分块文本去掉空白与标点后切成字符 3-gram（shingle），用 MinHash 估计 Jaccard 相似度
+- LSH 分桶只比较同桶的候选对，整体接近线性；相似度达到阈值的分块用并查集合并成一组
+- 每组只保留第一个分块去做嵌入，其余分块的来源记录在保留分块的 metadata["duplicates"] 中
+"""
+import re
+import unicodedata
+import zlib
+from typing import Sequence
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+# 只保留文字与数字，换行 / 标点 / 空白的差异不影响相似度
+_STRIP_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def shingles(text: str, k: int = 3) -> set[str]:
+    text = _STRIP_RE.sub("", unicodedata.normalize("NFKC", text).lower())
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        grams = shingles(text)
+        if not grams:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hv = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+        # 与 datasketch 相同的置换：(a * x + b) mod p，再截到 32 位（uint64 溢出回绕是预期行为）
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(self._a, hv) + self._b[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=1)
+
+
+def group_near_duplicates(texts: Sequence[str], threshold: float = 0.85,
+                          num_perm: int = 128, bands: int = 32) -> list[list[int]]:
+    """
+    返回分组（每组为升序下标，组内第一个为保留分块），按保留分块的下标排序
+    threshold：估计 Jaccard 相似度达到该值才视为近重复
+    """
+    n = len(texts)
+    if n == 0:
+        return []
+    hasher = MinHasher(num_perm)
+    signatures = np.stack([hasher.signature(t) for t in texts])
+    rows_per_band = num_perm // bands
+
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        buckets: dict[bytes, list[int]] = {}
+        band_sig = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        for i in range(n):
+            buckets.setdefault(band_sig[i].tobytes(), []).append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            # 桶通常很小，两两比较；异常大的桶（大量相同模板文本）只和桶内第一个比较
+            pairs = (
+                ((members[i], members[j]) for i in range(len(members)) for j in range(i + 1, len(members)))
+                if len(members) <= 32 else ((members[0], other) for other in members[1:])
+            )
+            for a, b in pairs:
+                root_a, root_b = find(a), find(b)
+                if root_a == root_b:
+                    continue
+                similarity = float(np.mean(signatures[a] == signatures[b]))
+                if similarity >= threshold:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups: dict[int, list[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values(), key=lambda g: g[0])
@@ -0,0 +1,154 @@
+# src/llm/embedding_backends.py
+"""
+Embedding 后端选择（settings: knowledge.embedding_backend = torch | onnx）
+- torch：llama_index 的 HuggingFaceEmbedding（sentence-transformers + torch）
+- onnx ：直接用 onnxruntime 跑随仓库附带的 multilingual-e5-small/onnx 导出，
+         分词、均值池化、L2 归一化都在本模块完成，不加载 torch
+两者使用同一模型权重、同样的池化与归一化，向量可以互换，已持久化的索引无需重建
+"""
+from pathlib import Path
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+SUPPORTED_BACKENDS = ("torch", "onnx")
+_MICRO_BATCH = 4  # onnx 后端一次推理的文本数，小批补齐浪费少、中间激活也小
+
+
+# 查询 / 文档前缀：与 HuggingFaceEmbedding 对 multilingual-e5-small 的处理一致（它只给 BGE / Instructor 系列加前缀），
+# 两个后端的向量才能互换。不从 llama_index.embeddings.huggingface.utils 取：导入该包会经
+# sentence_transformers 加载整个 torch，onnx 后端省下的启动时间和内存就白费了
+DEFAULT_QUERY_INSTRUCTION = ""
+DEFAULT_TEXT_INSTRUCTION = ""
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """onnxruntime（CPU）版 sentence-transformers 推理：Transformer → 均值池化 → 归一化"""
+
+    max_length: int = Field(default=512, description="最大 token 数（与 sentence_bert_config 一致）")
+    normalize: bool = Field(default=True)
+    query_instruction: str = Field(default="")
+    text_instruction: str = Field(default="")
+
+    _session = PrivateAttr()
+    _tokenizer = PrivateAttr()
+    _input_names = PrivateAttr()
+
+    def __init__(
+        self,
+        model_dir: str,
+        onnx_file: str = "onnx/model.onnx",
+        max_length: int = 512,
+        num_threads: int = 0,
+        embed_batch_size: int = 32,
+        query_instruction: str = DEFAULT_QUERY_INSTRUCTION,
+        text_instruction: str = DEFAULT_TEXT_INSTRUCTION,
+        **kwargs,
+    ):
+        super().__init__(
+            model_name=str(model_dir),
+            embed_batch_size=embed_batch_size,
+            max_length=max_length,
+            query_instruction=query_instruction,
+            text_instruction=text_instruction,
+            **kwargs,
+        )
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        onnx_path = model_dir / onnx_file
+        tokenizer_path = onnx_path.parent / "tokenizer.json"
+        if not tokenizer_path.exists():
+            tokenizer_path = model_dir / "tokenizer.json"
+
+        options = ort.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 不用内存池：批量编码长文本时池子会涨到峰值且不归还，常驻内存反而比 torch 后端高
+        options.enable_cpu_mem_arena = False
+        self._session = ort.InferenceSession(
+            str(onnx_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+        tokenizer = Tokenizer.from_file(str(tokenizer_path))
+        pad_id = tokenizer.token_to_id("<pad>")
+        tokenizer.enable_truncation(max_length=max_length)
+        tokenizer.enable_padding(pad_id=pad_id if pad_id is not None else 0, pad_token="<pad>")
+        self._tokenizer = tokenizer
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    # ---------- 推理 ----------
+    def _encode(self, texts: list[str]) -> list[list[float]]:
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        token_embeddings = self._session.run(None, feeds)[0]  # [batch, seq, dim]
+
+        # 均值池化（只统计有效 token）
+        mask = attention_mask[:, :, None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        embeddings = summed / counts
+
+        if self.normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings.astype(np.float32).tolist()
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._encode([self.query_instruction + query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._encode([self.text_instruction + text])[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        # 按长度排序后切成小批：每批只补齐到批内最长的文本，与 sentence-transformers 的做法一致
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings: list[list[float] | None] = [None] * len(texts)
+        for start in range(0, len(order), _MICRO_BATCH):
+            batch = order[start:start + _MICRO_BATCH]
+            for i, vec in zip(batch, self._encode([self.text_instruction + texts[i] for i in batch])):
+                embeddings[i] = vec
+        return embeddings
+
+
+def create_embed_model(
+    backend: str,
+    model_name: str,
+    onnx_file: str = "onnx/model.onnx",
+    num_threads: int = 0,
+    embed_batch_size: int = 32,
+):
+    """按配置创建 Embedding 模型；未知后端按 torch 处理"""
+    backend = (backend or "torch").lower()
+    if backend not in SUPPORTED_BACKENDS:
+        print(f"[Embedding] 未知后端 {backend}，使用 torch")
+        backend = "torch"
+
+    if backend == "onnx":
+        return OnnxEmbedding(
+            model_dir=model_name,
+            onnx_file=onnx_file,
+            num_threads=num_threads,
+            embed_batch_size=embed_batch_size,
+        )
+
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    if num_threads > 0:
+        import torch
+        torch.set_num_threads(num_threads)
+    return HuggingFaceEmbedding(model_name=model_name, embed_batch_size=embed_batch_size)
@@ -0,0 +1,125 @@
+# src/llm/embedding_cache.py
+"""
+查询向量 LRU 缓存
+- 键为规范化后的查询文本（NFKC + 去首尾空白 + 合并连续空白）；规范化只用于查找，
+  未命中时编码的仍是原始查询，开不开缓存检索结果都一样
+- 容量有上限，超出时淘汰最久未使用的条目
+- 可选落盘：退出时（以及每新增若干条时）写入 JSON，下次启动继续使用
+- 落盘文件记录模型标识（后端 + 模型 + 查询前缀），换了其中任何一项自动作废
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    return _WS_RE.sub(" ", text).strip()
+
+
+class QueryEmbeddingCache:
+    def __init__(
+        self,
+        embed_fn: Callable[[str], list[float]],
+        max_size: int = 256,
+        persist_path: str | Path | None = None,
+        model_key: str = "",
+        save_every: int = 32,
+    ):
+        self.embed_fn = embed_fn
+        self.max_size = max(1, int(max_size))
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.model_key = model_key
+        self.save_every = max(1, int(save_every))
+
+        self._entries: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._unsaved = 0
+
+        if self.persist_path:
+            self._load()
+            atexit.register(self.save)
+
+    # ---------- 查询 ----------
+    def get(self, text: str) -> list[float]:
+        key = normalize_query(text)
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vec
+            self.misses += 1
+
+        # 计算向量时不持锁，避免阻塞其他线程的命中查询
+        vec = list(self.embed_fn(text))
+
+        with self._lock:
+            self._entries[key] = vec
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            need_save = self.persist_path is not None and self._unsaved >= self.save_every
+
+        if need_save:
+            self.save()
+        return vec
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+    # ---------- 落盘 ----------
+    def _load(self):
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"[QueryEmbeddingCache] 缓存文件损坏，忽略：{e}")
+            return
+
+        if data.get("model") != self.model_key:
+            print("[QueryEmbeddingCache] Embedding 模型 / 后端已变化，丢弃旧缓存")
+            return
+
+        for key, vec in data.get("entries", [])[-self.max_size:]:
+            self._entries[key] = vec
+        print(f"[QueryEmbeddingCache] 载入 {len(self._entries)} 条查询向量缓存")
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self._lock:
+            if self._unsaved == 0:
+                return
+            data = {"model": self.model_key, "entries": list(self._entries.items())}
+            self._unsaved = 0
+
+        try:
+            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.persist_path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            print(f"[QueryEmbeddingCache] 保存缓存失败：{e}")
@@ -0,0 +1,326 @@
+# src/llm/endpoint_router.py
+"""
+多端点路由与对冲请求（hedged requests）
+- 每个端点维护首字延迟的 EWMA、最近若干次延迟（用于算 p95）与错误率 EWMA
+- 连续失败的端点进入冷却，冷却期内排在健康端点之后
+- 请求先发往预计最快的健康端点；超过该端点的 p95 延迟仍没有首字时，向下一个端点再发一份
+- 最先拿到首字（非流式时为完整响应）的一路获胜，其余各路立即关闭各自登记的连接
+  （还在等响应头或首字节的一路也会马上断开，不必等到读取超时）
+- 某一路在拿到首字之前出错时，立即改发下一个端点，不等对冲延迟
+"""
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, NamedTuple, Sequence
+
+
+class Endpoint(NamedTuple):
+    name: str
+    url: str
+    api_key: str
+    model: str
+
+
+class AttemptCancelled(Exception):
+    """另一路已经获胜，本路应尽快放弃"""
+
+
+class _Race:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.winner: "Attempt | None" = None
+        self.attempts: list["Attempt"] = []
+
+    def claim(self, attempt: "Attempt") -> bool:
+        with self._lock:
+            if self.winner is None:
+                self.winner = attempt
+                losers = [a for a in self.attempts if a is not attempt]
+            else:
+                return self.winner is attempt
+        for loser in losers:
+            loser.cancel()
+        return True
+
+
+class Attempt:
+    """一次发往某个端点的请求；请求函数在拿到首字时调用 claim()，之后才能把内容交给界面"""
+
+    def __init__(self, endpoint: Endpoint, race: _Race):
+        self.endpoint = endpoint
+        self._race = race
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._closer: Callable[[], None] | None = None
+        self.started = time.perf_counter()
+        self.first_token_s: float | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def bind_connection(self, closer: Callable[[], None] | None):
+        """
+        登记本路正在使用的连接的关闭函数（None = 注销，连接即将归还连接池）
+        登记时已经被取消的话立即关闭
+        """
+        with self._lock:
+            self._closer = closer
+            if closer is None or not self.cancelled:
+                return
+        self._close(closer)
+
+    def cancel(self):
+        with self._lock:
+            self._cancel.set()
+            closer, self._closer = self._closer, None
+        if closer is not None:
+            self._close(closer)
+
+    def _close(self, closer: Callable[[], None]):
+        try:
+            closer()
+        except Exception as e:
+            print(f"[EndpointRouter] 关闭 {self.endpoint.name} 的连接失败：{e}")
+
+    def claim(self):
+        """争夺本次请求的胜者；输给其他端点时抛出 AttemptCancelled"""
+        if self.first_token_s is None:
+            self.first_token_s = time.perf_counter() - self.started
+        if self.cancelled or not self._race.claim(self):
+            raise AttemptCancelled()
+
+    def guard(self, lines):
+        """包装流式响应的逐行迭代：被取消后在下一行到达时抛出 AttemptCancelled"""
+        for line in lines:
+            if self.cancelled:
+                raise AttemptCancelled()
+            yield line
+
+
+class EndpointHealth:
+    def __init__(self, alpha: float = 0.3, window: int = 50):
+        self.alpha = alpha
+        self.latency_ewma: float | None = None
+        self.error_ewma = 0.0
+        self.samples: deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record_latency(self, latency_s: float):
+        self.samples.append(latency_s)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency_s
+        else:
+            self.latency_ewma += self.alpha * (latency_s - self.latency_ewma)
+
+    def record_success(self, latency_s: float):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.error_ewma *= 1 - self.alpha
+        self.record_latency(latency_s)
+
+    def record_failure(self, max_failures: int, cooldown_s: float):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.error_ewma += self.alpha * (1 - self.error_ewma)
+        if self.consecutive_failures >= max_failures:
+            self.cooldown_until = time.monotonic() + cooldown_s
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def expected_latency(self) -> float:
+        """预计延迟：EWMA 按错误率放大；还没有样本的端点排在有样本的之后（保持配置顺序）"""
+        if self.latency_ewma is None:
+            return float("inf")
+        return self.latency_ewma / max(0.05, 1 - self.error_ewma)
+
+    def percentile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ewma_s": self.latency_ewma,
+            "error_ewma": self.error_ewma,
+            "p95_s": self.percentile(0.95),
+            "cooling_down": not self.healthy(time.monotonic()),
+        }
+
+
+class EndpointRouter:
+    def __init__(
+        self,
+        endpoints: Sequence[Endpoint],
+        hedge: bool = True,
+        hedge_delay_s: float = 4.0,
+        hedge_min_delay_s: float = 0.5,
+        hedge_max_delay_s: float = 15.0,
+        max_parallel: int = 2,
+        max_failures: int = 2,
+        cooldown_s: float = 30.0,
+        alpha: float = 0.3,
+        min_samples: int = 5,
+    ):
+        self.hedge = hedge
+        self.hedge_delay_s = hedge_delay_s
+        self.hedge_min_delay_s = hedge_min_delay_s
+        self.hedge_max_delay_s = hedge_max_delay_s
+        self.max_parallel = max(1, max_parallel)
+        self.max_failures = max(1, max_failures)
+        self.cooldown_s = cooldown_s
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._health: dict[Endpoint, EndpointHealth] = {}
+        self.endpoints: list[Endpoint] = []
+        self.set_endpoints(endpoints)
+
+    def configure(self, **options):
+        """更新对冲 / 冷却参数（设置可能在运行中修改）"""
+        for key, value in options.items():
+            if not hasattr(self, key) or key.startswith("_"):
+                raise TypeError(f"未知参数：{key}")
+            setattr(self, key, value)
+
+    def set_endpoints(self, endpoints: Sequence[Endpoint]):
+        """更新端点列表；未变化的端点保留已有的延迟统计"""
+        with self._lock:
+            self.endpoints = list(dict.fromkeys(endpoints))
+            self._health = {ep: self._health.get(ep) or EndpointHealth(self.alpha) for ep in self.endpoints}
+
+    def ranked(self) -> list[Endpoint]:
+        """健康端点按预计延迟升序在前，冷却中的端点在后"""
+        now = time.monotonic()
+        with self._lock:
+            return sorted(
+                self.endpoints,
+                key=lambda ep: (not self._health[ep].healthy(now), self._health[ep].expected_latency()),
+            )
+
+    def hedge_delay(self, endpoint: Endpoint) -> float:
+        """对冲延迟：样本足够时取该端点的 p95 首字延迟，否则用 hedge_delay_s"""
+        with self._lock:
+            health = self._health[endpoint]
+            p95 = health.percentile(0.95) if len(health.samples) >= self.min_samples else None
+        if p95 is None:
+            return self.hedge_delay_s
+        return min(self.hedge_max_delay_s, max(self.hedge_min_delay_s, p95))
+
+    def _record_success(self, endpoint: Endpoint, latency_s: float):
+        with self._lock:
+            if endpoint in self._health:
+                self._health[endpoint].record_success(latency_s)
+
+    def _record_latency(self, endpoint: Endpoint, latency_s: float):
+        with self._lock:
+            if endpoint in self._health:
+                self._health[endpoint].record_latency(latency_s)
+
+    def _record_failure(self, endpoint: Endpoint):
+        with self._lock:
+            health = self._health.get(endpoint)
+            if health is None:
+                return
+            health.record_failure(self.max_failures, self.cooldown_s)
+            cooling = not health.healthy(time.monotonic())
+        if cooling:
+            print(f"[EndpointRouter] {endpoint.name} 连续失败，冷却 {self.cooldown_s:.0f}s")
+
+    def _record_losers(self, race: _Race):
+        """比胜者先发出却输掉的各路：首字至少要这么久，计入延迟样本，避免慢端点一直排在最前"""
+        winner = race.winner
+        claimed_at = winner.started + (winner.first_token_s or 0.0)
+        for attempt in race.attempts:
+            if attempt is not winner and attempt.first_token_s is None and attempt.started <= winner.started:
+                self._record_latency(attempt.endpoint, claimed_at - attempt.started)
+
+    def run(self, request_fn: Callable[[Endpoint, Attempt], object]):
+        """
+        request_fn(endpoint, attempt)：向 endpoint 发请求并返回结果；拿到首字时调用 attempt.claim()
+        （没有调用时以完成请求视为拿到首字）。返回 (结果, 获胜的端点)；所有端点都失败时抛出最后一个异常
+        """
+        pending = self.ranked()
+        if not pending:
+            raise RuntimeError("没有可用的 LLM 端点")
+        race = _Race()
+        results: queue.Queue = queue.Queue()
+
+        def worker(attempt: Attempt):
+            try:
+                value = request_fn(attempt.endpoint, attempt)
+                attempt.claim()
+            except AttemptCancelled:
+                results.put((attempt, False, None))
+                return
+            except Exception as e:
+                results.put((attempt, False, e))
+                return
+            results.put((attempt, True, value))
+
+        def launch() -> Attempt:
+            attempt = Attempt(pending.pop(0), race)
+            race.attempts.append(attempt)
+            if race.winner is not None:
+                attempt.cancel()
+            threading.Thread(target=worker, args=(attempt,), daemon=True,
+                             name=f"LLM-{attempt.endpoint.name}").start()
+            return attempt
+
+        primary = launch()
+        inflight = 1
+        hedge_at = primary.started + self.hedge_delay(primary.endpoint) if self.hedge else None
+        last_error: Exception | None = None
+
+        while True:
+            timeout = None
+            if hedge_at is not None and pending and race.winner is None and inflight < self.max_parallel:
+                timeout = max(0.0, hedge_at - time.perf_counter())
+            try:
+                attempt, ok, value = results.get(timeout=timeout)
+            except queue.Empty:
+                hedged = launch()
+                inflight += 1
+                print(f"[EndpointRouter] {primary.endpoint.name} 超过 "
+                      f"{hedge_at - primary.started:.2f}s 未响应，对冲到 {hedged.endpoint.name}")
+                hedge_at = time.perf_counter() + self.hedge_delay(hedged.endpoint)
+                continue
+
+            inflight -= 1
+            if ok:
+                latency = attempt.first_token_s
+                self._record_success(attempt.endpoint, latency if latency is not None
+                                     else time.perf_counter() - attempt.started)
+                self._record_losers(race)
+                return value, attempt.endpoint
+
+            if value is not None and not attempt.cancelled:
+                self._record_failure(attempt.endpoint)
+                last_error = value
+                print(f"[EndpointRouter] {attempt.endpoint.name} 请求失败：{value}")
+                if race.winner is attempt:
+                    # 已经开始输出之后才出错，不再换端点重发
+                    raise value
+                if pending and race.winner is None:
+                    launch()
+                    inflight += 1
+                    continue
+
+            if inflight == 0:
+                if last_error is not None:
+                    raise last_error
+                raise RuntimeError("所有 LLM 端点均未返回结果")
+
+    def stats(self) -> dict[str, dict]:
+        """{端点名: {requests, failures, latency_ewma_s, error_ewma, p95_s, cooling_down}}"""
+        with self._lock:
+            return {ep.name: self._health[ep].as_dict() for ep in self.endpoints}
@@ -0,0 +1,238 @@
+# src/llm/entity_index.py
+"""
+译名对照表驱动的实体索引
+- 加载时把 译名对照表.yaml 中每个实体的中文名 / ja / en / aliases 编译成 Aho-Corasick 自动机，
+  匹配耗时只与查询长度有关，与对照表大小无关
+- 实体 → 分块行号 的倒排表（行号与 MmapVectorStore 一致），查询提到已知实体时只在这些分块里检索
+- 别名统一替换成中文正式名再做嵌入（「帝释天」「Indra」→「因陀罗」）；只替换命中的片段，查询其余部分原样保留
+- 匹配时忽略 NFKC、大小写与分隔符（·・/ 空格等）的差异，取最长的写法：「阿周那Alter」「Arjuna Alter」都识别为「阿周那·alter」
+
+持久化：entity_postings.json（与向量库同目录），用向量库 build_id + 对照表哈希判断是否过期
+"""
+import hashlib
+import json
+import os
+import unicodedata
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+import numpy as np
+
+GLOSSARY_FILE = "译名对照表.yaml"
+POSTINGS_FILE = "entity_postings.json"
+POSTINGS_VERSION = 2  # 2：匹配时忽略分隔符
+_SECTIONS = ("characters", "terms")
+# 写法里可有可无的分隔符（NFKC 之后）：「阿周那·alter」「アルジュナ・オルタ」「Arjuna Alter」
+_SEPARATORS = frozenset(" \t\r\n·・‧•/-_")
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def _match_key(surface: str) -> str:
+    """对照表写法 → 匹配用的键：NFKC + 小写，去掉分隔符"""
+    return "".join(ch for ch in _normalize(surface) if ch not in _SEPARATORS)
+
+
+def _match_text(text: str) -> tuple[str, list[int]]:
+    """
+    与 _match_key 相同的变换，另外返回每个字符在原文中的位置，匹配结果据此映射回原文
+    NFKC 不改变长度时（绝大多数文本）逐字对应；否则按「字符 + 其后的组合字符」分段变换
+    """
+    normalized = _normalize(text)
+    if len(normalized) == len(text):
+        pieces = ((i, ch) for i, ch in enumerate(normalized))
+    else:
+        groups, start = [], 0
+        for i in range(1, len(text) + 1):
+            # 半角浊点「ﾞ」之类 NFKC 之后才是组合字符，也要与前一个字符一起变换
+            if i == len(text) or not unicodedata.combining(_normalize(text[i])[:1] or " "):
+                groups.append((start, _normalize(text[start:i])))
+                start = i
+        pieces = ((i, ch) for i, piece in groups for ch in piece)
+    chars, origin = [], []
+    for i, ch in pieces:
+        if ch not in _SEPARATORS:
+            chars.append(ch)
+            origin.append(i)
+    return "".join(chars), origin
+
+
+def _is_word_char(ch: str) -> bool:
+    ch = _normalize(ch)
+    return bool(ch) and ch[-1].isascii() and ch[-1].isalnum()
+
+
+class EntityMention(NamedTuple):
+    start: int
+    end: int
+    entity: str
+
+
+class AhoCorasick:
+    """多模式匹配自动机：patterns 为 {模式串: 值}，返回最左最长、互不重叠的匹配"""
+
+    def __init__(self, patterns: dict[str, str]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._output: list[tuple[int, str] | None] = [None]  # 以该状态结尾的模式 (长度, 值)
+        for pattern, value in patterns.items():
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._output.append(None)
+                state = nxt
+            self._output[state] = (len(pattern), value)
+
+        # BFS 计算失败指针与输出链（指向失败链上最近的终止状态）
+        self._fail = [0] * len(self._goto)
+        self._dict_link = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                fail_state = self._fail[nxt]
+                self._dict_link[nxt] = fail_state if self._output[fail_state] else self._dict_link[fail_state]
+
+    def iter_matches(self, text: str):
+        """逐字符扫描，产出所有 (起点, 终点, 值)，包括互相重叠的"""
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            out = state if self._output[state] else self._dict_link[state]
+            while out:
+                length, value = self._output[out]
+                yield i + 1 - length, i + 1, value
+                out = self._dict_link[out]
+
+    def find(self, text: str) -> list[tuple[int, int, str]]:
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        result = []
+        last_end = 0
+        for start, end, value in matches:
+            if start >= last_end:
+                result.append((start, end, value))
+                last_end = end
+        return result
+
+
+class Glossary:
+    def __init__(self, surfaces: dict[str, str], digest: str = ""):
+        """surfaces: {匹配键（见 _match_key）: 中文正式名}"""
+        self.surfaces = surfaces
+        self.digest = digest
+        self.entities = sorted(set(surfaces.values()))
+        self._matcher = AhoCorasick(surfaces)
+
+    @classmethod
+    def load(cls, path: Path) -> "Glossary | None":
+        if not path.exists():
+            return None
+        try:
+            import yaml
+            raw = path.read_bytes()
+            data = yaml.safe_load(raw.decode("utf-8")) or {}
+        except Exception as e:
+            print(f"[Glossary] 读取译名对照表失败：{e}")
+            return None
+
+        surfaces: dict[str, str] = {}
+        for section in _SECTIONS:
+            for name, entry in (data.get(section) or {}).items():
+                entry = entry or {}
+                names = [name, entry.get("ja"), entry.get("en")] + list(entry.get("aliases") or [])
+                for surface in names:
+                    if not surface:
+                        continue
+                    surface = _match_key(str(surface))
+                    # 单字写法误命中太多，不参与匹配；同一写法以先出现的实体为准
+                    if len(surface) >= 2:
+                        surfaces.setdefault(surface, name)
+        return cls(surfaces, hashlib.sha256(raw).hexdigest())
+
+    def find(self, text: str) -> list[EntityMention]:
+        """返回文本中的实体提及（位置对应原文）"""
+        key, origin = _match_text(text)
+        mentions = []
+        for s, e, entity in self._matcher.find(key):
+            start, end = origin[s], origin[e - 1] + 1
+            # 拉丁字母写法要求整词匹配（避免 indra 命中 indrajit）
+            if key[s].isascii() and key[s].isalnum():
+                if (start > 0 and _is_word_char(text[start - 1])) or (end < len(text) and _is_word_char(text[end])):
+                    continue
+            mentions.append(EntityMention(start, end, entity))
+        return mentions
+
+    def entities_in(self, text: str) -> list[str]:
+        """按首次出现顺序去重的实体列表"""
+        return list(dict.fromkeys(m.entity for m in self.find(text)))
+
+    def normalize(self, text: str) -> str:
+        """把别名 / 外文写法替换成中文正式名；没有命中的部分原样保留（不做 NFKC / 小写）"""
+        parts = []
+        last = 0
+        for mention in self.find(text):
+            parts.append(text[last:mention.start])
+            parts.append(mention.entity)
+            last = mention.end
+        parts.append(text[last:])
+        return "".join(parts)
+
+
+class EntityIndex:
+    def __init__(self, glossary: Glossary, postings: dict[str, np.ndarray], build_id: str = ""):
+        self.glossary = glossary
+        self.postings = postings
+        self.build_id = build_id
+
+    @classmethod
+    def build(cls, glossary: Glossary, texts: Iterable[str], build_id: str = "") -> "EntityIndex":
+        rows: dict[str, list[int]] = {}
+        for row, text in enumerate(texts):
+            for entity in glossary.entities_in(text):
+                rows.setdefault(entity, []).append(row)
+        postings = {entity: np.asarray(r, dtype=np.int32) for entity, r in rows.items()}
+        return cls(glossary, postings, build_id)
+
+    @classmethod
+    def load(cls, glossary: Glossary, persist_dir: Path) -> "EntityIndex | None":
+        """文件不存在、版本不符或对照表已修改时返回 None"""
+        try:
+            with open(persist_dir / POSTINGS_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if data.get("version") != POSTINGS_VERSION or data.get("glossary_sha256") != glossary.digest:
+            return None
+        postings = {entity: np.asarray(rows, dtype=np.int32) for entity, rows in data.get("postings", {}).items()}
+        return cls(glossary, postings, data.get("build_id", ""))
+
+    def save(self, persist_dir: Path):
+        persist_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = persist_dir / (POSTINGS_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": POSTINGS_VERSION,
+                "build_id": self.build_id,
+                "glossary_sha256": self.glossary.digest,
+                "postings": {entity: rows.tolist() for entity, rows in self.postings.items()},
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, persist_dir / POSTINGS_FILE)
+
+    def rows_for(self, entities: Iterable[str]) -> np.ndarray:
+        """提到的实体所在分块的并集（升序行号）"""
+        arrays = [self.postings[e] for e in entities if e in self.postings]
+        if not arrays:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(arrays))
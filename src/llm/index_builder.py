@@ -0,0 +1,125 @@
+# src/llm/index_builder.py
+"""
+索引构建流水线：读取 + 分块（可放进进程池）→ 按长度排序后大批量嵌入
+- 分块函数都在模块顶层，spawn 出来的子进程可以直接导入调用；
+  子进程只返回纯字符串 / 字典，不传 llama_index 对象
+- 嵌入前按文本长度排序再切批，同一批长度接近，padding 浪费少；结果按原顺序返回
+"""
+import os
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import NamedTuple
+
+POOL_MIN_FILES = 16
+LORE_CHUNK_SIZE = 1000
+LORE_CHUNK_OVERLAP = 150
+MIN_CHUNK_SIZE = 200  # 再短的话文件名等元数据就占满了分块，SentenceSplitter 会直接报错
+
+
+class ChunkedFile(NamedTuple):
+    rel: str
+    doc_ids: list[str]        # 写入文件清单，增量更新时据此删除旧分块
+    texts: list[str]          # 分块正文
+    metadatas: list[dict]     # {"doc_id", "file_name"}
+    embed_texts: list[str]    # 参与嵌入的文本（含 file_name 等元数据，与 llama_index 默认行为一致）
+
+
+def cpu_budget(max_threads: int = 0) -> int:
+    """构建索引可用的线程数：0 = 自动（留一半核心给界面与系统）"""
+    if max_threads > 0:
+        return max_threads
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def make_node_parser(is_lore: bool, chunk_size: int | None = None, chunk_overlap: int | None = None):
+    """chunk_size / chunk_overlap 只对 Lore 生效（knowledge.lore_chunk_size / lore_chunk_overlap），None = 默认值"""
+    from llama_index.core.node_parser import SentenceSplitter
+
+    if is_lore:
+        # Lore：通用剧情/事实分块，优先按空行拆分
+        return SentenceSplitter(
+            chunk_size=chunk_size or LORE_CHUNK_SIZE,
+            chunk_overlap=LORE_CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap,
+            # 仅用单个字符串（旧版本要求）
+            paragraph_separator="\n\n",
+            separator="。"  # 中文核心句子分隔符（单个字符串）
+        )
+    # Style：日文语料分块，适配短台词
+    return SentenceSplitter(
+        chunk_size=300,
+        chunk_overlap=50,
+        # 仅用单个字符串（旧版本要求）
+        paragraph_separator="\n",
+        separator="、"  # 日文核心句子分隔符（单个字符串）
+    )
+
+
+def read_documents(data_dir: Path, rel: str, is_lore: bool) -> list:
+    """
+    读取单个文件；文档 id 固定为「相对路径#序号」，增量更新时据此删除旧节点
+    """
+    from llama_index.core import SimpleDirectoryReader
+
+    reader_kwargs = {
+        "input_files": [str(data_dir / rel)],
+        "encoding": "utf-8",
+    }
+    if is_lore:
+        # 关键修正：将字符串路径转Path对象后再取name
+        reader_kwargs["file_metadata"] = lambda file_path: {"file_name": Path(file_path).name}
+    docs = SimpleDirectoryReader(**reader_kwargs).load_data()
+    for i, doc in enumerate(docs):
+        doc.id_ = f"{rel}#{i}"
+    return docs
+
+
+def chunk_file(data_dir: str, rel: str, is_lore: bool, chunk_size: int | None = None,
+               chunk_overlap: int | None = None) -> ChunkedFile | None:
+    """读取并分块一个文件（可在子进程中执行）；读取失败返回 None"""
+    from llama_index.core.schema import MetadataMode
+
+    try:
+        docs = read_documents(Path(data_dir), rel, is_lore)
+    except Exception as e:
+        print(f"[IndexBuilder] 读取 {rel} 失败：{e}")
+        return None
+    nodes = make_node_parser(is_lore, chunk_size, chunk_overlap).get_nodes_from_documents(docs)
+    return ChunkedFile(
+        rel=rel,
+        doc_ids=[d.id_ for d in docs],
+        texts=[n.get_content() for n in nodes],
+        metadatas=[{"doc_id": n.ref_doc_id, "file_name": n.metadata.get("file_name", "")} for n in nodes],
+        embed_texts=[n.get_content(metadata_mode=MetadataMode.EMBED) for n in nodes],
+    )
+
+
+def chunk_files(data_dir: Path, rels: list[str], is_lore: bool, pool: Executor | None = None,
+                chunk_size: int | None = None, chunk_overlap: int | None = None) -> dict[str, ChunkedFile]:
+    """
+    返回 {相对路径: 分块结果}（保持 rels 的顺序）
+    pool 为空或文件很少时在当前线程逐个处理（子进程首次导入 llama_index 需要一秒以上，少量文件不划算）
+    """
+    if pool is None or len(rels) < POOL_MIN_FILES:
+        results = [chunk_file(str(data_dir), rel, is_lore, chunk_size, chunk_overlap) for rel in rels]
+    else:
+        n = len(rels)
+        results = list(pool.map(
+            chunk_file, [str(data_dir)] * n, rels, [is_lore] * n, [chunk_size] * n, [chunk_overlap] * n,
+            chunksize=max(1, len(rels) // 32),
+        ))
+    return {chunked.rel: chunked for chunked in results if chunked is not None}
+
+
+def embed_in_batches(embed_model, texts: list[str], batch_size: int = 64) -> list[list[float]]:
+    """按长度排序后分批嵌入，返回与 texts 顺序一致的向量"""
+    if not texts:
+        return []
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    embeddings: list = [None] * len(texts)
+    batch_size = max(1, batch_size)
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        vectors = embed_model.get_text_embedding_batch([texts[i] for i in batch])
+        for i, vector in zip(batch, vectors):
+            embeddings[i] = vector
+    return embeddings
@@ -0,0 +1,71 @@
+# src/llm/index_manifest.py
+"""
+索引文件清单（file_manifest.json，与 data_mtime.json 放在同一目录）
+记录每个数据文件的内容哈希以及它在索引中对应的文档 id：
+- 数据目录的修改时间变化后，只比较哈希，找出新增 / 修改 / 删除的文件
+- 修改时间被重置（例如 PyInstaller 拷贝）但内容没变时，不会触发任何重建
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_NAME = "file_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def iter_data_files(data_dir: Path):
+    """与索引读取范围一致：递归所有文件，跳过隐藏文件"""
+    for file in sorted(data_dir.rglob("*")):
+        if file.is_file() and not file.name.startswith("."):
+            yield file
+
+
+def hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def compute_file_hashes(data_dir: Path) -> dict[str, str]:
+    """{相对路径（posix）: sha256}"""
+    hashes = {}
+    for file in iter_data_files(data_dir):
+        try:
+            hashes[file.relative_to(data_dir).as_posix()] = hash_file(file)
+        except OSError:
+            continue
+    return hashes
+
+
+def load_manifest(persist_dir: Path) -> dict[str, dict] | None:
+    """返回 {相对路径: {"sha256": ..., "doc_ids": [...]}}；文件不存在或损坏时返回 None"""
+    try:
+        with open(persist_dir / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if data.get("version") != MANIFEST_VERSION:
+        return None
+    return data.get("files", {})
+
+
+def save_manifest(persist_dir: Path, files: dict[str, dict]):
+    persist_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = persist_dir / (MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, persist_dir / MANIFEST_NAME)
+
+
+def diff_manifest(old_files: dict[str, dict], new_hashes: dict[str, str]) -> tuple[list[str], list[str], list[str]]:
+    """返回 (新增, 修改, 删除) 的相对路径列表"""
+    added = [p for p in new_hashes if p not in old_files]
+    changed = [
+        p for p, digest in new_hashes.items()
+        if p in old_files and old_files[p].get("sha256") != digest
+    ]
+    removed = [p for p in old_files if p not in new_hashes]
+    return added, changed, removed
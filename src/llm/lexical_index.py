@@ -0,0 +1,228 @@
+# src/llm/lexical_index.py
+"""
+CJK 字符 n-gram 的 BM25 倒排索引，与向量检索做倒数排名融合（RRF）
+- 中日文按连续字符切出 2-gram / 3-gram，拉丁字母与数字按整词，
+  章节名、从者名等专有名词即使向量检索排不上来也能精确命中
+- 行号与 MmapVectorStore 的行号一一对应
+
+持久化格式（与向量库放在同一目录）：
+- bm25_terms.npy    int64 [T]，词项哈希（升序），查词用二分查找，加载时不建 Python 字典
+- bm25_offsets.npy  int64 [T + 1]，第 i 个词项的倒排表位于 rows/tf 的 [offsets[i], offsets[i + 1])
+- bm25_rows.npy     int32，倒排表中的行号
+- bm25_tf.npy       uint16，词频
+- bm25_doc_len.npy  int32 [N]，每行的词项总数
+- bm25_info.json    版本、参数、对应向量库的 build_id
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+LEXICAL_VERSION = 1
+_FILES = ("bm25_terms.npy", "bm25_offsets.npy", "bm25_rows.npy", "bm25_tf.npy", "bm25_doc_len.npy")
+_INFO_FILE = "bm25_info.json"
+
+# 汉字 / 假名连续片段，或拉丁字母数字单词
+_TOKEN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+
+
+def tokenize(text: str, ngram_sizes: tuple[int, ...] = (2, 3)) -> list[str]:
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if run[0].isascii():
+            tokens.append(run)
+            continue
+        if len(run) < min(ngram_sizes):
+            tokens.append(run)
+            continue
+        for n in ngram_sizes:
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list[int]], k: int = 60) -> list[tuple[int, float]]:
+    """多路排名融合：score = Σ 1 / (k + 名次)，返回按分数降序的 (行号, 分数)"""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _count_postings(texts: Iterable[str], first_row: int, ngram_sizes) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """分词并统计词频，返回 (词项哈希, 行号, 词频, 每行长度) 四个平铺数组"""
+    hashes, rows, tfs, doc_len = [], [], [], []
+    for offset, text in enumerate(texts):
+        counts = Counter(tokenize(text, ngram_sizes))
+        row = first_row + offset
+        doc_len.append(sum(counts.values()))
+        for term, tf in counts.items():
+            hashes.append(term_hash(term))
+            rows.append(row)
+            tfs.append(min(tf, 65535))
+    return (
+        np.asarray(hashes, dtype=np.int64),
+        np.asarray(rows, dtype=np.int32),
+        np.asarray(tfs, dtype=np.uint16),
+        np.asarray(doc_len, dtype=np.int32),
+    )
+
+
+class BM25Index:
+    def __init__(self, terms, offsets, rows, tf, doc_len, ngram_sizes=(2, 3), k1: float = 1.2, b: float = 0.75,
+                 build_id: str = ""):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tf = tf
+        self.doc_len = doc_len
+        self.ngram_sizes = tuple(ngram_sizes)
+        self.k1 = k1
+        self.b = b
+        self.build_id = build_id
+        self._avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    # ---------- 构建 ----------
+    @classmethod
+    def _from_flat(cls, hashes, rows, tfs, doc_len, **kwargs) -> "BM25Index":
+        order = np.lexsort((rows, hashes))
+        hashes, rows, tfs = hashes[order], rows[order], tfs[order]
+        terms, starts = np.unique(hashes, return_index=True)
+        offsets = np.append(starts, len(hashes)).astype(np.int64)
+        return cls(terms, offsets, rows, tfs, doc_len, **kwargs)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], ngram_sizes=(2, 3), **kwargs) -> "BM25Index":
+        hashes, rows, tfs, doc_len = _count_postings(texts, 0, ngram_sizes)
+        return cls._from_flat(hashes, rows, tfs, doc_len, ngram_sizes=ngram_sizes, **kwargs)
+
+    def update(self, keep_rows: list[int], new_texts: Iterable[str], build_id: str = "") -> "BM25Index":
+        """
+        增量更新，行号变化与 MmapVectorStore.take(keep_rows).extend(新分块) 一致：
+        保留行按 keep_rows 的顺序重新编号，新分块接在后面；只有新分块需要分词
+        """
+        n = len(self.doc_len)
+        remap = np.full(n, -1, dtype=np.int64)
+        remap[np.asarray(keep_rows, dtype=np.int64)] = np.arange(len(keep_rows))
+
+        term_of_posting = np.repeat(self.terms, np.diff(self.offsets))
+        new_rows = remap[self.rows]
+        alive = new_rows >= 0
+
+        add_hashes, add_rows, add_tfs, add_len = _count_postings(new_texts, len(keep_rows), self.ngram_sizes)
+        return BM25Index._from_flat(
+            np.concatenate([term_of_posting[alive], add_hashes]),
+            np.concatenate([new_rows[alive].astype(np.int32), add_rows]),
+            np.concatenate([np.asarray(self.tf)[alive], add_tfs]),
+            np.concatenate([np.asarray(self.doc_len)[np.asarray(keep_rows, dtype=np.int64)], add_len]).astype(np.int32),
+            ngram_sizes=self.ngram_sizes, k1=self.k1, b=self.b, build_id=build_id,
+        )
+
+    # ---------- 读写 ----------
+    @staticmethod
+    def exists(persist_dir: Path) -> bool:
+        return all((persist_dir / name).exists() for name in _FILES + (_INFO_FILE,))
+
+    @classmethod
+    def load(cls, persist_dir: Path) -> "BM25Index":
+        with open(persist_dir / _INFO_FILE, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("version") != LEXICAL_VERSION:
+            raise ValueError(f"BM25 索引版本不匹配：{info.get('version')}")
+        arrays = [np.load(persist_dir / name, mmap_mode="r") for name in _FILES]
+        return cls(
+            *arrays,
+            ngram_sizes=tuple(info.get("ngram_sizes", (2, 3))),
+            k1=info.get("k1", 1.2),
+            b=info.get("b", 0.75),
+            build_id=info.get("build_id", ""),
+        )
+
+    def save(self, persist_dir: Path):
+        persist_dir.mkdir(parents=True, exist_ok=True)
+        arrays = (self.terms, self.offsets, self.rows, self.tf, self.doc_len)
+        for name, array in zip(_FILES, arrays):
+            tmp_path = persist_dir / (name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp_path, persist_dir / name)
+        tmp_path = persist_dir / (_INFO_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": LEXICAL_VERSION,
+                "ngram_sizes": list(self.ngram_sizes),
+                "k1": self.k1,
+                "b": self.b,
+                "build_id": self.build_id,
+                "rows": len(self.doc_len),
+                "terms": len(self.terms),
+            }, f)
+        os.replace(tmp_path, persist_dir / _INFO_FILE)
+
+    def materialize(self) -> "BM25Index":
+        """复制到内存，释放对文件的映射（之后才能覆盖写回）"""
+        return BM25Index(
+            np.array(self.terms), np.array(self.offsets), np.array(self.rows),
+            np.array(self.tf), np.array(self.doc_len),
+            ngram_sizes=self.ngram_sizes, k1=self.k1, b=self.b, build_id=self.build_id,
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    # ---------- 检索 ----------
+    def scores(self, query: str) -> np.ndarray:
+        """每行的 BM25 分数（float32 [N]）"""
+        n = len(self.doc_len)
+        scores = np.zeros(n, dtype=np.float32)
+        if n == 0 or len(self.terms) == 0:
+            return scores
+
+        query_hashes = np.unique(np.asarray(
+            [term_hash(t) for t in tokenize(query, self.ngram_sizes)], dtype=np.int64
+        ))
+        if len(query_hashes) == 0:
+            return scores
+
+        # 二分查找后确认哈希相等（查询词可能不在词表中）
+        positions = np.searchsorted(self.terms, query_hashes)
+        valid = positions < len(self.terms)
+        positions, query_hashes = positions[valid], query_hashes[valid]
+        found = positions[np.asarray(self.terms[positions]) == query_hashes]
+
+        doc_len = np.asarray(self.doc_len, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * doc_len / max(self._avg_len, 1e-9))
+        for p in found:
+            start, end = int(self.offsets[p]), int(self.offsets[p + 1])
+            rows = np.asarray(self.rows[start:end])
+            tf = np.asarray(self.tf[start:end], dtype=np.float32)
+            df = end - start
+            idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            np.add.at(scores, rows, idf * tf * (self.k1 + 1) / (tf + norm[rows]))
+        return scores
+
+    def query(self, query: str, top_k: int = 8, rows: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """返回分数大于 0 的前 top_k 行 (行号, 分数)；rows 不为空时只在这些行中排序"""
+        scores = self.scores(query)
+        if rows is not None:
+            masked = np.zeros_like(scores)
+            masked[rows] = scores[rows]
+            scores = masked
+        n = len(scores)
+        if n == 0 or top_k <= 0:
+            return []
+        k = min(top_k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(r), float(scores[r])) for r in top if scores[r] > 0]
@@ -0,0 +1,292 @@
+# src/llm/prompt_builder.py
+"""
+按 token 预算组装提示词
+- 每个部分用分词器实测 token 数：OpenAI 模型用 tiktoken 对应编码，其他模型用 o200k_base 近似；
+  DeepSeek 用官方给出的换算比例（中文约 0.6 token/字，英文约 0.3 token/字符），不加载 tiktoken；
+  tiktoken 未安装或离线拿不到编码文件时同样退回按字符类别估算（会打印原因）
+- 编码文件第一次用到时在后台线程下载到 cache/tiktoken（TIKTOKEN_CACHE_DIR，用户自己设置时以其为准），之后离线可用；
+  下载完成之前先按字符估算，对话线程不会等下载
+- 人设、前情摘要与当前消息必须保留，其余部分按优先级依次填入剩余预算：
+  lore 按检索排名逐条、history 从最近一条往前（保持连续）、memory（召回的旧对话）按召回排名逐条、style 逐条；
+  priority 中没有列出的部分排在最后
+- 每次请求打印各部分的 token 明细
+- 布局：inline = 检索内容拼在人设后面（同一条 system 消息）；
+  cache = 人设（及前情摘要）是开头唯一的一条 system 消息，历史紧随其后，每轮变化的剧情 / 语料并入当前的 user 消息，
+  使提示词前缀逐字节稳定，可命中提供方的前缀缓存。不在对话中间插 system 消息：
+  不少 OpenAI 兼容后端会拒绝非开头的 system 消息，或悄悄降低它的权重
+"""
+import os
+import threading
+import time
+from typing import NamedTuple, Sequence
+
+from utils import resource_path
+
+# 每条消息的格式开销（角色、分隔符），与 OpenAI 官方计数示例一致；另加 3 个回复引导 token
+MESSAGE_OVERHEAD = 4
+REPLY_PRIMING = 3
+DEFAULT_PRIORITY = ("lore", "history", "memory", "style")
+LORE_HEADER = "【剧情记忆】"
+MEMORY_HEADER = "【往事回忆】"
+SUMMARY_HEADER = "【前情摘要】"
+STYLE_HEADER = "【语料参考】"
+CURRENT_HEADER = "【本轮消息】"  # cache 布局下检索内容并入当前消息时，与用户原话之间的分隔
+LAYOUT_INLINE = "inline"
+LAYOUT_CACHE = "cache"
+
+_SECTION_NAMES = {"persona": "人设", "summary": "摘要", "current": "当前消息", "lore": "剧情", "history": "历史", "memory": "回忆",
+                  "style": "语料", "framing": "格式"}
+TIKTOKEN_CACHE_DIR = "cache/tiktoken"
+
+_encodings: dict[str, object] = {}  # 模型名 → 编码（None = 加载失败，按字符估算）
+_loading: set[str] = set()           # 正在后台加载编码的模型名
+_encodings_lock = threading.Lock()
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (0x3040 <= code <= 0x30FF or 0x3400 <= code <= 0x4DBF or 0x4E00 <= code <= 0x9FFF
+            or 0xF900 <= code <= 0xFAFF or 0xFF00 <= code <= 0xFFEF or 0xAC00 <= code <= 0xD7AF)
+
+
+def estimate_tokens(text: str, cjk_ratio: float = 1.0, other_ratio: float = 0.25) -> int:
+    """按字符类别估算 token 数（CJK 字符与其他字符分别换算）"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return max(1, round(cjk * cjk_ratio + (len(text) - cjk) * other_ratio))
+
+
+def _load_encoding(model: str):
+    """
+    返回已加载的 tiktoken 编码；还没加载过时在后台线程开始加载并返回 None
+    （结果按模型名缓存，离线时不会每次重试下载）
+    """
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        if model not in _loading:
+            _loading.add(model)
+            threading.Thread(target=_fetch_encoding, args=(model,), daemon=True, name="TiktokenLoader").start()
+        return None
+
+
+def encoding_loading(model: str) -> bool:
+    with _encodings_lock:
+        return model in _loading
+
+
+def _fetch_encoding(model: str):
+    # 用户自己设置了 TIKTOKEN_CACHE_DIR 时尊重其设置
+    cache_dir = os.environ.setdefault("TIKTOKEN_CACHE_DIR", resource_path(TIKTOKEN_CACHE_DIR))
+    started = time.perf_counter()
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"[Prompt] ⚠️ 无法加载 tiktoken 编码（{e.__class__.__name__}: {str(e)[:120]}），"
+              f"token 预算改用按字符估算（与实际 token 数会有偏差）；编码缓存目录：{cache_dir}")
+        encoding = None
+    else:
+        elapsed = time.perf_counter() - started
+        if elapsed > 1.0:
+            # 编码文件不在缓存目录里，刚从网上下载了一份（之后离线也能用）
+            print(f"[Prompt] tiktoken 编码 {encoding.name} 加载耗时 {elapsed:.1f}s（已缓存到 {cache_dir}）")
+    with _encodings_lock:
+        _encodings[model] = encoding
+        _loading.discard(model)
+
+
+class TokenCounter:
+    def __init__(self, model: str, provider: str = ""):
+        self.model = model
+        self.provider = provider
+        if provider == "deepseek" or "deepseek" in model.lower():
+            # DeepSeek 词表不在 tiktoken 中，按其文档的换算比例估算
+            self._encoding = None
+            self.name = "deepseek-ratio"
+            self._ratios = (0.6, 0.3)
+        else:
+            self._encoding = _load_encoding(model)
+            self.name = self._encoding.name if self._encoding is not None else "char-estimate"
+            self._ratios = (1.0, 0.25)
+        # 编码还在后台加载时先按字符估算（一次请求内用同一种计数，明细才对得上）
+        self._waiting = self._encoding is None and encoding_loading(model)
+
+    @property
+    def outdated(self) -> bool:
+        """后台加载已经结束（成功或失败），应换一个新的计数器"""
+        return self._waiting and not encoding_loading(self.model)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return estimate_tokens(text, *self._ratios)
+
+    def count_message(self, message: dict) -> int:
+        content = message.get("content")
+        if not isinstance(content, str):
+            # 多模态消息只统计文本部分
+            content = "".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+        return MESSAGE_OVERHEAD + self.count(content)
+
+
+class PromptParts(NamedTuple):
+    persona: str
+    current: dict                   # 本轮 user 消息（必须保留）
+    lore: Sequence[str] = ()        # 按检索排名
+    style: Sequence[str] = ()
+    history: Sequence[dict] = ()    # 本轮之前的消息，时间顺序
+    memory: Sequence[str] = ()      # 从对话日志召回的旧对话，按召回排名
+    summary: str = ""               # 被挤出历史的旧对话的滚动摘要
+
+
+class SectionUsage(NamedTuple):
+    kept: int
+    total: int
+    tokens: int
+
+
+def _fill(items: Sequence[str], counter: TokenCounter, remaining: int, header: str) -> tuple[list[str], int]:
+    """逐条放入放得下的条目（放不下的跳过，继续尝试后面更短的）；有条目时计入小标题"""
+    header_cost = counter.count(header + "\n\n")
+    kept, used = [], 0
+    for item in items:
+        cost = counter.count(item + "\n\n")
+        extra = cost + (header_cost if not kept else 0)
+        if used + extra <= remaining:
+            kept.append(item)
+            used += extra
+    return kept, used
+
+
+def _fill_history(history: Sequence[dict], counter: TokenCounter, remaining: int) -> tuple[list[dict], int]:
+    """从最近一条往前放，遇到放不下的就停止，保证历史连续"""
+    kept, used = [], 0
+    for message in reversed(history):
+        cost = counter.count_message(message)
+        if used + cost > remaining:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    return kept, used
+
+
+def render_knowledge(lore: Sequence[str], style: Sequence[str], memory: Sequence[str] = ()) -> str:
+    contexts = []
+    if lore:
+        contexts.append(LORE_HEADER)
+        contexts.extend(lore)
+    if memory:
+        contexts.append(MEMORY_HEADER)
+        contexts.extend(memory)
+    if style:
+        contexts.append(STYLE_HEADER)
+        contexts.extend(style)
+    if not contexts:
+        return ""
+    return "\n\n".join(contexts) + "\n\n"
+
+
+def render_summary(summary: str) -> str:
+    return f"{SUMMARY_HEADER}\n\n{summary}\n\n" if summary else ""
+
+
+def assemble_prompt(parts: PromptParts, counter: TokenCounter, budget: int,
+                    priority: Sequence[str] = DEFAULT_PRIORITY,
+                    layout: str = LAYOUT_INLINE) -> tuple[list[dict], dict[str, SectionUsage]]:
+    """
+    返回 (messages, {部分: 用量})
+    budget：整个提示词（含消息格式开销）的 token 上限；人设、摘要与当前消息超出预算时仍然保留，只打印警告
+    layout：LAYOUT_INLINE | LAYOUT_CACHE（见模块说明）
+    """
+    persona_tokens = MESSAGE_OVERHEAD + counter.count(parts.persona)
+    current_tokens = counter.count_message(parts.current)
+    summary_text = render_summary(parts.summary)
+    summary_tokens = counter.count(summary_text)
+    # cache 布局：检索内容并入当前消息时多一行分隔标题（没有检索内容时不加，见下方 framing）
+    layout_overhead = counter.count(CURRENT_HEADER + "\n\n") if layout == LAYOUT_CACHE else 0
+    remaining = budget - REPLY_PRIMING - persona_tokens - summary_tokens - current_tokens - layout_overhead
+
+    chosen: dict[str, list] = {"lore": [], "history": [], "memory": [], "style": []}
+    usage = {
+        "persona": SectionUsage(1, 1, persona_tokens),
+        "current": SectionUsage(1, 1, current_tokens),
+    }
+    if summary_text:
+        usage["summary"] = SectionUsage(1, 1, summary_tokens)
+    priority = list(priority) + [s for s in DEFAULT_PRIORITY if s not in priority]
+    for section in priority:
+        if section == "lore":
+            kept, used = _fill(parts.lore, counter, max(0, remaining), LORE_HEADER)
+            total = len(parts.lore)
+        elif section == "style":
+            kept, used = _fill(parts.style, counter, max(0, remaining), STYLE_HEADER)
+            total = len(parts.style)
+        elif section == "memory":
+            kept, used = _fill(parts.memory, counter, max(0, remaining), MEMORY_HEADER)
+            total = len(parts.memory)
+        elif section == "history":
+            kept, used = _fill_history(parts.history, counter, max(0, remaining))
+            total = len(parts.history)
+        else:
+            continue
+        chosen[section] = kept
+        usage[section] = SectionUsage(len(kept), total, used)
+        remaining -= used
+
+    knowledge = render_knowledge(chosen["lore"], chosen["style"], chosen["memory"])
+    # 回复引导与布局带来的格式开销也记入明细，各部分之和即为实际发送的 token 数
+    usage["framing"] = SectionUsage(1, 1, REPLY_PRIMING + (layout_overhead if knowledge else 0))
+    if layout == LAYOUT_CACHE:
+        system_content = parts.persona + (f"\n\n{summary_text.rstrip()}" if summary_text else "")
+        messages = [
+            {"role": "system", "content": system_content},
+            *chosen["history"],
+            _with_context(parts.current, knowledge),
+        ]
+        return messages, usage
+
+    system_content = parts.persona + summary_text + knowledge
+    messages = [
+        {"role": "system", "content": system_content},
+        *chosen["history"],
+        parts.current,
+    ]
+    return messages, usage
+
+
+def _with_context(current: dict, knowledge: str) -> dict:
+    """把检索内容放在当前消息前面（返回新消息，不改动历史里的原消息）"""
+    if not knowledge:
+        return current
+    prefix = f"{knowledge}{CURRENT_HEADER}\n\n"
+    content = current.get("content")
+    if isinstance(content, str):
+        return {**current, "content": prefix + content}
+    # 多模态消息：作为第一段文本插入
+    return {**current, "content": [{"type": "text", "text": prefix}, *(content or [])]}
+
+
+def format_usage(usage: dict[str, SectionUsage], budget: int, counter: TokenCounter) -> str:
+    total = sum(u.tokens for u in usage.values())
+    fields = [counter.name, f"预算 {budget}"]
+    for section in ("persona", "summary", "current", "lore", "history", "memory", "style", "framing"):
+        u = usage.get(section)
+        if u is None:
+            continue
+        if section in ("persona", "summary", "current", "framing"):
+            fields.append(f"{_SECTION_NAMES[section]} {u.tokens}")
+        else:
+            fields.append(f"{_SECTION_NAMES[section]} {u.kept}/{u.total} {u.tokens}")
+    fields.append(f"合计 {total}")
+    line = "[Prompt] " + " | ".join(fields)
+    if total > budget:
+        line += "（必须保留的部分已超出预算）"
+    return line
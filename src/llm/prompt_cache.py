@@ -0,0 +1,77 @@
+# src/llm/prompt_cache.py
+"""
+提供方前缀缓存（prompt caching）的命中统计
+- DeepSeek：usage.prompt_cache_hit_tokens / prompt_cache_miss_tokens
+- OpenAI 兼容：usage.prompt_tokens_details.cached_tokens
+- 流式请求需在 payload 里带 stream_options.include_usage，最后一个 chunk 才会返回 usage
+- 按「是否命中缓存」分别统计首字延迟与总耗时，用来衡量缓存友好布局的收益
+"""
+import threading
+from typing import NamedTuple
+
+
+class CacheUsage(NamedTuple):
+    prompt_tokens: int
+    cached_tokens: int
+
+
+def parse_cache_usage(usage: dict | None) -> CacheUsage | None:
+    """从响应的 usage 字段取出 (提示词 token 数, 命中缓存的 token 数)；没有 usage 时返回 None"""
+    if not isinstance(usage, dict):
+        return None
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    if "prompt_cache_hit_tokens" in usage:
+        cached = int(usage.get("prompt_cache_hit_tokens") or 0)
+        if not prompt_tokens:
+            prompt_tokens = cached + int(usage.get("prompt_cache_miss_tokens") or 0)
+    else:
+        details = usage.get("prompt_tokens_details") or {}
+        cached = int(details.get("cached_tokens") or 0) if isinstance(details, dict) else 0
+    return CacheUsage(prompt_tokens, cached)
+
+
+class PromptCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.hit_requests = 0
+        # {命中/未命中: [请求数, 首字延迟总和, 总耗时总和]}
+        self._latency = {True: [0, 0.0, 0.0], False: [0, 0.0, 0.0]}
+
+    def record(self, usage: CacheUsage, first_token_s: float | None, total_s: float):
+        hit = usage.cached_tokens > 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens
+            self.cached_tokens += usage.cached_tokens
+            self.hit_requests += int(hit)
+            bucket = self._latency[hit]
+            bucket[0] += 1
+            bucket[1] += first_token_s if first_token_s is not None else total_s
+            bucket[2] += total_s
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {
+                "requests": self.requests,
+                "hit_requests": self.hit_requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "token_hit_rate": (self.cached_tokens / self.prompt_tokens) if self.prompt_tokens else 0.0,
+            }
+            for hit, label in ((True, "hit"), (False, "miss")):
+                count, first, total = self._latency[hit]
+                result[f"{label}_avg_first_token_s"] = (first / count) if count else 0.0
+                result[f"{label}_avg_total_s"] = (total / count) if count else 0.0
+            return result
+
+
+def format_cache_usage(usage: CacheUsage, first_token_s: float | None, total_s: float) -> str:
+    rate = (usage.cached_tokens / usage.prompt_tokens) if usage.prompt_tokens else 0.0
+    fields = [f"缓存命中 {usage.cached_tokens}/{usage.prompt_tokens}（{rate:.0%}）"]
+    if first_token_s is not None:
+        fields.append(f"首字 {first_token_s:.2f}s")
+    fields.append(f"总耗时 {total_s:.2f}s")
+    return "[PromptCache] " + " | ".join(fields)
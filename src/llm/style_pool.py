@@ -0,0 +1,72 @@
+# src/llm/style_pool.py
+"""
+Style 语料池：索引加载时一次性筛出合格台词，之后每次对话只做 O(1) 的随机抽取
+- 台词存成元组（只读、紧凑），运行期间不再遍历 docstore
+- 近期抽过的台词用「环形缓冲 + 集合」记录，查重 O(1)，语义与原来「避开最近 15 条」一致
+"""
+import random
+import threading
+from collections import deque
+from typing import Iterable
+
+
+class StyleSampler:
+    def __init__(self, lines: Iterable[str], history_size: int = 15, rng: random.Random | None = None):
+        # 去重并保持原顺序（同一句台词只占一个位置）
+        self.lines: tuple[str, ...] = tuple(dict.fromkeys(lines))
+        self._recent: deque[int] = deque()
+        self._recent_set: set[int] = set()
+        self._history_size = max(0, int(history_size))
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], min_len: int = 20, max_len: int = 300, **kwargs) -> "StyleSampler":
+        """从 Style 向量库的分块中筛出长度合适的台词"""
+        lines = []
+        for text in texts:
+            content = text.strip()
+            if min_len <= len(content) <= max_len:
+                lines.append(content)
+        return cls(lines, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def _remember(self, idx: int):
+        self._recent.append(idx)
+        self._recent_set.add(idx)
+        while len(self._recent) > self._history_size:
+            self._recent_set.discard(self._recent.popleft())
+
+    def sample(self, max_count: int = 3) -> list[str]:
+        """
+        随机抽取 1~max_count 条近期未出现过的台词
+        - 可选台词耗尽时清空历史（与原逻辑一致）
+        - 拒绝采样：语料远大于历史长度，期望常数次即可抽中
+        """
+        n = len(self.lines)
+        if n == 0 or max_count <= 0:
+            return []
+
+        with self._lock:
+            available = n - len(self._recent_set)
+            if available <= 0:
+                self._recent.clear()
+                self._recent_set.clear()
+                available = n
+
+            count = self._rng.randint(1, min(max_count, available))
+            chosen: list[int] = []
+            chosen_set: set[int] = set()
+            while len(chosen) < count:
+                idx = self._rng.randrange(n)
+                if idx in self._recent_set or idx in chosen_set:
+                    continue
+                chosen.append(idx)
+                chosen_set.add(idx)
+
+            for idx in chosen:
+                self._remember(idx)
+
+        return [self.lines[i] for i in chosen]
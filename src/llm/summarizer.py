@@ -0,0 +1,136 @@
+# src/llm/summarizer.py
+"""
+滚动对话摘要
+- 历史超出保留轮数时，被挤出的消息先进入待摘要队列（在摘要完成之前仍然原样发送，不丢上下文）
+- 回复送达界面之后，由后台线程把「已有摘要 + 待摘要消息」交给 LLM 压缩成新的摘要，
+  摘要请求从不出现在对话请求的路径上；同一时间最多一个摘要任务
+- 摘要请求的 token 消耗与耗时单独统计，不混进对话请求的缓存 / 端点统计
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你负责为一段角色扮演对话维护「前情摘要」。"
+    "把已有摘要与新增对话合并成一段新的摘要：保留用户透露的个人信息、偏好、约定、未完成的话题与重要事件，"
+    "省略寒暄与重复内容；用第三人称、陈述句，不要加入对话中没有的内容。"
+)
+
+
+class ConversationSummarizer:
+    def __init__(self, request_fn: Callable[[list[dict], int], tuple[str, dict | None]], max_chars: int = 300,
+                 max_tokens: int = 400):
+        """request_fn(messages, max_tokens) -> (摘要文本, 响应中的 usage)"""
+        self.request_fn = request_fn
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._summary = ""
+        self._pending: list[dict] = []
+        self._running = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Summarizer")
+
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_s = 0.0
+        self.summarized_messages = 0
+
+    @property
+    def summary(self) -> str:
+        with self._lock:
+            return self._summary
+
+    def add_evicted(self, messages: list[dict]):
+        """历史裁剪时调用：被挤出的消息按时间顺序排队等待摘要"""
+        if not messages:
+            return
+        with self._lock:
+            self._pending.extend(messages)
+
+    def pending_messages(self) -> list[dict]:
+        """已挤出历史、但还没并入摘要的消息（组装提示词时放在历史最前面）"""
+        with self._lock:
+            return list(self._pending)
+
+    def schedule(self, user_name: str):
+        """有待摘要的消息且没有摘要任务在跑时，提交一次后台摘要；立即返回"""
+        with self._lock:
+            if self._running or not self._pending:
+                return
+            self._running = True
+        self._executor.submit(self._run, user_name)
+
+    def _build_messages(self, summary: str, pending: list[dict], user_name: str) -> list[dict]:
+        lines = []
+        for message in pending:
+            speaker = user_name if message["role"] == "user" else "你"
+            lines.append(f"{speaker}：{message['content'].strip()}")
+        return [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": (
+                    f"已有摘要：\n{summary or '（无）'}\n\n"
+                    "新增对话：\n" + "\n".join(lines) + "\n\n"
+                    f"请输出更新后的摘要，不超过 {self.max_chars} 字，只输出摘要本身。"
+                ),
+            },
+        ]
+
+    def _run(self, user_name: str):
+        try:
+            while True:
+                with self._lock:
+                    summary, pending = self._summary, list(self._pending)
+                if not pending:
+                    return
+                started = time.perf_counter()
+                try:
+                    text, usage = self.request_fn(self._build_messages(summary, pending, user_name), self.max_tokens)
+                except Exception as e:
+                    text, usage = "", None
+                    print(f"[Summary] 摘要请求失败：{e}")
+                elapsed = time.perf_counter() - started
+                self._record(usage, elapsed, ok=bool(text and text.strip()))
+                if not text or not text.strip():
+                    # 失败时保留待摘要消息（仍原样发送），下一次回复后再试
+                    return
+                with self._lock:
+                    self._summary = text.strip()[: self.max_chars * 2]
+                    # 摘要期间可能又有新消息被挤出，只移除本次已经并入摘要的部分
+                    del self._pending[: len(pending)]
+                    self.summarized_messages += len(pending)
+        finally:
+            with self._lock:
+                self._running = False
+
+    def _record(self, usage: dict | None, elapsed: float, ok: bool):
+        prompt_tokens = int((usage or {}).get("prompt_tokens") or 0)
+        completion_tokens = int((usage or {}).get("completion_tokens") or 0)
+        with self._lock:
+            self.calls += 1
+            self.failures += int(not ok)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.total_s += elapsed
+        print(f"[Summary] 摘要请求 | 输入 {prompt_tokens} tokens | 输出 {completion_tokens} tokens | "
+              f"耗时 {elapsed:.2f}s{'' if ok else '（失败）'}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "avg_latency_s": (self.total_s / self.calls) if self.calls else 0.0,
+                "summarized_messages": self.summarized_messages,
+                "pending_messages": len(self._pending),
+                "summary_chars": len(self._summary),
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
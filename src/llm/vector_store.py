@@ -0,0 +1,311 @@
+# src/llm/vector_store.py
+"""
+内存映射的二进制向量库（替代 llama_index 的 JSON docstore / vector store 加载路径）
+
+持久化格式（persist_dir 下）：
+- embeddings.npy      [N, dim] 的 float32 / float16 矩阵，行向量已 L2 归一化
+- chunks.bin          每个分块一条 UTF-8 JSON 记录 {"text": ..., "metadata": {...}}，首尾相接
+- chunks_offsets.npy  int64 [N + 1]，第 i 条记录位于 chunks.bin[offsets[i]:offsets[i + 1]]
+- store_info.json     版本、维度、dtype、条数、build_id（每次保存重新生成，供配套索引校验是否同步）
+
+加载时 np.load(mmap_mode="r") + mmap，几乎不耗时，只有实际访问到的页才会占用内存；
+检索是一次矩阵乘法 + argpartition
+"""
+import json
+import mmap
+import os
+import uuid
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+
+STORE_VERSION = 1
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks_offsets.npy"
+INFO_FILE = "store_info.json"
+
+
+class RetrievedChunk:
+    """检索结果；接口与 llama_index 的 NodeWithScore 保持一致（get_content / score）"""
+
+    __slots__ = ("row", "text", "metadata", "score")
+
+    def __init__(self, row: int, text: str, metadata: dict, score: float):
+        self.row = row
+        self.text = text
+        self.metadata = metadata
+        self.score = score
+
+    def get_content(self) -> str:
+        return self.text
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+
+def source_doc_ids(metadata: dict) -> list[str]:
+    """分块的所有来源文档：自身 + 构建时合并进来的近重复分块"""
+    return [metadata.get("doc_id")] + [d.get("doc_id") for d in metadata.get("duplicates", [])]
+
+
+def mmr_select(query_embedding, candidates: np.ndarray, top_k: int, lambda_mult: float = 0.7,
+               relevance=None) -> list[int]:
+    """
+    最大边际相关性（MMR）：每步选 lambda * 相关度 - (1 - lambda) * 与已选结果的最大相似度 最高的候选
+    relevance：每个候选的相关度（如混合检索的融合分数，调用方归一化到 0~1）；为空时用与 query_embedding 的余弦相似度
+    候选两两相似度一次矩阵乘法算好，之后每步只做向量化的 max 更新；返回候选下标（按入选顺序）
+    """
+    n = len(candidates)
+    if n == 0 or top_k <= 0:
+        return []
+    matrix = _normalize_rows(np.asarray(candidates, dtype=np.float32))
+    if relevance is None:
+        q = np.asarray(query_embedding, dtype=np.float32)
+        relevance = matrix @ (q / max(float(np.linalg.norm(q)), 1e-12))
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+    pairwise = matrix @ matrix.T
+
+    selected = [int(np.argmax(relevance))]
+    max_sim = pairwise[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(top_k, n):
+        mmr = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_sim, pairwise[best], out=max_sim)
+    return selected
+
+
+class MmapVectorStore:
+    def __init__(self, embeddings: np.ndarray, offsets: np.ndarray, blob, blob_file=None):
+        self.embeddings = embeddings
+        self.offsets = offsets
+        self._blob = blob
+        self._blob_file = blob_file
+        self.build_id = ""
+
+    # ---------- 构建 ----------
+    @classmethod
+    def from_records(
+        cls,
+        texts: list[str],
+        metadatas: list[dict],
+        embeddings: Iterable[Iterable[float]],
+        dtype: str = "float32",
+    ) -> "MmapVectorStore":
+        """由内存中的分块构建（尚未落盘）"""
+        matrix = np.asarray(list(embeddings), dtype=np.float32)
+        if matrix.size == 0:
+            matrix = matrix.reshape(0, 0)
+        else:
+            matrix = _normalize_rows(matrix)
+        matrix = matrix.astype(np.dtype(dtype))
+
+        chunks = []
+        offsets = [0]
+        for text, metadata in zip(texts, metadatas):
+            record = json.dumps({"text": text, "metadata": metadata}, ensure_ascii=False).encode("utf-8")
+            chunks.append(record)
+            offsets.append(offsets[-1] + len(record))
+
+        return cls(matrix, np.asarray(offsets, dtype=np.int64), b"".join(chunks))
+
+    # ---------- 读写 ----------
+    @staticmethod
+    def exists(persist_dir: Path) -> bool:
+        return all((persist_dir / name).exists() for name in (EMBEDDINGS_FILE, CHUNKS_FILE, OFFSETS_FILE, INFO_FILE))
+
+    @classmethod
+    def load(cls, persist_dir: Path) -> "MmapVectorStore":
+        with open(persist_dir / INFO_FILE, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("version") != STORE_VERSION:
+            raise ValueError(f"向量库版本不匹配：{info.get('version')}")
+
+        embeddings = np.load(persist_dir / EMBEDDINGS_FILE, mmap_mode="r")
+        offsets = np.load(persist_dir / OFFSETS_FILE, mmap_mode="r")
+        if len(offsets) != embeddings.shape[0] + 1:
+            raise ValueError("向量与分块数量不一致")
+
+        blob_path = persist_dir / CHUNKS_FILE
+        if blob_path.stat().st_size == 0:
+            store = cls(embeddings, offsets, b"")
+        else:
+            blob_file = open(blob_path, "rb")
+            blob = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+            store = cls(embeddings, offsets, blob, blob_file)
+        store.build_id = info.get("build_id", "")
+        return store
+
+    def save(self, persist_dir: Path):
+        """写入临时文件后替换；若当前对象本身是从该目录映射来的，需先 materialize()"""
+        persist_dir.mkdir(parents=True, exist_ok=True)
+        self.build_id = uuid.uuid4().hex
+
+        def write(name: str, writer):
+            tmp_path = persist_dir / (name + ".tmp")
+            writer(tmp_path)
+            os.replace(tmp_path, persist_dir / name)
+
+        def write_npy(array):
+            def writer(path):
+                with open(path, "wb") as f:
+                    np.save(f, np.ascontiguousarray(array))
+            return writer
+
+        def write_blob(path):
+            with open(path, "wb") as f:
+                f.write(self._blob[:])
+
+        def write_info(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": STORE_VERSION,
+                    "count": len(self),
+                    "dim": self.dim,
+                    "dtype": str(self.embeddings.dtype),
+                    "build_id": self.build_id,
+                }, f)
+
+        write(EMBEDDINGS_FILE, write_npy(self.embeddings))
+        write(OFFSETS_FILE, write_npy(self.offsets))
+        write(CHUNKS_FILE, write_blob)
+        write(INFO_FILE, write_info)
+
+    def materialize(self) -> "MmapVectorStore":
+        """复制到内存并释放文件映射（Windows 下被映射的文件无法替换）"""
+        store = MmapVectorStore(np.array(self.embeddings), np.array(self.offsets), bytes(self._blob[:]))
+        self.close()
+        return store
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        if self._blob_file:
+            self._blob_file.close()
+            self._blob_file = None
+        self._blob = b""
+        dim = self.dim
+        self.embeddings = np.zeros((0, dim), dtype=self.embeddings.dtype)
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    # ---------- 访问 ----------
+    def __len__(self) -> int:
+        return int(self.embeddings.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.embeddings.shape[1]) if self.embeddings.ndim == 2 else 0
+
+    def get_record(self, row: int) -> dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(bytes(self._blob[start:end]).decode("utf-8"))
+
+    def get_text(self, row: int) -> str:
+        return self.get_record(row)["text"]
+
+    def get_metadata(self, row: int) -> dict:
+        return self.get_record(row)["metadata"]
+
+    def iter_records(self) -> Iterator[dict]:
+        for row in range(len(self)):
+            yield self.get_record(row)
+
+    def iter_texts(self) -> Iterator[str]:
+        for record in self.iter_records():
+            yield record["text"]
+
+    # ---------- 检索 ----------
+    def similarity(self, query_embedding, rows: np.ndarray | None = None) -> np.ndarray:
+        """查询向量与分块的余弦相似度（一次矩阵乘法）；rows 不为空时只计算这些行"""
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        matrix = self.embeddings if rows is None else self.embeddings[rows]
+        return (matrix @ q.astype(self.embeddings.dtype)).astype(np.float32)
+
+    def query(self, query_embedding, top_k: int = 8, similarity_cutoff: float | None = None,
+              rows: np.ndarray | None = None) -> list[RetrievedChunk]:
+        """rows：限定检索范围（例如实体倒排表给出的候选行）"""
+        n = len(self) if rows is None else len(rows)
+        if n == 0 or top_k <= 0:
+            return []
+
+        scores = self.similarity(query_embedding, rows)
+        k = min(top_k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if similarity_cutoff is not None and score < similarity_cutoff:
+                break
+            row = int(i) if rows is None else int(rows[i])
+            record = self.get_record(row)
+            results.append(RetrievedChunk(row, record["text"], record["metadata"], score))
+        return results
+
+    # ---------- 增量更新 ----------
+    def rows_without_docs(self, doc_ids: set[str]) -> list[int]:
+        """来源中不含指定文档的行号（来源 = metadata.doc_id + 近重复合并掉的 duplicates）"""
+        return [
+            row for row in range(len(self))
+            if doc_ids.isdisjoint(source_doc_ids(self.get_metadata(row)))
+        ]
+
+    def docs_sharing_rows(self, doc_ids: set[str]) -> set[str]:
+        """与指定文档共用分块（近重复合并）的全部文档"""
+        shared = set()
+        for row in range(len(self)):
+            sources = source_doc_ids(self.get_metadata(row))
+            if not doc_ids.isdisjoint(sources):
+                shared.update(sources)
+        return shared
+
+    def with_duplicates(self, extra: dict[int, list[dict]]) -> "MmapVectorStore":
+        """返回新库：给指定行的 metadata["duplicates"] 追加近重复来源（向量与正文不变）"""
+        chunks = []
+        offsets = [0]
+        for row in range(len(self)):
+            record = bytes(self._blob[int(self.offsets[row]):int(self.offsets[row + 1])])
+            if row in extra:
+                parsed = json.loads(record.decode("utf-8"))
+                metadata = parsed["metadata"]
+                metadata["duplicates"] = metadata.get("duplicates", []) + extra[row]
+                record = json.dumps(parsed, ensure_ascii=False).encode("utf-8")
+            chunks.append(record)
+            offsets.append(offsets[-1] + len(record))
+        return MmapVectorStore(np.asarray(self.embeddings), np.asarray(offsets, dtype=np.int64), b"".join(chunks))
+
+    def take(self, rows: list[int]) -> "MmapVectorStore":
+        """按行号挑出分块，组成新库（记录字节直接拷贝，不重新解析）"""
+        chunks = []
+        offsets = [0]
+        for row in rows:
+            record = bytes(self._blob[int(self.offsets[row]):int(self.offsets[row + 1])])
+            chunks.append(record)
+            offsets.append(offsets[-1] + len(record))
+        if rows:
+            matrix = np.asarray(self.embeddings[rows])
+        else:
+            matrix = np.zeros((0, self.dim), dtype=self.embeddings.dtype)
+        return MmapVectorStore(matrix, np.asarray(offsets, dtype=np.int64), b"".join(chunks))
+
+    def extend(self, other: "MmapVectorStore") -> "MmapVectorStore":
+        """返回拼接后的新库（自身不变）"""
+        if len(other) == 0:
+            return self.take(list(range(len(self))))
+        if len(self) == 0:
+            return other
+        matrix = np.concatenate([np.asarray(self.embeddings), other.embeddings.astype(self.embeddings.dtype)])
+        blob = bytes(self._blob[:]) + bytes(other._blob[:])
+        offsets = np.concatenate([np.asarray(self.offsets), np.asarray(other.offsets[1:]) + int(self.offsets[-1])])
+        return MmapVectorStore(matrix, offsets.astype(np.int64), blob)
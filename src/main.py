@@ -2,7 +2,7 @@
 import sys
 import os
 from PySide6.QtWidgets import QApplication
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from gui.pet_window import PetWindow
 from gui.tray import AppTray
 from settings_manager import SettingsManager
@@ -22,6 +22,12 @@ def main():
     pet.set_context_menu(menu)
     tray_icon_path = resource_path("assets/images/icon.ico")
     tray = AppTray(app, pet_window=pet, icon_path=tray_icon_path, menu=menu)
+
+    # 分阶段启动：桌宠与托盘先出现并可交互，事件循环开始后再在后台加载索引
+    QTimer.singleShot(0, pet.start_background_init)
     sys.exit(app.exec())
 if __name__ == "__main__":
+    # 构建索引时分块使用 spawn 进程池：PyInstaller 打包后子进程需要这一行才能正常启动
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,288 @@
+# src/memory/conversation_log.py
+"""
+持久化对话日志 + 长期记忆召回
+- 每一轮对话写入本地 SQLite（WAL 模式），FTS5 全文索引存 CJK 2-gram / 拉丁整词（与 lore 的 BM25 同一套切词），
+  不依赖 SQLite 的 trigram 分词器，两个字的人名、地名也能命中
+- 写入只在后台写线程里进行：append() 只是放进队列，攒够 batch_size 条或每隔 flush_interval_s 秒一个事务提交
+- 一问一答写入时带同一个 pair_id（new_pair_id()），召回时按它找回另一半；屏幕评论等单独的一条没有 pair_id
+- 可选为每轮计算向量（embed_fn，由 ChatManager 在嵌入模型加载后设置），召回时对全文检索的候选重排
+- 召回有时间上限：超过 timeout_ms 的 FTS 查询由 progress handler 中断，本轮直接不带回忆
+"""
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+from llm.lexical_index import reciprocal_rank_fusion, tokenize
+
+SCHEMA_VERSION = 2  # 2：turns 增加 pair_id
+_MAX_QUERY_TERMS = 12
+_MAX_TERM_DF = 0.05  # 出现在超过 5% 轮次里的词项（「今天」「什么」之类）不参与召回
+_MIN_DF_LIMIT = 100  # 日志还小时不按比例剔除
+_FLUSH_DUE = object()  # 写线程内部：距第一条未提交记录已过 flush_interval_s
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    embedding BLOB,
+    pair_id INTEGER
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(terms);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_vocab USING fts5vocab(turns_fts, 'row');
+"""
+
+
+class RecalledTurn(NamedTuple):
+    id: int
+    ts: float
+    role: str
+    content: str
+    score: float
+
+
+def _terms(text: str) -> list[str]:
+    return list(dict.fromkeys(tokenize(text, (2,))))
+
+
+def _match_expr(terms: list[str]) -> str:
+    # 每个词项加双引号，避免与 FTS5 的查询语法（AND / NOT / * 等）冲突
+    return " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+class ConversationLog:
+    def __init__(
+        self,
+        db_path: str | Path,
+        batch_size: int = 32,
+        flush_interval_s: float = 2.0,
+        embed_fn: Callable[[str], list[float]] | None = None,
+    ):
+        self.db_path = Path(db_path)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval_s = max(0.05, float(flush_interval_s))
+        self.embed_fn = embed_fn
+
+        # 建库、建表也在写线程里做，构造函数不碰磁盘（ChatManager 在 GUI 线程中创建）
+        self._ready = threading.Event()
+        self._reader: sqlite3.Connection | None = None
+        self._reader_lock = threading.Lock()
+
+        self._queue: queue.Queue = queue.Queue()
+        self._pair_lock = threading.Lock()
+        self._last_pair_id = 0
+        self._closed = False
+        self.written = 0
+        self._writer = threading.Thread(target=self._write_loop, name="ConversationLog", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # ---------- 写入（后台线程） ----------
+    def new_pair_id(self) -> int:
+        """为一问一答分配 pair_id：按纳秒时间戳单调递增，不需要查库，重启后也不会与旧的重复"""
+        with self._pair_lock:
+            self._last_pair_id = max(self._last_pair_id + 1, time.time_ns())
+            return self._last_pair_id
+
+    def append(self, role: str, content: str, ts: float | None = None, pair_id: int | None = None):
+        """只入队，不做任何磁盘 IO；可以在任何线程调用"""
+        if self._closed or not content.strip():
+            return
+        self._queue.put((time.time() if ts is None else ts, role, content.strip(), pair_id))
+
+    def flush(self, timeout: float | None = None):
+        """等待此前入队的记录全部落盘"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _write_loop(self):
+        try:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path))
+            conn.executescript("PRAGMA journal_mode=WAL;" + _SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(turns)")}
+            if "pair_id" not in columns:
+                # 版本 1 的日志：旧记录没有 pair_id，召回时只带回命中的那一条
+                conn.execute("ALTER TABLE turns ADD COLUMN pair_id INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_pair ON turns (pair_id)")
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error as e:
+            print(f"[ConversationLog] 打开对话日志失败：{e}")
+            self._closed = True
+            return
+        finally:
+            self._ready.set()
+        pending, waiters = [], []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = _FLUSH_DUE
+            if item is None:
+                self._commit(conn, pending)
+                break
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not _FLUSH_DUE:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval_s
+            if item is _FLUSH_DUE or waiters or len(pending) >= self.batch_size:
+                self._commit(conn, pending)
+                pending, deadline = [], None
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, records: list[tuple]):
+        if not records:
+            return
+        embeddings = [None] * len(records)
+        if self.embed_fn is not None:
+            for i, (_, _, content, _) in enumerate(records):
+                try:
+                    vec = np.asarray(self.embed_fn(content), dtype=np.float32)
+                    embeddings[i] = (vec / max(float(np.linalg.norm(vec)), 1e-12)).tobytes()
+                except Exception as e:
+                    print(f"[ConversationLog] 计算对话向量失败：{e}")
+                    break
+        try:
+            with conn:
+                for (ts, role, content, pair_id), emb in zip(records, embeddings):
+                    cur = conn.execute(
+                        "INSERT INTO turns (ts, role, content, embedding, pair_id) VALUES (?, ?, ?, ?, ?)",
+                        (ts, role, content, emb, pair_id),
+                    )
+                    conn.execute(
+                        "INSERT INTO turns_fts (rowid, terms) VALUES (?, ?)",
+                        (cur.lastrowid, " ".join(_terms(content))),
+                    )
+            self.written += len(records)
+        except sqlite3.Error as e:
+            print(f"[ConversationLog] 写入对话日志失败：{e}")
+
+    # ---------- 召回 ----------
+    def _get_reader(self) -> sqlite3.Connection | None:
+        """调用方需持有 _reader_lock；写线程建好库之前最多等 1 秒"""
+        if self._reader is None and not self._closed and self._ready.wait(1.0) and not self._closed:
+            self._reader = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        return self._reader
+
+    def recall(self, query: str, top_k: int = 3, timeout_ms: float = 50, candidates: int = 30,
+               query_embedding=None, exclude: set[str] | None = None) -> list[RecalledTurn]:
+        """
+        全文检索取前 candidates 条候选（BM25 排序）；有查询向量且候选存有向量时，与向量相似度排名做 RRF 融合
+        exclude：不召回这些内容（通常是仍在上下文里的近期历史）；超时返回空列表
+        """
+        terms = _terms(query)
+        if not terms or top_k <= 0:
+            return []
+        deadline = time.perf_counter() + timeout_ms / 1000.0
+        with self._reader_lock:
+            reader = self._get_reader()
+            if reader is None:
+                return []
+            # 每执行 1000 条虚拟机指令检查一次，超时返回非零值中断查询
+            reader.set_progress_handler(lambda: int(time.perf_counter() > deadline), 1000)
+            try:
+                terms = self._selective_terms(reader, terms)
+                if not terms:
+                    return []
+                rows = reader.execute(
+                    "SELECT t.id, t.ts, t.role, t.content, t.embedding, bm25(turns_fts) AS rank "
+                    "FROM turns_fts JOIN turns t ON t.id = turns_fts.rowid "
+                    "WHERE turns_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (_match_expr(terms), int(candidates)),
+                ).fetchall()
+            except sqlite3.OperationalError as e:
+                if "interrupt" in str(e):
+                    print(f"[ConversationLog] 召回超过 {timeout_ms:.0f}ms，本轮跳过")
+                    return []
+                raise
+            finally:
+                reader.set_progress_handler(None, 0)
+
+        if exclude:
+            rows = [r for r in rows if r[3] not in exclude]
+        if not rows:
+            return []
+
+        scores = {r[0]: -r[5] for r in rows}  # FTS5 的 bm25() 越小越相关
+        order = [r[0] for r in rows]
+        with_vec = [r for r in rows if r[4] is not None]
+        if query_embedding is not None and with_vec:
+            q = np.asarray(query_embedding, dtype=np.float32)
+            q = q / max(float(np.linalg.norm(q)), 1e-12)
+            matrix = np.frombuffer(b"".join(r[4] for r in with_vec), dtype=np.float32).reshape(len(with_vec), -1)
+            if matrix.shape[1] == q.shape[0]:
+                sims = matrix @ q
+                vector_order = [with_vec[i][0] for i in np.argsort(-sims)]
+                fused = reciprocal_rank_fusion([order, vector_order])
+                order = [row_id for row_id, _ in fused]
+                scores = dict(fused)
+
+        by_id = {r[0]: r for r in rows}
+        return [
+            RecalledTurn(row_id, by_id[row_id][1], by_id[row_id][2], by_id[row_id][3], scores[row_id])
+            for row_id in order[:top_k]
+        ]
+
+    @staticmethod
+    def _selective_terms(reader: sqlite3.Connection, terms: list[str]) -> list[str]:
+        """
+        按文档频率筛选查询词项：去掉日志里没有的、以及过于常见的，剩下的按稀有程度取前 _MAX_QUERY_TERMS 个
+        常见的 2-gram 倒排表很长，OR 进查询会让 bm25 排序扫描大半个索引
+        """
+        placeholders = ",".join("?" * len(terms))
+        df = dict(reader.execute(f"SELECT term, doc FROM turns_vocab WHERE term IN ({placeholders})", terms))
+        total = reader.execute("SELECT max(rowid) FROM turns_fts").fetchone()[0] or 0
+        limit = max(_MIN_DF_LIMIT, int(total * _MAX_TERM_DF))
+        kept = sorted((t for t in terms if 0 < df.get(t, 0) <= limit), key=lambda t: df[t])
+        return kept[:_MAX_QUERY_TERMS]
+
+    def neighbors(self, turn_id: int) -> list[tuple[str, str]]:
+        """
+        (角色, 内容)：该轮与同一 pair_id 的另一半，按写入顺序（提问在前）
+        没有 pair_id 的（屏幕评论、没拿到回复的提问、版本 1 的旧记录）只返回它自己
+        """
+        with self._reader_lock:
+            reader = self._get_reader()
+            if reader is None:
+                return []
+            hit = reader.execute("SELECT role, content, pair_id FROM turns WHERE id = ?", (turn_id,)).fetchone()
+            if hit is None:
+                return []
+            if hit[2] is None:
+                return [(hit[0], hit[1])]
+            rows = reader.execute(
+                "SELECT role, content FROM turns WHERE pair_id = ? ORDER BY id", (hit[2],)
+            ).fetchall()
+        return [(role, content) for role, content in rows]
+
+    def count(self) -> int:
+        with self._reader_lock:
+            reader = self._get_reader()
+            return reader.execute("SELECT COUNT(*) FROM turns").fetchone()[0] if reader else 0
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+        with self._reader_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
@@ -24,14 +24,85 @@ DEFAULTS = {
         "api_key": "",
         "model": "gpt-4o-mini",
         "temperature": 1.0,  # 默认 temperature
-        "max_tokens": 512
+        "max_tokens": 512,
+        "prompt_budget": 24000,  # 每次请求的提示词 token 上限（人设与当前消息之外按优先级填充）
+        "prompt_priority": ["lore", "history", "memory", "style"],  # 预算不足时先保证靠前的部分；未列出的排在最后
+        "prompt_layout": "cache",  # cache = 人设在前保持不变、检索内容并入当前 user 消息（命中前缀缓存，只有开头一条 system）| inline = 检索内容拼进人设
+        "stream_usage": True,  # 流式请求附带 stream_options.include_usage，用于统计缓存命中
+        "stream": True,  # 流式输出（SSE），不支持的提供方可关闭
+        "endpoints": [],  # 备用端点 [{"name", "provider", "base_url", "api_key", "model"}]，缺省字段沿用上面的主端点
+        "hedge": True,  # 首字超过端点 p95 延迟时向下一个端点再发一份，先到者胜出
+        "hedge_delay_s": 4.0,  # 延迟样本不足时的对冲等待
+        "hedge_min_delay_s": 0.5,
+        "hedge_max_delay_s": 15.0,
+        "endpoint_cooldown_s": 30.0  # 端点连续失败后暂停使用的时间
     },
     "vision": {
         "api_url": "https://api.siliconflow.cn/v1/chat/completions",
         "api_key": "",
         "enabled": False,
         "auto_interval": 0,
+        "capture_mode": "pet_monitor",  # pet_monitor | cursor_monitor | active_window（仅 Windows）| tiles | all
+        "max_edge": 1568,  # 截图长边缩到多少像素再上传，0 = 原尺寸
+        "image_format": "jpeg",  # jpeg | webp | png
+        "image_quality": 80,  # jpeg / webp 质量
+        "save_screenshots": False,  # 调试用：把上传的截图另存到 screenshots/
         "keep_last_n_screenshots": 3
+    },
+    "knowledge": {
+        "embedding_backend": "torch",  # torch | onnx
+        "onnx_model_file": "onnx/model.onnx",  # 相对模型目录
+        "embedding_threads": 0,  # 嵌入推理线程数，0 = 与 build_max_threads 一致
+        "embed_batch_size": 64,  # 构建索引时每批嵌入的分块数（按长度排序后分批）
+        "parallel_build": True,  # Lore 与 Style 同时加载 / 构建
+        "build_workers": 0,  # 读取 + 分块的进程数，0 = 自动；1 = 不使用进程池
+        "build_max_threads": 0,  # 构建索引最多占用的 CPU 线程数，0 = 核心数的一半
+        "vector_dtype": "float32",  # 向量库存储精度：float32 | float16
+        "query_cache_size": 256,  # 查询向量 LRU 缓存条数
+        "query_cache_persist": True,  # 缓存落盘到 knowledge_db/query_cache.json
+        "retrieval_mode": "hybrid",  # hybrid = 向量 + BM25 融合 | vector = 纯向量
+        "rrf_k": 60,  # 倒数排名融合的平滑常数
+        "entity_routing": True,  # 查询提到译名对照表中的实体时只检索其所在分块
+        "dedup": True,  # 构建索引时合并近重复分块（MinHash）
+        "dedup_threshold": 0.85,  # 估计 Jaccard 相似度阈值
+        "lore_chunk_size": 1000,  # Lore 分块长度（字符），修改后下次启动重建 Lore 索引
+        "lore_chunk_overlap": 150,  # 相邻 Lore 分块的重叠长度
+        "similarity_top_k": 8,  # 向量 / BM25 各取的候选分块数（融合后也保留这么多）
+        "similarity_cutoff": 0.2,  # 向量检索的相似度下限
+        "lore_top_n": 3,  # 每轮放入提示词的剧情分块数
+        "mmr_lambda": 0.7,  # MMR：1 = 只看相关性，越小越强调多样性
+        "when_loading": "wait",  # 索引加载中收到消息：wait = 等待（有超时）| skip = 直接回答
+        "wait_timeout_s": 20
+    },
+    "memory": {
+        "enabled": True,  # 对话写入 src/memory/conversation.db，并召回相关的旧对话
+        "recall_top_n": 2,  # 每轮放入提示词的旧对话段数
+        "recall_timeout_ms": 50,  # 召回超时直接跳过，不拖慢回复
+        "embed_turns": False,  # 为每轮对话计算向量，召回时与全文检索融合排序
+        "batch_size": 32,  # 写线程攒够这么多条就提交
+        "flush_interval_s": 2.0  # 或距第一条未提交记录超过这么久就提交
+    },
+    "summary": {
+        "enabled": True,  # 挤出历史的旧对话在后台压缩成滚动摘要
+        "keep_rounds": 3,  # 开启摘要时原样保留的最近轮数（不超过 llm.history_rounds）
+        "max_chars": 300,  # 摘要长度上限（字）
+        "max_tokens": 400,  # 摘要请求的 max_tokens
+        "model": ""  # 摘要用的模型，留空与对话相同
+    },
+    "tracing": {
+        "enabled": True,  # 对话 / 屏幕观察按阶段计时，写入 logs/traces.jsonl
+        "path": "logs/traces.jsonl",
+        "max_bytes": 2097152,  # 单个文件上限，超过后轮转
+        "backup_count": 3,  # 保留的旧文件数
+        "exporter": "jsonl",  # jsonl | otlp（同时导出到 OpenTelemetry，需要 opentelemetry-sdk）
+        "otlp_endpoint": "",  # 留空 = OTLP gRPC 默认地址 localhost:4317
+        "recent": 300  # 设置对话框汇总的最近 trace 条数
+    },
+    "network": {
+        "connect_timeout_s": 10,
+        "read_timeout_s": 120,
+        "pool_maxsize": 4,
+        "http2": False  # 需要安装 httpx 与 h2
     }
 }
 
@@ -0,0 +1,306 @@
+# src/tracing.py
+"""
+管线分段计时（对话 / 屏幕观察）
+- 一次用户能感知到的操作是一条 trace（chat / screen_observe），其中每个阶段是一个 span：
+  截图、缩放编码、Base64 编码、视觉模型请求、检索、提示词组装、LLM 请求（含首字延迟）
+- span 可以带属性：载荷字节数、token 数、端点等；阶段抛出异常时记为 error 并附上错误信息
+- trace 结束时整条写入本地 JSONL（按大小轮转）；tracing.exporter = otlp 时同时导出到 OpenTelemetry
+  （opentelemetry-sdk + OTLP gRPC 导出器，未安装时只写 JSONL）
+- 最近的 trace 保留在内存里（启动时从 JSONL 末尾补齐），设置对话框据此按阶段汇总 p50 / p95
+- 当前 trace / span 存在 contextvars 里；没有进行中的 trace 时 span 只计时、不记录。
+  对冲请求等在其他线程里完成的工作，由调用线程的 span 通过闭包写入属性
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from utils import resource_path
+
+_TAIL_BYTES = 256 * 1024  # 启动时从 JSONL 末尾读回最近 trace 的字节数上限
+
+
+class Span:
+    __slots__ = ("name", "parent", "start", "end", "attrs", "status")
+
+    def __init__(self, name: str, parent: "Span | None", attrs: dict):
+        self.name = name
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        self.attrs = dict(attrs)
+        self.status = "ok"
+
+    def set(self, **attrs):
+        """补充属性（载荷大小、token 数等）；可以在其他线程里调用"""
+        self.attrs.update(attrs)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1e3
+
+
+class Trace:
+    def __init__(self, name: str, attrs: dict):
+        self.trace_id = uuid.uuid4().hex
+        self.ts = time.time()
+        self.root = Span(name, None, attrs)
+        self.spans: list[Span] = [self.root]
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def epoch_ns(self, t: float) -> int:
+        """perf_counter 时刻 → Unix 纳秒时间戳（OpenTelemetry 导出用）"""
+        return int((self.ts + (t - self.root.start)) * 1e9)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans[1:])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "ts": round(self.ts, 3),
+            "duration_ms": round(self.root.duration_ms, 2),
+            "status": self.root.status,
+            "attrs": self.root.attrs,
+            "spans": [
+                {
+                    "name": s.name,
+                    "parent": s.parent.name if s.parent is not None else None,
+                    "start_ms": round((s.start - self.root.start) * 1e3, 2),
+                    "duration_ms": round(s.duration_ms, 2),
+                    "status": s.status,
+                    "attrs": s.attrs,
+                }
+                for s in spans
+            ],
+        }
+
+
+_current: ContextVar[tuple[Trace, Span] | None] = ContextVar("pipeline_trace", default=None)
+
+
+class Tracer:
+    def __init__(self, settings_manager=None):
+        self.sm = settings_manager
+        self._lock = threading.Lock()
+        self._recent: deque[dict] | None = None
+        self._logger: logging.Logger | None = None
+        self._otel = None
+        self._otel_checked = False
+
+    def _get(self, key: str, default):
+        return self.sm.get("tracing", key, default=default) if self.sm is not None else default
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._get("enabled", True))
+
+    @property
+    def path(self) -> Path:
+        return Path(resource_path(self._get("path", "logs/traces.jsonl")))
+
+    # ---------- 记录 ----------
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """开始一条 trace，产出根 span；已有进行中的 trace 时退化为其中的一个 span"""
+        if _current.get() is not None or not self.enabled:
+            with self.span(name, **attrs) as span:
+                yield span
+            return
+        trace = Trace(name, attrs)
+        token = _current.set((trace, trace.root))
+        try:
+            yield trace.root
+        except BaseException as e:
+            trace.root.status = "error"
+            trace.root.attrs["error"] = str(e)[:200]
+            raise
+        finally:
+            trace.root.end = time.perf_counter()
+            _current.reset(token)
+            self._finish(trace)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """当前 trace 中的一个阶段；嵌套使用时记录父子关系"""
+        current = _current.get()
+        span = Span(name, current[1] if current else None, attrs)
+        if current is None:
+            # 不在 trace 里：照常计时（调用方可能读取 duration_ms），但不记录
+            try:
+                yield span
+            finally:
+                span.end = time.perf_counter()
+            return
+        trace = current[0]
+        trace.add(span)
+        token = _current.set((trace, span))
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attrs["error"] = str(e)[:200]
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current.reset(token)
+
+    def current_span(self) -> Span | None:
+        current = _current.get()
+        return current[1] if current else None
+
+    def _finish(self, trace: Trace):
+        record = trace.to_dict()
+        with self._lock:
+            self._recent_buffer().append(record)
+        try:
+            self._get_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+        except Exception as e:
+            print(f"[Tracing] 写入 trace 失败：{e}")
+        if self._get("exporter", "jsonl") == "otlp":
+            self._export_otel(trace)
+
+    def _get_logger(self) -> logging.Logger:
+        if self._logger is None:
+            path = self.path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=int(self._get("max_bytes", 2 * 1024 * 1024)),
+                backupCount=int(self._get("backup_count", 3)),
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("desktop_pet.traces")
+            logger.handlers = [handler]
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            self._logger = logger
+        return self._logger
+
+    # ---------- OpenTelemetry ----------
+    def _get_otel(self):
+        """按需初始化 OTLP 导出；没有安装 opentelemetry-sdk 时返回 None（只提示一次）"""
+        if self._otel_checked:
+            return self._otel
+        self._otel_checked = True
+        try:
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError:
+            print("[Tracing] 未安装 opentelemetry-sdk / OTLP 导出器，trace 只写入本地 JSONL")
+            return None
+        endpoint = self._get("otlp_endpoint", "") or None
+        provider = TracerProvider(resource=Resource.create({"service.name": "indra-desktop-pet"}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        atexit.register(provider.shutdown)
+        self._otel = provider.get_tracer("desktop_pet.pipeline")
+        return self._otel
+
+    def _export_otel(self, trace: Trace):
+        otel = self._get_otel()
+        if otel is None:
+            return
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.trace import Status, StatusCode
+
+        def attributes(attrs: dict) -> dict:
+            return {k: v for k, v in attrs.items() if isinstance(v, (str, bool, int, float))}
+
+        exported: dict[int, object] = {}
+        try:
+            with trace._lock:
+                spans = list(trace.spans)
+            # spans 按开始顺序排列，父 span 总在子 span 之前
+            for span in spans:
+                parent = exported.get(id(span.parent)) if span.parent is not None else None
+                context = otel_trace.set_span_in_context(parent) if parent is not None else None
+                otel_span = otel.start_span(span.name, context=context, attributes=attributes(span.attrs),
+                                            start_time=trace.epoch_ns(span.start))
+                if span.status == "error":
+                    otel_span.set_status(Status(StatusCode.ERROR, span.attrs.get("error", "")))
+                exported[id(span)] = otel_span
+            for span in reversed(spans):
+                exported[id(span)].end(end_time=trace.epoch_ns(span.end or span.start))
+        except Exception as e:
+            print(f"[Tracing] 导出 OpenTelemetry 失败：{e}")
+
+    # ---------- 查看 ----------
+    def _recent_buffer(self) -> deque:
+        """调用方需持有 _lock；第一次用到时从 JSONL 末尾读回上次运行留下的 trace"""
+        if self._recent is None:
+            self._recent = deque(maxlen=int(self._get("recent", 300)))
+            try:
+                with open(self.path, "rb") as f:
+                    start = max(0, f.seek(0, 2) - _TAIL_BYTES)
+                    f.seek(start)
+                    lines = f.read().splitlines()
+                if start > 0:
+                    lines = lines[1:]  # 第一行可能只读到一半
+            except OSError:
+                lines = []
+            for line in lines:
+                try:
+                    self._recent.append(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+        return self._recent
+
+    def recent(self) -> list[dict]:
+        with self._lock:
+            return list(self._recent_buffer())
+
+    def summary(self) -> list[dict]:
+        """按（流程, 阶段）汇总最近的 trace：次数、错误数、p50 / p95 / 最大耗时、数值属性的平均值"""
+        groups: dict[tuple[str, str], dict] = {}
+        for record in self.recent():
+            rows = [("（总计）", record)] + [(s["name"], s) for s in record.get("spans", [])]
+            for stage, item in rows:
+                group = groups.setdefault((record["name"], stage), {"durations": [], "errors": 0, "attrs": {}})
+                group["durations"].append(item["duration_ms"])
+                group["errors"] += item.get("status") == "error"
+                for key, value in (item.get("attrs") or {}).items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        group["attrs"].setdefault(key, []).append(value)
+        summary = []
+        for (flow, stage), group in groups.items():
+            durations = sorted(group["durations"])
+            summary.append({
+                "flow": flow,
+                "stage": stage,
+                "count": len(durations),
+                "errors": group["errors"],
+                "p50_ms": durations[len(durations) // 2],
+                "p95_ms": durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+                "max_ms": durations[-1],
+                "attrs": {k: sum(v) / len(v) for k, v in group["attrs"].items()},
+            })
+        return summary
+
+
+_shared_tracer: Tracer | None = None
+_shared_lock = threading.Lock()
+
+
+def get_tracer(settings_manager=None) -> Tracer:
+    """获取进程内共享的 Tracer（首次调用时传入的 settings_manager 生效）"""
+    global _shared_tracer
+    with _shared_lock:
+        if _shared_tracer is None:
+            _shared_tracer = Tracer(settings_manager)
+        elif settings_manager is not None and _shared_tracer.sm is None:
+            _shared_tracer.sm = settings_manager
+        return _shared_tracer
@@ -1,38 +1,56 @@
 import base64
-import requests
 from pathlib import Path
 from utils import resource_path
+from http_transport import get_transport
+from tracing import get_tracer
+
+_MIME_BY_SUFFIX = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
 
 class QwenVisionClient:
-    def __init__(self, api_url: str, api_key: str, model: str):
+    def __init__(self, api_url: str, api_key: str, model: str, transport=None):
         self.api_url = api_url
         self.api_key = api_key
         self.model = model
+        # 与 ChatManager 共享连接池，定时截图不必每次重新握手
+        self.transport = transport or get_transport()
+        self.tracer = get_tracer()
 
     def describe_image(self, image_path: Path) -> str:
         """
-        将截图发送给 Qwen 视觉模型，返回文字概括
+        将磁盘上的截图发送给 Qwen 视觉模型，返回文字概括
         """
         # 调整：统一处理图片路径
         abs_image_path = Path(resource_path(str(image_path)))
-        image_b64 = self._encode_image(abs_image_path)
+        data = abs_image_path.read_bytes()
+        mime = _MIME_BY_SUFFIX.get(abs_image_path.suffix.lower(), "image/png")
+        return self.describe_image_bytes(data, mime)
 
+    def describe_image_bytes(self, data: bytes, mime: str = "image/jpeg") -> str:
+        """
+        将内存中已编码好的截图直接发送给视觉模型，不经过磁盘
+        """
+        return self.describe_images([(data, mime)])
+
+    def describe_images(self, images: list[tuple[bytes, str]]) -> str:
+        """
+        一次请求发送多张截图（ScreenObserver.observe_once 的结果，tiles 模式下每块屏幕一张），返回文字概括
+        images: [(图片字节, MIME), ...]
+        """
+        with self.tracer.span("vision_encode") as span:
+            urls = [f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}" for data, mime in images]
+            upload_bytes = sum(len(url) for url in urls)
+            span.set(b64_bytes=upload_bytes, images=len(urls))
+
+        prompt = "请客观、简要地描述这张屏幕截图的内容，描述用户此时可能在做什么，如果看到视频和游戏窗口，将一部分重点放在视频和游戏窗口的描述上。回答字数控制在200字以内不要分段。"
+        if len(urls) > 1:
+            prompt = f"以下 {len(urls)} 张截图分别是用户每块显示器的画面，把它们当作同一时刻的整个桌面来看。" + prompt.replace("这张", "这些")
         payload = {
             "model": self.model,
             "messages": [
                 {
                     "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "请客观、简要地描述这张屏幕截图的内容，描述用户此时可能在做什么，如果看到视频和游戏窗口，将一部分重点放在视频和游戏窗口的描述上。回答字数控制在200字以内不要分段。"
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{image_b64}"
-                            }
-                        }
+                    "content": [{"type": "text", "text": prompt}] + [
+                        {"type": "image_url", "image_url": {"url": url}} for url in urls
                     ]
                 }
             ],
@@ -46,13 +64,11 @@ class QwenVisionClient:
             "Content-Type": "application/json"
         }
 
-        resp = requests.post(self.api_url, json=payload, headers=headers, timeout=120)
-        resp.raise_for_status()
-
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
-
-    @staticmethod
-    def _encode_image(path: Path) -> str:
-        with open(path, "rb") as f:
-            return base64.b64encode(f.read()).decode("utf-8")
+        with self.tracer.span("vision_request", model=self.model, upload_bytes=upload_bytes) as span:
+            data = self.transport.post_json(self.api_url, headers, payload)
+            description = data["choices"][0]["message"]["content"]
+            usage = data.get("usage") or {}
+            span.set(prompt_tokens=int(usage.get("prompt_tokens") or 0),
+                     completion_tokens=int(usage.get("completion_tokens") or 0),
+                     reply_chars=len(description or ""))
+        return description
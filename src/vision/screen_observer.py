@@ -1,9 +1,131 @@
+import io
+import sys
 import time
 from pathlib import Path
+from typing import NamedTuple
 import mss
 from PIL import Image
 from PySide6.QtCore import Qt
+from PySide6.QtGui import QCursor
 from utils import resource_path
+from tracing import get_tracer
+
+# vision.capture_mode 可选值
+CAPTURE_MODES = ("pet_monitor", "cursor_monitor", "active_window", "tiles", "all")
+_MIN_WINDOW_EDGE = 64  # 前台窗口比这还小（或已最小化）时退回截光标所在的屏幕
+
+_FORMATS = {  # vision.image_format → (Pillow 格式, MIME, 扩展名)
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "png": ("PNG", "image/png", "png"),
+}
+
+
+class Screenshot(NamedTuple):
+    data: bytes                    # 编码后的图片，直接交给视觉模型
+    mime: str                      # image/jpeg | image/webp | image/png
+    size: tuple[int, int]          # 编码后的宽高
+    source_size: tuple[int, int]   # 原始截图的宽高
+    path: Path | None = None       # 开启 vision.save_screenshots 时的落盘路径（调试用）
+
+
+def frame_to_image(raw) -> Image.Image:
+    """mss 的 BGRA 帧 → RGB 图像；直接按 BGRX 解码原始缓冲区，不经过 raw.rgb 的逐像素转换"""
+    return Image.frombuffer("RGB", raw.size, raw.bgra, "raw", "BGRX", 0, 1)
+
+
+def encode_screenshot(img: Image.Image, max_edge: int = 1568, fmt: str = "jpeg",
+                      quality: int = 80) -> tuple[bytes, str, tuple[int, int]]:
+    """
+    长边缩到 max_edge 以内（0 = 不缩放）后在内存中编码，返回 (图片字节, MIME, 宽高)
+    视觉模型内部本来就会把大图缩小，上传原尺寸只会多花编码、上传时间和 token
+    """
+    if max_edge > 0 and max(img.size) > max_edge:
+        scale = max_edge / max(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        # reducing_gap：先按整数倍快速盒式缩小，再做一次双线性插值
+        img = img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    pil_format, mime, _ = _FORMATS.get(fmt, _FORMATS["jpeg"])
+    buf = io.BytesIO()
+    if pil_format == "JPEG":
+        img.save(buf, "JPEG", quality=quality)
+    elif pil_format == "WEBP":
+        img.save(buf, "WEBP", quality=quality, method=2)
+    else:
+        img.save(buf, "PNG", compress_level=1)
+    return buf.getvalue(), mime, img.size
+
+
+def _contains(monitor: dict, point: tuple[int, int]) -> bool:
+    x, y = point
+    return (monitor["left"] <= x < monitor["left"] + monitor["width"]
+            and monitor["top"] <= y < monitor["top"] + monitor["height"])
+
+
+def _clip(rect: dict, bounds: dict) -> dict | None:
+    left, top = max(rect["left"], bounds["left"]), max(rect["top"], bounds["top"])
+    right = min(rect["left"] + rect["width"], bounds["left"] + bounds["width"])
+    bottom = min(rect["top"] + rect["height"], bounds["top"] + bounds["height"])
+    if right - left < _MIN_WINDOW_EDGE or bottom - top < _MIN_WINDOW_EDGE:
+        return None
+    return {"left": left, "top": top, "width": right - left, "height": bottom - top}
+
+
+def select_regions(mode: str, monitors: list[dict], pet_point: tuple[int, int] | None = None,
+                   cursor_point: tuple[int, int] | None = None,
+                   window_rect: dict | None = None) -> tuple[str, list[dict]]:
+    """
+    按截图模式挑出要截的区域，返回 (实际生效的模式, 区域列表)
+    monitors 是 mss 的 sct.monitors：[0] 为所有屏幕的外接矩形，其后是每块屏幕
+    - pet_monitor / cursor_monitor：桌宠 / 光标所在的那块屏幕
+    - active_window：前台窗口（裁到桌面范围内）；拿不到时退回 cursor_monitor
+    - tiles：每块屏幕各截一张，省掉外接矩形里错位屏幕之间的黑边
+    - all：所有屏幕的外接矩形（旧行为）
+    Qt 的逻辑坐标和 mss 的物理坐标共享每块屏幕的左上角，缩放只会让逻辑区域变小，
+    所以逻辑坐标下的点仍落在同一块屏幕的物理区域里，可以直接拿来判断
+    """
+    screens = monitors[1:] or monitors[:1]
+    if mode == "all":
+        return mode, [monitors[0]]
+    if mode == "tiles":
+        return mode, list(screens)
+    if mode == "active_window":
+        region = _clip(window_rect, monitors[0]) if window_rect else None
+        if region is not None:
+            return mode, [region]
+        mode = "cursor_monitor"
+    point = cursor_point if mode == "cursor_monitor" else pet_point
+    if mode not in CAPTURE_MODES:
+        mode = "pet_monitor"
+    for monitor in screens:
+        if point is not None and _contains(monitor, point):
+            return mode, [monitor]
+    return mode, [screens[0]]
+
+
+def foreground_window_rect(exclude_hwnd: int | None = None) -> dict | None:
+    """
+    前台窗口的屏幕区域（物理像素，与 mss 一致；mss 已把进程设为 DPI 感知）
+    目前只支持 Windows；其他平台、拿不到或前台就是桌宠自己时返回 None
+    """
+    if sys.platform != "win32":
+        return None
+    import ctypes
+    from ctypes import wintypes
+
+    user32 = ctypes.windll.user32
+    hwnd = user32.GetForegroundWindow()
+    if not hwnd or hwnd == exclude_hwnd or user32.IsIconic(hwnd):
+        return None
+    rect = wintypes.RECT()
+    # DWMWA_EXTENDED_FRAME_BOUNDS：不含 Win10+ 窗口四周看不见的缩放边框
+    if ctypes.windll.dwmapi.DwmGetWindowAttribute(
+            wintypes.HWND(hwnd), 9, ctypes.byref(rect), ctypes.sizeof(rect)) != 0:
+        if not user32.GetWindowRect(hwnd, ctypes.byref(rect)):
+            return None
+    return {"left": rect.left, "top": rect.top,
+            "width": rect.right - rect.left, "height": rect.bottom - rect.top}
+
 
 class ScreenObserver:
     def __init__(self, pet_window, settings_manager):
@@ -16,19 +138,24 @@ class ScreenObserver:
 
         # 调整：统一使用resource_path处理截图保存目录
         self.output_dir = Path(resource_path("screenshots"))
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.tracer = get_tracer(settings_manager)
 
-    def observe_once(self):
+    def observe_once(self) -> list[Screenshot]:
         """
         手动触发一次屏幕观察：
-        截图 -> 保存 -> 自动清理旧截图
+        按 vision.capture_mode 选区域截图 -> 缩放 + 内存中编码（-> 可选：保存到 screenshots/ 并清理旧截图）
+        tiles 模式每块屏幕一张，其余模式只有一张
         """
         print("[ScreenObserver] 开始截图")
+        mode = str(self.sm.get("vision", "capture_mode", default="pet_monitor")).lower()
 
-        # 保存原始状态
+        # 保存原始状态；桌宠 / 光标 / 前台窗口的位置要在隐藏桌宠之前取
         old_opacity = self.pet_window.windowOpacity()
         old_mouse_transparent = self.pet_window.testAttribute(Qt.WA_TransparentForMouseEvents)
-        
+        pet_center = self.pet_window.frameGeometry().center()
+        cursor = QCursor.pos()
+        window_rect = foreground_window_rect(int(self.pet_window.winId())) if mode == "active_window" else None
+
         try:
             # ===== 1️⃣ 临时隐藏桌宠 =====
             self.pet_window.setWindowOpacity(0.0)
@@ -39,31 +166,61 @@ class ScreenObserver:
             time.sleep(0.02)
 
             # ===== 2️⃣ 截图 =====
-            with mss.mss() as sct:
-                monitor = sct.monitors[0]  # 0 = 所有屏幕
-                raw_img = sct.grab(monitor)
-
-                img = Image.frombytes(
-                    "RGB",
-                    raw_img.size,
-                    raw_img.rgb
+            with self.tracer.span("capture") as span, mss.mss() as sct:
+                desktop = sct.monitors[0]  # 0 = 所有屏幕
+                mode, regions = select_regions(
+                    mode, sct.monitors,
+                    pet_point=(pet_center.x(), pet_center.y()),
+                    cursor_point=(cursor.x(), cursor.y()),
+                    window_rect=window_rect,
                 )
-
-            # ===== 3️⃣ 保存 =====
-            ts = time.strftime("%Y%m%d_%H%M%S")
-            path = self.output_dir / f"screen_{ts}.png"
-            img.save(path)
-
-            print(f"[ScreenObserver] 截图完成：{path}")
-
-            # ===== 5️⃣ 自动清理旧截图 =====
-            self._cleanup_old_screenshots()
+                raw_imgs = [sct.grab(region) for region in regions]
+                pixels = sum(raw.width * raw.height for raw in raw_imgs)
+                # 与截全部屏幕相比省下多少像素，在设置 → 性能里按模式对比
+                span.set(mode=mode, regions=len(raw_imgs), pixels=pixels,
+                         desktop_pixels=desktop["width"] * desktop["height"])
         finally:
-            # ===== 4️⃣ 恢复桌宠（无论是否异常都执行）=====
+            # ===== 3️⃣ 恢复桌宠（无论是否异常都执行；编码不需要桌宠隐藏着）=====
             self.pet_window.setWindowOpacity(old_opacity)
             self.pet_window.setAttribute(Qt.WA_TransparentForMouseEvents, old_mouse_transparent)
             self.pet_window.repaint()  # 强制重绘，避免界面卡顿
-        return path  # 👈 给 Qwen 用
+
+        # ===== 4️⃣ 缩放 + 编码（全程在内存里，不落盘）=====
+        fmt = str(self.sm.get("vision", "image_format", default="jpeg")).lower()
+        shots = []
+        with self.tracer.span("image_encode", format=fmt) as span:
+            for raw_img in raw_imgs:
+                data, mime, size = encode_screenshot(
+                    frame_to_image(raw_img),
+                    max_edge=int(self.sm.get("vision", "max_edge", default=1568)),
+                    fmt=fmt,
+                    quality=int(self.sm.get("vision", "image_quality", default=80)),
+                )
+                shots.append(Screenshot(data, mime, size, tuple(raw_img.size)))
+            span.set(image_bytes=sum(len(s.data) for s in shots),
+                     out_pixels=sum(s.size[0] * s.size[1] for s in shots))
+        for shot in shots:
+            print(f"[ScreenObserver] 截图完成（{mode}）：{shot.source_size[0]}x{shot.source_size[1]} → "
+                  f"{shot.size[0]}x{shot.size[1]}，{shot.mime}，{len(shot.data) / 1024:.0f} KB")
+
+        # ===== 5️⃣ 可选：保存一份用于调试，并自动清理旧截图 =====
+        if self.sm.get("vision", "save_screenshots", default=False):
+            shots = [shot._replace(path=self._save(shot, i)) for i, shot in enumerate(shots)]
+        return shots
+
+    def _save(self, shot: Screenshot, index: int = 0) -> Path | None:
+        ext = next((e for _, m, e in _FORMATS.values() if m == shot.mime), "img")
+        ts = time.strftime("%Y%m%d_%H%M%S")
+        suffix = f"_{index}" if index else ""
+        path = self.output_dir / f"screen_{ts}{suffix}.{ext}"
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(shot.data)
+        except OSError as e:
+            print(f"[ScreenObserver] 保存截图失败：{e}")
+            return None
+        self._cleanup_old_screenshots()
+        return path
 
     def _cleanup_old_screenshots(self):
         """
@@ -85,7 +242,7 @@ class ScreenObserver:
             return
 
         screenshots = sorted(
-            self.output_dir.glob("screen_*.png"),
+            self.output_dir.glob("screen_*.*"),
             key=lambda p: p.stat().st_mtime
         )
 